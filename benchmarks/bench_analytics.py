@@ -0,0 +1,107 @@
+# Per section price stats of a season of snapshots, row by row vs analytics.py
+#
+# Writes --events x --snapshots snapshot CSVs of --listings listings each in the usual
+# output/[spider]/[file_timestamp]/[YYYYMMDD].csv layout of a temporary folder, then computes the
+# min / p10 / median / p90 price and # of listings per (section, quantity) of every snapshot:
+#   rows     csv.DictReader, a Decimal per price and statistics.quantiles per group,
+#            like the pandas-free scripts over the CSVs
+#   numpy    analytics.section_stats without a cache
+#   cold     analytics.section_stats filling an empty cache
+#   cached   analytics.section_stats again, every snapshot read from the cache
+# and checks that every method found the same stats.
+#
+# Run from the root of the repo:
+#   python benchmarks/bench_analytics.py [--events 81] [--snapshots 20] [--listings 1000]
+
+import sys
+import csv
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+from statistics import quantiles
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "secondary_tix"))
+
+import numpy as np
+from secondary_tix import analytics
+from secondary_tix.items import EVENT_LISTING_HEADERS
+
+SPIDER_NAME = "gametime"
+
+
+def write_season(directory: Path, events: int, snapshots: int, listings: int):
+    random.seed(7)
+    for snapshot in range(snapshots):
+        run_directory = directory / f"output/{SPIDER_NAME}/2023{snapshot // 28 + 4:02d}{snapshot % 28 + 1:02d}1200"
+        run_directory.mkdir(parents=True)
+        for event in range(events):
+            event_date = f"2023-{event // 28 + 4:02d}-{event % 28 + 1:02d}"
+            with open(run_directory / f"{event_date.replace('-', '')}.csv", "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(EVENT_LISTING_HEADERS)
+                for _ in range(listings):
+                    writer.writerow([
+                        event_date, "Dodgers", f"Section {random.randint(100, 160)}", str(random.randint(1, 30)),
+                        random.choice((1, 2, 4)), f"{random.uniform(15, 900):.2f}", "2023-04-01 12:00:00",
+                    ])
+
+
+def row_by_row(paths: list) -> list[tuple]:
+    stats = []
+    for path in paths:
+        groups = {}
+        with open(path, newline="") as file:
+            for row in csv.DictReader(file):
+                groups.setdefault((row["section"], int(row["quantity"])), []).append(Decimal(row["price"]))
+        for (section, quantity), prices in sorted(groups.items()):
+            prices.sort()
+            if len(prices) > 1:
+                deciles = quantiles(prices, n=10, method="inclusive")
+                p10, p90 = deciles[0], deciles[-1]
+            else:
+                p10 = p90 = prices[0]
+            median = quantiles(prices, n=2, method="inclusive")[0] if len(prices) > 1 else prices[0]
+            stats.append((path.parent.name, section, quantity, len(prices), prices[0], p10, median, p90))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Season price stats, row by row vs vectorized")
+    parser.add_argument("--events", type=int, default=81, help="# of events")
+    parser.add_argument("--snapshots", type=int, default=20, help="# of snapshots of every event")
+    parser.add_argument("--listings", type=int, default=1000, help="# of listings per snapshot")
+    args = parser.parse_args()
+
+    directory = Path(tempfile.mkdtemp(prefix="bench_analytics_"))
+    cache_directory = directory / "output/cache/analytics"
+    try:
+        write_season(directory, args.events, args.snapshots, args.listings)
+        paths = analytics.snapshot_paths(directory, SPIDER_NAME)
+        print(f"{len(paths)} snapshots, {len(paths) * args.listings:,} listings")
+
+        results = {}
+        start = time.perf_counter()
+        results["rows"] = row_by_row(paths)
+        timings = {"rows": time.perf_counter() - start}
+        for mode, cache in (("numpy", None), ("cold", cache_directory), ("cached", cache_directory)):
+            start = time.perf_counter()
+            results[mode] = analytics.section_stats(paths, directory, cache)
+            timings[mode] = time.perf_counter() - start
+
+        expected = np.array([row[3:] for row in results["rows"]], dtype=np.float64)
+        for mode in ("numpy", "cold", "cached"):
+            found = np.array([row[4:] for row in results[mode].rows()], dtype=np.float64)
+            assert found.shape == expected.shape and np.allclose(found, expected), f"{mode} stats differ"
+
+        for mode, seconds in timings.items():
+            print(f"  {mode:<7} {seconds:>7.2f}s  {timings['rows'] / seconds:>6.1f}x")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
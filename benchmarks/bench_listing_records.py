@@ -0,0 +1,115 @@
+# Microbenchmark of the per-listing work in the parse hot loops
+#
+# Compares building scrapy.Item listings with a strptime/strftime round trip per row
+# (how both spiders used to do it) against the ListingRecord path the spiders use now.
+#
+# Run from the root of the repo:
+#   python benchmarks/bench_listing_records.py [# of listings]
+
+import sys
+import json
+import time
+import logging
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "secondary_tix"))
+
+from secondary_tix.items import EventListing, EventListingGametime
+from secondary_tix.spiders.gametime import GametimeSpider
+from secondary_tix.spiders.vivid import VividSpider
+
+
+def gametime_rows(n: int) -> list[tuple[str, str]]:
+    return [(f"Section {100 + i % 50}, Row {i % 30}", f"${1000 + i:,}/ea") for i in range(n)]
+
+
+def vivid_body(n: int) -> str:
+    tickets = [
+        {"i": str(i), "s": str(100 + i % 50), "r": str(i % 30), "q": str(1 + i % 4), "p": f"{50 + i % 300}.00"}
+        for i in range(n)
+    ]
+    return json.dumps({"tickets": tickets})
+
+
+def gametime_before(listing_rows, quantity, event_date, opponent):
+    all_listings = []
+    for section_row, price in listing_rows:
+        section = section_row.split(",")[0].strip()
+        row = section_row.split(",")[1].replace("Row","").strip()
+        price = price.replace("/ea","").replace("$","").replace(",","")
+        event_listing = EventListingGametime()
+        event_listing["event_date"] = event_date
+        event_listing["opponent"] = opponent
+        event_listing["section"] = section
+        event_listing["row"] = row
+        event_listing["quantity"] = quantity
+        event_listing["price"] = price
+        event_listing["listing_valid_as_of"] = datetime.strptime(datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+        all_listings.append(event_listing)
+    return all_listings
+
+
+def vivid_before(response, event_date, opponent):
+    all_listings = []
+    for ticket in response.json()["tickets"]:
+        event_listing = EventListing()
+        event_listing["event_date"] = event_date
+        event_listing["opponent"] = opponent
+        event_listing["section"] = ticket["s"]
+        event_listing["row"] = ticket["r"]
+        event_listing["quantity"] = ticket["q"]
+        event_listing["price"] = ticket["p"]
+        event_listing["listing_valid_as_of"] = datetime.strptime(datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+        all_listings.append(event_listing)
+    return all_listings
+
+
+def rows_per_second(func, n: int, repeat: int=5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return n / best
+
+
+def main(n: int):
+    # Only measure the record building, not the log lines
+    logging.disable(logging.CRITICAL)
+
+    gametime = GametimeSpider(team="dodgers", event_date="2023-07-29")
+    vivid = VividSpider()
+    rows = gametime_rows(n)
+    response = FakeResponse(
+        vivid_body(n),
+        {"event_date": "2023-07-29", "event_title": "Giants at Dodgers"},
+    )
+
+    results = [
+        ("gametime before", rows_per_second(lambda: gametime_before(rows, "2", "2023-07-29", "Giants"), n)),
+        ("gametime after", rows_per_second(lambda: gametime.parse_listings(rows, "2", "2023-07-29", "Giants"), n)),
+        ("vivid before", rows_per_second(lambda: vivid_before(response, "2023-07-29", "Giants"), n)),
+        ("vivid after", rows_per_second(lambda: list(vivid.parse_event_page(response)), n)),
+    ]
+    print(f"{n} listings")
+    for name, rate in results:
+        print(f"  {name:<16} {rate:>12,.0f} rows/s")
+
+
+class FakeResponse:
+    """
+    Just enough of a Response for VividSpider.parse_event_page
+    """
+
+    def __init__(self, text: str, meta: dict):
+        self.text = text
+        self.meta = meta
+        self.flags = []
+
+    def json(self):
+        return json.loads(self.text)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
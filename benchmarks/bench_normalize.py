@@ -0,0 +1,122 @@
+# Cheapest equivalent seat across marketplaces, ListingIndex vs scanning the listings
+#
+# Generates the listings of --events Dodger Stadium games on both marketplaces, Gametime with the
+# display text ("Field Box 12", "Row 5") and Vivid with the codes ("12FD", "5"), and reports:
+#   build    listings/s added to a ListingIndex, like the NormalizedIndexPipeline as items stream in
+#   save     seconds to save both marketplaces and load them back, like the next run
+#   index    seconds for --lookups cheapest-seat lookups in the index
+#   scan     the same lookups scanning every listing and normalizing its section / row,
+#            like a downstream job matching the two marketplaces without the index
+# and checks that both found the same prices.
+#
+# Run from the root of the repo:
+#   python benchmarks/bench_normalize.py [--events 20] [--listings 5000] [--lookups 2000]
+
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "secondary_tix"))
+
+from secondary_tix import normalize
+
+VENUE = "dodger-stadium"
+LEVELS = {"FD": "Field Box", "LG": "Loge Box", "RS": "Reserve", "TD": "Top Deck"}
+
+
+def generate_listings(events: int, listings: int) -> list[tuple[str, dict]]:
+    random.seed(5)
+    generated = []
+    for event in range(events):
+        event_date = f"2099-07-{event % 28 + 1:02d}" if event < 28 else f"2099-08-{event % 28 + 1:02d}"
+        for i in range(listings):
+            code, number, row = random.choice(list(LEVELS)), random.randint(1, 60), random.randint(1, 30)
+            listing = {
+                "event_date": event_date,
+                "quantity": random.choice((1, 2, 4)),
+                "price": round(random.uniform(20, 600), 2),
+                "listing_valid_as_of": "2099-07-01 12:00:00",
+                "home_team": "dodgers",
+                "listing_id": str(i),
+            }
+            if i % 2:
+                generated.append(("gametime", {**listing, "section": f"{LEVELS[code]} {number}", "row": f"Row {row}"}))
+            else:
+                generated.append(("vivid", {**listing, "section": f"{number}{code}", "row": str(row)}))
+    return generated
+
+
+def scan_cheapest(listings: list, event_date: str, section: str, row: str, quantity: int):
+    cheapest = None
+    for _, listing in listings:
+        if (
+            listing["event_date"] == event_date
+            and listing["quantity"] == quantity
+            and normalize.normalize_section(VENUE, listing["section"]) == section
+            and normalize.normalize_row(listing["row"]) == row
+            and (cheapest is None or listing["price"] < cheapest)
+        ):
+            cheapest = listing["price"]
+    return cheapest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cheapest equivalent seat, index vs scan")
+    parser.add_argument("--events", type=int, default=20, help="# of events")
+    parser.add_argument("--listings", type=int, default=5000, help="# of listings per event over both marketplaces")
+    parser.add_argument("--lookups", type=int, default=2000, help="# of cheapest seat lookups")
+    args = parser.parse_args()
+
+    listings = generate_listings(args.events, args.listings)
+    lookups = [
+        (listing["event_date"], listing["section"], listing["row"], listing["quantity"])
+        for _, listing in random.sample(listings, args.lookups)
+    ]
+    print(f"{len(listings):,} listings of {args.events} events, {args.lookups} lookups")
+
+    start = time.perf_counter()
+    index = normalize.ListingIndex()
+    for marketplace, listing in listings:
+        index.add(marketplace, listing)
+    seconds = time.perf_counter() - start
+    print(f"  build   {seconds:>7.3f}s  {len(listings) / seconds:>10,.0f} listings/s  {len(index):,} seats")
+
+    directory = Path(tempfile.mkdtemp(prefix="bench_normalize_"))
+    try:
+        start = time.perf_counter()
+        for marketplace in ("gametime", "vivid"):
+            index.save(directory, marketplace)
+        loaded = normalize.ListingIndex.load(directory)
+        print(f"  save    {time.perf_counter() - start:>7.3f}s  saved and loaded back")
+    finally:
+        shutil.rmtree(directory)
+    assert loaded.offers == index.offers, "loaded index differs"
+
+    start = time.perf_counter()
+    found = [index.cheapest(VENUE, *lookup).price for lookup in lookups]
+    index_seconds = time.perf_counter() - start
+    print(f"  index   {index_seconds:>7.3f}s  {index_seconds / args.lookups * 1e6:>10.1f}us per lookup")
+
+    # The scan is slow, time a sample of the lookups
+    sample = lookups[:max(1, args.lookups // 100)]
+    start = time.perf_counter()
+    scanned = [
+        scan_cheapest(
+            listings, event_date, normalize.normalize_section(VENUE, section), normalize.normalize_row(row), quantity
+        )
+        for event_date, section, row, quantity in sample
+    ]
+    scan_seconds = (time.perf_counter() - start) / len(sample) * args.lookups
+    print(
+        f"  scan    {scan_seconds:>7.3f}s  {scan_seconds / args.lookups * 1e6:>10.1f}us per lookup"
+        f"  ({len(sample)} timed)  {scan_seconds / index_seconds:,.0f}x slower"
+    )
+    assert scanned == found[:len(sample)], "scan and index found different prices"
+
+
+if __name__ == "__main__":
+    main()
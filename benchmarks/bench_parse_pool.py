@@ -0,0 +1,107 @@
+# How long the event loop is blocked by the HTML parsing, inline vs in a ParserPool
+#
+# Parses --pages copies of the 2000 listings Gametime fixture, --concurrency at a time, like
+# several event pages finishing together, while a heartbeat task ticks every 10ms on the same loop.
+# For each parser backend and mode it reports:
+#   total    seconds to parse every page
+#   blocked  seconds the loop spent in the parsing calls (the parse/reactor_blocked_seconds stat)
+#   max lag  longest delay of a heartbeat, how long every other page / download was frozen at once
+#
+# Run from the root of the repo:
+#   python benchmarks/bench_parse_pool.py [--pages 16] [--concurrency 4] [--processes 4]
+
+import sys
+import gzip
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "secondary_tix"))
+
+from secondary_tix.parsers import PARSERS, ParserPool, get_parser
+from secondary_tix.spiders.gametime import GAMES_SECTION, LISTING_SELECTORS
+
+FIXTURE_PATH = Path(__file__).parent / "fixtures" / "gametime_listings_2000.html.gz"
+HEARTBEAT_SECONDS = 0.01
+
+
+async def heartbeat(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        lags.append(time.perf_counter() - start - HEARTBEAT_SECONDS)
+
+
+async def parse_pages(html: str, pages: int, concurrency: int, parse) -> dict:
+    """
+    parse: coroutine function parsing a page, returns the seconds it blocked the loop
+    """
+
+    lags, stop = [], asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    semaphore = asyncio.Semaphore(concurrency)
+    blocked = []
+
+    async def parse_page():
+        async with semaphore:
+            blocked.append(await parse(html))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[parse_page() for _ in range(pages)])
+    total = time.perf_counter() - start
+    stop.set()
+    await beat
+    return {"total": total, "blocked": sum(blocked), "max_lag": max(lags, default=0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event loop blocking of inline vs pooled HTML parsing")
+    parser.add_argument("--pages", type=int, default=16, help="# of pages to parse")
+    parser.add_argument("--concurrency", type=int, default=4, help="pages parsed at once")
+    parser.add_argument("--processes", type=int, default=4, help="processes of the pool")
+    args = parser.parse_args()
+
+    html = gzip.decompress(FIXTURE_PATH.read_bytes()).decode()
+    fields = [LISTING_SELECTORS["section_row"], LISTING_SELECTORS["price"]]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    print(f"{args.pages} pages of {len(html) / 1e6:.1f}MB, {args.concurrency} at a time")
+    print(f"  {'backend':<6} {'mode':<8} {'total':>8} {'blocked':>8} {'max lag':>8}")
+    for name in PARSERS:
+        inline_parser = get_parser(name, GAMES_SECTION, LISTING_SELECTORS["listing"], fields)
+
+        async def parse_inline(page_html):
+            start = time.perf_counter()
+            inline_parser.listings_page(page_html)
+            blocked = time.perf_counter() - start
+            # Back to the loop between pages, like separate callbacks
+            await asyncio.sleep(0)
+            return blocked
+
+        pool = ParserPool(args.processes, name, GAMES_SECTION, LISTING_SELECTORS["listing"], fields)
+        # Start the processes before timing
+        loop.run_until_complete(asyncio.gather(*[
+            pool.run("listings_page", "<html></html>") for _ in range(args.processes)
+        ]))
+
+        async def parse_pooled(page_html):
+            start = time.perf_counter()
+            future = pool.submit("listings_page", page_html)
+            blocked = time.perf_counter() - start
+            await asyncio.wrap_future(future)
+            return blocked
+
+        for mode, parse in (("inline", parse_inline), (f"pool({args.processes})", parse_pooled)):
+            result = loop.run_until_complete(parse_pages(html, args.pages, args.concurrency, parse))
+            print(
+                f"  {name:<6} {mode:<8} {result['total']:>7.2f}s {result['blocked']:>7.3f}s "
+                f"{result['max_lag'] * 1000:>6.0f}ms"
+            )
+        pool.close()
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# Offline benchmark of the parse callbacks
+#
+# Drives the spiders' callbacks with the fixtures in benchmarks/fixtures (see make_fixtures.py)
+# through real Scrapy responses, Gametime pages are served by a FakePage instead of a browser.
+# No network or browser is needed.
+#
+# For each case it reports:
+#   rows/s      items (or requests) produced per second, best of --repeat runs
+#   peak        peak memory allocated while running the case once (tracemalloc)
+#   output      whether the output matches benchmarks/fixtures/expected.json
+#
+# Run from the root of the repo:
+#   python benchmarks/bench_parsers.py                      run every case
+#   python benchmarks/bench_parsers.py vivid_listings       only the cases starting with vivid_listings
+#   python benchmarks/bench_parsers.py --save results.json  save the results
+#   python benchmarks/bench_parsers.py --baseline results.json --tolerance 0.2
+#       fail if a case is more than 20% slower than in results.json
+#   python benchmarks/bench_parsers.py --update-expected    accept the current output as the expected one
+#
+# Exits with 1 if an output changed or a case is slower than the baseline allows
+
+import sys
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "secondary_tix"))
+
+from bs4 import BeautifulSoup
+from itemadapter import ItemAdapter, is_item
+from scrapy import Request
+from scrapy.http import HtmlResponse, TextResponse
+from scrapy.utils.test import get_crawler
+
+from secondary_tix.parsers import PARSERS
+from secondary_tix.spiders.gametime import GametimeSpider
+from secondary_tix.spiders.vivid import VividSpider
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+EXPECTED_PATH = FIXTURES_DIRECTORY / "expected.json"
+
+GAMETIME_LISTING_COUNTS = [20, 200, 2000]
+VIVID_LISTING_COUNTS = [100, 1000, 10000, 100000]
+EVENT_DATE = "2023-07-29"
+EVENT_TITLE = "Giants at Los Angeles Dodgers"
+
+
+def load_fixture(name: str) -> bytes:
+    return gzip.decompress((FIXTURES_DIRECTORY / f"{name}.gz").read_bytes())
+
+
+class FakeLocator:
+    def __init__(self, count: int):
+        self._count = count
+
+    async def count(self) -> int:
+        return self._count
+
+
+class FakePage:
+    """
+    Just enough of a playwright Page for the Gametime callbacks in "soup" mode
+    Every call returns the fixture HTML as if the clicks had already happened
+    """
+
+    def __init__(self, url: str, html: str):
+        self.url = url
+        self.html = html
+
+    async def evaluate(self, script, arg=None):
+        # Only browser.record_page_metrics evaluates a script in "soup" mode
+        return {"bytes": len(self.html), "load_ms": 0, "resources": 0}
+
+    async def content(self) -> str:
+        return self.html
+
+    async def title(self) -> str:
+        return BeautifulSoup(self.html, "html.parser").title.text
+
+    async def query_selector(self, selector):
+        # No SHOW MORE button, the events page is already expanded
+        return None
+
+    def locator(self, selector):
+        return FakeLocator(0)
+
+    async def wait_for_selector(self, selector, **kwargs):
+        pass
+
+    async def wait_for_timeout(self, timeout):
+        pass
+
+    async def click(self, selector, **kwargs):
+        pass
+
+    async def close(self):
+        pass
+
+
+def gametime_response(url: str, html: str) -> HtmlResponse:
+    request = Request(url, meta={"playwright_page": FakePage(url, html)})
+    return HtmlResponse(url, body=b"", encoding="utf-8", request=request)
+
+
+async def collect(output) -> list:
+    return [x async for x in output]
+
+
+def run_callback(loop, output) -> list:
+    """
+    List the output of a callback, sync or async
+    """
+
+    if hasattr(output, "__aiter__"):
+        return loop.run_until_complete(collect(output))
+    return list(output)
+
+
+def fingerprint(output: list) -> str:
+    """
+    sha256 of the output, leaving out what changes from run to run
+        (listing_valid_as_of and run, playwright context names, the year Vivid event dates get from the clock)
+    """
+
+    digest = hashlib.sha256()
+    for x in output:
+        if is_item(x):
+            record = ItemAdapter(x).asdict()
+            record.pop("listing_valid_as_of", None)
+            record.pop("run", None)
+        elif isinstance(x, Request):
+            record = {
+                "url": x.url,
+                "callback": x.callback.__name__,
+                "event_title": x.meta.get("event_title"),
+                "event_month_day": (x.meta.get("event_date") or "")[5:],
+            }
+        else:
+            record = x
+        digest.update(json.dumps(record, sort_keys=True, default=str).encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def build_cases() -> dict:
+    """
+    return: case name -> function that runs the case and returns its output
+    """
+
+    # One spider per HTML parser backend, their output must be the same
+    gametime_spiders = {
+        name: GametimeSpider.from_crawler(
+            get_crawler(GametimeSpider, {"GAMETIME_EXTRACTION_MODE": "soup", "GAMETIME_HTML_PARSER": name}),
+            team="dodgers",
+            event_date=EVENT_DATE,
+        )
+        for name in PARSERS
+    }
+    gametime = gametime_spiders["lxml"]
+    vivid = VividSpider.from_crawler(get_crawler(VividSpider))
+    loop = asyncio.new_event_loop()
+
+    cases = {}
+
+    events_html = load_fixture("gametime_events.html").decode()
+    for name, spider in gametime_spiders.items():
+        cases[f"gametime_events_{name}"] = lambda spider=spider: run_callback(
+            loop, spider.parse_games(gametime_response("https://gametime.co/dodgers-tickets/performers/mlblad", events_html))
+        )
+
+    for n in GAMETIME_LISTING_COUNTS:
+        html = load_fixture(f"gametime_listings_{n}.html").decode()
+        url = f"https://gametime.co/mlb-baseball/giants-at-dodgers-tickets/events/{n}"
+        for name, spider in gametime_spiders.items():
+            cases[f"gametime_listings_{n}_{name}"] = (
+                lambda html=html, url=url, spider=spider: run_callback(loop, spider.parse(gametime_response(url, html)))
+            )
+
+        rows, title = gametime.html_parser().listings_page(html)
+        cases[f"gametime_parse_listings_{n}"] = (
+            lambda rows=rows: gametime.parse_listings(rows, "2", EVENT_DATE, "Giants")
+        )
+
+    for n in GAMETIME_LISTING_COUNTS[-1:]:
+        html = load_fixture(f"gametime_listings_{n}.html").decode()
+        for name, spider in gametime_spiders.items():
+            cases[f"gametime_event_info_{n}_{name}"] = (
+                lambda html=html, spider=spider: [spider.parse_event_title(spider.html_parser().listings_page(html)[1])]
+            )
+
+    schedule_url = "https://www.vividseats.com/los-angeles-dodgers-tickets--sports-mlb-baseball/performer/806"
+    schedule_body = load_fixture("vivid_schedule.html")
+    cases["vivid_schedule"] = lambda: run_callback(
+        loop, vivid.parse(HtmlResponse(schedule_url, body=schedule_body, encoding="utf-8", request=Request(schedule_url)))
+    )
+
+    for n in VIVID_LISTING_COUNTS:
+        body = load_fixture(f"vivid_listings_{n}.json")
+        url = f"https://www.vividseats.com/hermes/api/v1/listings?productionId={4200000 + n}"
+        meta = {"event_date": EVENT_DATE, "event_title": EVENT_TITLE}
+        cases[f"vivid_listings_{n}"] = (
+            lambda body=body, url=url, meta=meta: run_callback(
+                loop,
+                vivid.parse_event_page(
+                    TextResponse(url, body=body, encoding="utf-8", request=Request(url, meta=meta))
+                ),
+            )
+        )
+
+    return cases
+
+
+def measure(run, repeat: int) -> dict:
+    """
+    Run a case once under tracemalloc, then `repeat` times for the timing
+
+    return: # of rows, best rows/s, peak memory in bytes and fingerprint of the output
+    """
+
+    tracemalloc.start()
+    output = run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    return {
+        "rows": len(output),
+        "rows_per_second": len(output) / best if best else 0.0,
+        "seconds": best,
+        "peak_bytes": peak,
+        "sha256": fingerprint(output),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the parse callbacks")
+    parser.add_argument("cases", nargs="*", help="only run the cases starting with one of these")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case, the best one is kept")
+    parser.add_argument("--save", type=Path, help="save the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="results saved with --save to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown vs the baseline")
+    parser.add_argument("--update-expected", action="store_true", help="accept the current output as expected")
+    args = parser.parse_args()
+
+    # Only measure the parsing, not the log lines
+    logging.disable(logging.CRITICAL)
+
+    expected = json.loads(EXPECTED_PATH.read_text()) if EXPECTED_PATH.exists() else {}
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else {}
+
+    cases = build_cases()
+    if args.cases:
+        cases = {name: run for name, run in cases.items() if name.startswith(tuple(args.cases))}
+
+    results, failures = {}, []
+    print(f"{'case':<32} {'rows':>8} {'rows/s':>14} {'peak':>10}  output")
+    for name, run in cases.items():
+        result = results[name] = measure(run, args.repeat)
+
+        if args.update_expected:
+            expected[name] = {"rows": result["rows"], "sha256": result["sha256"]}
+            status = "updated"
+        elif name not in expected:
+            status = "no expected output"
+        elif expected[name] == {"rows": result["rows"], "sha256": result["sha256"]}:
+            status = "ok"
+        else:
+            status = "CHANGED"
+            failures.append(f"{name}: output changed")
+
+        if name in baseline:
+            floor = baseline[name]["rows_per_second"] * (1 - args.tolerance)
+            if result["rows_per_second"] < floor:
+                status += f", SLOWER than baseline ({baseline[name]['rows_per_second']:,.0f} rows/s)"
+                failures.append(f"{name}: slower than baseline")
+
+        print(
+            f"{name:<32} {result['rows']:>8} {result['rows_per_second']:>14,.0f} "
+            f"{result['peak_bytes'] / 1024 / 1024:>8.1f}MB  {status}"
+        )
+
+    if args.update_expected:
+        EXPECTED_PATH.write_text(json.dumps(expected, indent=2, sort_keys=True) + "\n")
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+
+    if failures:
+        print("\n".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# Throughput of the AdaptiveRateController vs the old fixed pacing
+#
+# Starts a local stand-in for the listings API that allows --limit requests per second
+# and answers 429 (Retry-After: 1) above that, then crawls --requests JSON pages twice:
+#   fixed      DOWNLOAD_DELAY / CONCURRENT_REQUESTS_PER_DOMAIN like before the controller
+#   adaptive   the AdaptiveRateController with the ADAPTIVE_RATE_BUDGETS of settings.py
+# All delays are multiplied by --scale so the demo takes seconds instead of minutes
+#
+# Run from the root of the repo:
+#   python benchmarks/bench_rate_controller.py [--requests 60] [--limit 20] [--scale 0.05]
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "secondary_tix"))
+os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "secondary_tix.settings")
+
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """
+    Allows `limit` requests per one second window, 429 for the rest
+    """
+
+    window_start = 0.0
+    window_count = 0
+    limit = 20
+    lock = threading.Lock()
+    served = 0
+    throttled = 0
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            now = time.monotonic()
+            if now - cls.window_start >= 1:
+                cls.window_start, cls.window_count = now, 0
+            cls.window_count += 1
+            allowed = cls.window_count <= cls.limit
+            if allowed:
+                cls.served += 1
+            else:
+                cls.throttled += 1
+
+        if not allowed:
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        time.sleep(0.05)
+        body = json.dumps({"tickets": [{"s": "112", "r": "5", "q": "2", "p": "123.00"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def crawl_settings(mode: str, scale: float) -> dict:
+    settings = get_project_settings()
+    overrides = {
+        "ITEM_PIPELINES": {},
+        "DOWNLOADER_MIDDLEWARES": {"secondary_tix.middlewares.ScrapeOpsFakeUserAgentMiddleware": None},
+        "DOWNLOAD_HANDLERS": {},
+        "INSTRUMENTATION_ENABLED": False,
+        "HTTPCACHE_ENABLED": False,
+        "LOG_LEVEL": "WARNING",
+        "RETRY_TIMES": 10,
+        "RANDOMIZE_DOWNLOAD_DELAY": False,
+    }
+    if mode == "fixed":
+        overrides.update({
+            "ADAPTIVE_RATE_ENABLED": False,
+            "DOWNLOAD_DELAY": settings.getfloat("DOWNLOAD_DELAY") * scale,
+        })
+    else:
+        budgets = settings.getdict("ADAPTIVE_RATE_BUDGETS")
+        overrides["ADAPTIVE_RATE_BUDGETS"] = {
+            name: {
+                **budget,
+                **{k: budget[k] * scale for k in ("start_delay", "min_delay", "max_delay")},
+            }
+            for name, budget in budgets.items()
+        }
+    settings.setdict(overrides, priority="cmdline")
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AdaptiveRateController vs fixed pacing")
+    parser.add_argument("--requests", type=int, default=60, help="# of API pages to crawl")
+    parser.add_argument("--limit", type=int, default=20, help="requests per second the server allows")
+    parser.add_argument("--scale", type=float, default=0.05, help="multiplier of every delay")
+    args = parser.parse_args()
+
+    install_reactor("twisted.internet.asyncioreactor.AsyncioSelectorReactor")
+    import scrapy
+    from scrapy.crawler import CrawlerRunner
+    from twisted.internet import defer, reactor
+
+    ThrottlingHandler.limit = args.limit
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottlingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    class ApiSpider(scrapy.Spider):
+        name = "rate_demo"
+        file_timestamp = "demo"
+
+        def start_requests(self):
+            for i in range(args.requests):
+                yield scrapy.Request(f"{base_url}/listings?i={i}", meta={"request_class": "api"})
+
+        def parse(self, response):
+            yield {"i": response.url}
+
+    results = {}
+
+    @defer.inlineCallbacks
+    def run():
+        for mode in ("fixed", "adaptive"):
+            ThrottlingHandler.served = ThrottlingHandler.throttled = 0
+            runner = CrawlerRunner(crawl_settings(mode, args.scale))
+            crawler = runner.create_crawler(ApiSpider)
+            start = time.perf_counter()
+            yield runner.crawl(crawler)
+            results[mode] = {
+                "seconds": time.perf_counter() - start,
+                "items": crawler.stats.get_value("item_scraped_count", 0),
+                "throttled": ThrottlingHandler.throttled,
+                "stats": {k: v for k, v in crawler.stats.get_stats().items() if k.startswith("adaptive_rate")},
+            }
+        reactor.stop()
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+    server.shutdown()
+
+    print(f"{args.requests} requests, server allows {args.limit}/s, delays scaled by {args.scale}")
+    for mode, result in results.items():
+        print(
+            f"  {mode:<9} {result['seconds']:>7.2f}s  {result['items'] / result['seconds']:>7.1f} items/s  "
+            f"{result['items']} items  {result['throttled']} x 429"
+        )
+    print(f"  speedup   {results['fixed']['seconds'] / results['adaptive']['seconds']:.1f}x")
+    for key, value in sorted(results["adaptive"]["stats"].items()):
+        print(f"    {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
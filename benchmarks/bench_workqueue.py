@@ -0,0 +1,174 @@
+# Throughput of a distributed run vs the # of workers
+#
+# Starts a local stand-in for the event pages that answers after --latency seconds, puts
+# --tasks event tasks in a fresh work queue and crawls them with 1, 2, 4 ... --max-workers
+# worker processes. Each worker crawls one page at a time, like a worker with a single browser,
+# so the throughput should grow about linearly with the # of workers.
+# "crawl" is the longest time a worker's spider was open, "wall" adds the process startups.
+# The listings of every run are merged into output/bench_events/[run]/ of a temporary folder
+# and counted to check that no task was lost or crawled twice.
+#
+# Run from the root of the repo:
+#   python benchmarks/bench_workqueue.py [--tasks 40] [--latency 0.25] [--max-workers 4]
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "secondary_tix"))
+os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "secondary_tix.settings")
+
+from scrapy.utils.project import get_project_settings
+from secondary_tix.workqueue import WorkQueue
+
+LISTINGS_PER_EVENT = 25
+
+
+class SlowEventHandler(BaseHTTPRequestHandler):
+    """
+    Listings JSON of an event after `latency` seconds
+    """
+
+    latency = 0.25
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        body = json.dumps({
+            "tickets": [{"s": "112", "r": str(i), "q": "2", "p": "123.00"} for i in range(LISTINGS_PER_EVENT)]
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_worker(settings_overrides: dict, base_url: str, worker: str, elapsed_path: Path):
+    import scrapy
+    from scrapy.crawler import CrawlerProcess
+    from secondary_tix.items import ListingRecord
+
+    class BenchEventsSpider(scrapy.Spider):
+        name = "bench_events"
+        file_timestamp = None
+
+        def task_request(self, task):
+            return scrapy.Request(f"{base_url}/events/{task['event_id']}", callback=self.parse, meta=task)
+
+        def parse(self, response):
+            for ticket in response.json()["tickets"]:
+                yield ListingRecord(
+                    response.meta["event_date"], "Giants", ticket["s"], ticket["r"], int(ticket["q"]),
+                    ticket["p"], "2023-07-29 19:00:00",
+                )
+
+    settings = get_project_settings()
+    settings.setdict({**settings_overrides, "WORKQUEUE_WORKER": worker}, priority="cmdline")
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawler = process.create_crawler(BenchEventsSpider)
+    process.crawl(crawler)
+    process.start()
+    elapsed_path.write_text(str(crawler.stats.get_value("elapsed_time_seconds")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed run throughput vs # of workers")
+    parser.add_argument("--tasks", type=int, default=40, help="# of event tasks per run")
+    parser.add_argument("--latency", type=float, default=0.25, help="seconds to answer an event page")
+    parser.add_argument("--max-workers", type=int, default=4, help="largest # of workers")
+    args = parser.parse_args()
+
+    SlowEventHandler.latency = args.latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowEventHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    directory = Path(tempfile.mkdtemp(prefix="bench_workqueue_"))
+    queue_path = directory / "workqueue.sqlite"
+
+    worker_counts = []
+    workers = 1
+    while workers <= args.max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+
+    results = {}
+    for workers in worker_counts:
+        run = f"run{workers}"
+        queue = WorkQueue(queue_path, "bench_events")
+        queue.create_run(run)
+        for i in range(args.tasks):
+            queue.put(run, f"event:{i}", {"event_id": str(i), "event_date": f"2023-07-{i % 28 + 1:02d}"})
+        queue.seal(run)
+
+        overrides = {
+            "WORKQUEUE_ROLE": "worker",
+            "WORKQUEUE_PATH": queue_path,
+            "WORKQUEUE_RUN": run,
+            "WORKQUEUE_PREFETCH": 1,
+            "WORKQUEUE_TICK_SECONDS": 0.05,
+            "OUTPUT_DIRECTORY": directory,
+            "ITEM_PIPELINES": {"secondary_tix.pipelines.CsvWriterPipeline": 300},
+            "DOWNLOADER_MIDDLEWARES": {"secondary_tix.middlewares.ScrapeOpsFakeUserAgentMiddleware": None},
+            "CONCURRENT_REQUESTS": 1,
+            "ADAPTIVE_RATE_ENABLED": False,
+            "DOWNLOAD_DELAY": 0,
+            "DOWNLOAD_HANDLERS": {},
+            "INSTRUMENTATION_ENABLED": False,
+            "HTTPCACHE_ENABLED": False,
+            "LOG_QUEUE_ENABLED": False,
+            "LOG_LEVEL": "WARNING",
+        }
+        start = time.perf_counter()
+        processes = [
+            multiprocessing.Process(
+                target=run_worker, args=(overrides, base_url, f"w{i}", directory / f"{run}_w{i}.elapsed")
+            )
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        seconds = time.perf_counter() - start
+
+        run_directory = directory / "output/bench_events" / run
+        rows = 0
+        for path in run_directory.glob("*.csv"):
+            with open(path, newline="") as file:
+                rows += sum(1 for _ in csv.reader(file)) - 1
+        results[workers] = {
+            "seconds": seconds,
+            "crawl_seconds": max(float(x.read_text()) for x in directory.glob(f"{run}_w*.elapsed")),
+            "counts": queue.counts(run),
+            "rows": rows,
+            "parts_left": len(list(run_directory.glob("*.part-*.csv"))),
+        }
+        queue.close()
+
+    server.shutdown()
+    print(f"{args.tasks} tasks, {args.latency}s per event page, one page at a time per worker")
+    base = results[worker_counts[0]]["crawl_seconds"]
+    for workers, result in results.items():
+        expected_rows = args.tasks * LISTINGS_PER_EVENT
+        print(
+            f"  {workers} workers  wall {result['seconds']:>6.2f}s  crawl {result['crawl_seconds']:>6.2f}s  "
+            f"{args.tasks / result['crawl_seconds']:>6.1f} tasks/s  "
+            f"speedup {base / result['crawl_seconds']:.1f}x  done {result['counts']['done']}/{args.tasks}  "
+            f"rows {result['rows']}/{expected_rows}  parts left {result['parts_left']}"
+        )
+    print(f"  output in {directory}")
+
+
+if __name__ == "__main__":
+    main()
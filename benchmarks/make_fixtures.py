@@ -0,0 +1,154 @@
+# Build the fixtures used by bench_parsers.py
+#
+# The pages are generated with the same structure (classes, nesting, text) as the
+# Gametime and Vivid pages the spiders parse, from a fixed seed so every run builds
+# byte-identical files. A page saved from the website can replace any fixture as long
+# as it keeps the same name, then refresh the expected output with
+#   python benchmarks/bench_parsers.py --update-expected
+#
+# Run from the root of the repo:
+#   python benchmarks/make_fixtures.py
+
+import gzip
+import json
+import random
+from pathlib import Path
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+
+GAMETIME_LISTING_COUNTS = [20, 200, 2000]
+VIVID_LISTING_COUNTS = [100, 1000, 10000, 100000]
+# Ticket quantities in the Gametime dropdown
+GAMETIME_QUANTITIES = [1, 2, 4]
+EVENT_TITLE = "Giants at Dodgers - 7/29/23 at 7:10 PM"
+
+OPPONENTS = ["Giants", "Padres", "Rockies", "Diamondbacks", "Cubs", "Mets", "Braves", "Cardinals"]
+
+
+def write(name: str, text: str):
+    # mtime=0 so the gzip header doesn't change between builds
+    with open(FIXTURES_DIRECTORY / f"{name}.gz", "wb") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+            gz.write(text.encode())
+
+
+def gametime_listings_html(n: int, rng: random.Random) -> str:
+    """
+    Event page with the ticket quantity dropdown open and n listings
+    """
+
+    options = "".join(
+        f'<div class="_2dcu_9HNIoUpC8-dQyqvMR" id="{i}">'
+        f'<span class="_7in0Cl45Y3DqI27Uw8KET">{quantity} {"Ticket" if quantity == 1 else "Tickets"}</span></div>'
+        for i, quantity in enumerate(GAMETIME_QUANTITIES, start=1)
+    )
+    listings = []
+    for _ in range(n):
+        section = rng.choice([rng.randint(1, 60), rng.randint(100, 170), rng.randint(200, 260)])
+        row = rng.choice([str(rng.randint(1, 45)), rng.choice("ABCDEFGHJK")])
+        price = rng.randint(9, 4500)
+        listings.append(
+            '<div class="_2h7x6MAQ0R9rPi2f7MFJXo"><a href="#">'
+            '<div class="_1EShqotjRsBqatpuDDtfZ7"><img alt="" src="/seat.png">'
+            f'<span class="_1-M9Q0QPzQQPipMVX0voMp">Section {section}, Row {row}</span></div>'
+            '<div class="_3Vv2t9QWqoFQZYRe16fx9V"><span>Great view</span><span>Zone</span></div>'
+            f'<div class="_1Ez1uMaistdU48Vpp8XeO2"><span>${price:,}/ea</span><small>incl. fees</small></div>'
+            '</a></div>'
+        )
+    return (
+        f"<html><head><title>{EVENT_TITLE}</title></head><body>"
+        '<div class="_3jbsE7bPH2773pyaT0ayCf"><span>Filters</span><button>Qty</button></div>'
+        f'<div class="_1WI7N_Bs_b0gkDH7dzIdkV">{options}</div>'
+        f'<main>{"".join(listings)}</main>'
+        "</body></html>"
+    )
+
+
+def gametime_events_html(rng: random.Random) -> str:
+    """
+    Venue page with the games section fully expanded
+    Concerts and away games are mixed in, like on the website
+    """
+
+    links = []
+    for i in range(180):
+        month, day = 4 + i // 30, 1 + i % 28
+        if i % 5 == 4:
+            slug = f"concert-{i}-tickets"
+            path = f"/concerts/{slug}/{month}-{day}-2023-los-angeles-ca-dodger-stadium/events/{i:024x}"
+        elif i % 2:
+            slug = f"dodgers-at-{rng.choice(OPPONENTS).lower()}-tickets"
+            path = f"/mlb-baseball/{slug}/{month}-{day}-2023-away-city/events/{i:024x}"
+        else:
+            slug = f"{rng.choice(OPPONENTS).lower()}-at-dodgers-tickets"
+            path = f"/mlb-baseball/{slug}/{month}-{day}-2023-los-angeles-ca-dodger-stadium/events/{i:024x}"
+        links.append(f'<a href="{path}"><div><span>{month}/{day}</span><span>{slug}</span></div></a>')
+    # The event the benchmark filters for
+    links.append(
+        '<a href="/mlb-baseball/giants-at-dodgers-tickets/7-29-2023-los-angeles-ca-dodger-stadium/events/64a0">'
+        "<div><span>7/29</span></div></a>"
+    )
+    return (
+        "<html><head><title>Dodger Stadium Tickets</title></head><body>"
+        f'<section class="_2nM98ETTbcRZ87usbOF3tM">{"".join(links)}</section>'
+        "</body></html>"
+    )
+
+
+def vivid_schedule_html(rng: random.Random) -> str:
+    """
+    Team page with the list of upcoming games
+    """
+
+    months = ["Apr", "May", "Jun", "Jul", "Aug", "Sep"]
+    events = []
+    for i in range(81):
+        date = f"{months[i // 14]} {1 + i % 28}"
+        title = f"{rng.choice(OPPONENTS)} at Los Angeles Dodgers"
+        events.append(
+            '<div class="styles_box__QqP94">'
+            f'<a class="styles_link__1Scjm" href="/los-angeles-dodgers-tickets-dodger-stadium/production/{4200000 + i}">'
+            f'<div class="styles_date__x"><p class="styles_md__1m2cS styles_semi-bold__d780p">{date}</p><p>7:10pm</p></div>'
+            f'<div class="styles_col__2dlgD"><p class="styles_md__1m2cS styles_semi-bold__d780p">{title}</p>'
+            "<p>Dodger Stadium - Los Angeles, CA</p></div>"
+            "</a></div>"
+        )
+    return f'<html><body><div id="content">{"".join(events)}</div></body></html>'
+
+
+def vivid_listings_json(n: int, rng: random.Random) -> str:
+    """
+    Listings API response with n tickets
+    """
+
+    tickets = []
+    for i in range(n):
+        tickets.append({
+            "i": str(700000000 + i),
+            "s": str(rng.choice([rng.randint(1, 60), rng.randint(100, 170), rng.randint(200, 260)])),
+            "r": rng.choice([str(rng.randint(1, 45)), rng.choice("ABCDEFGHJK")]),
+            "q": str(rng.choice([1, 2, 2, 2, 3, 4, 4, 6, 8])),
+            "p": f"{rng.randint(900, 450000) / 100:.2f}",
+            "n": "",
+            "f": rng.randint(0, 1),
+        })
+    return json.dumps({"global": [{"productionId": 4200000}], "tickets": tickets})
+
+
+def main():
+    FIXTURES_DIRECTORY.mkdir(exist_ok=True)
+    rng = random.Random(20230729)
+
+    for n in GAMETIME_LISTING_COUNTS:
+        write(f"gametime_listings_{n}.html", gametime_listings_html(n, rng))
+    write("gametime_events.html", gametime_events_html(rng))
+    write("vivid_schedule.html", vivid_schedule_html(rng))
+    for n in VIVID_LISTING_COUNTS:
+        write(f"vivid_listings_{n}.json", vivid_listings_json(n, rng))
+
+    for path in sorted(FIXTURES_DIRECTORY.glob("*.gz")):
+        print(f"{path.name:<36} {path.stat().st_size:>10,} bytes")
+
+
+if __name__ == "__main__":
+    main()
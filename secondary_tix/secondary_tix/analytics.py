@@ -0,0 +1,362 @@
+# Price statistics over the listing snapshots
+#
+# Every output/[spider]/[file_timestamp]/[YYYYMMDD].csv (output/[spider]/[team]/... in batch mode)
+# is one snapshot of an event. A snapshot is loaded into typed NumPy arrays, with the sections and
+# rows as categorical codes, and the min / p10 / median / p90 price and # of listings of every
+# (section, quantity) are computed with one sort and a few vectorized ops instead of a Python loop.
+#
+# The stats of a snapshot are cached in ANALYTICS_CACHE_DIRECTORY as [YYYYMMDD].npz next to the
+# same relative path, and only computed again when the CSV changes (size / modified time), so
+# looking at a whole season again only reads the small cached files.
+# Delta runs (see delta.py) don't write full snapshots and are not included.
+#
+# ex -
+#   paths = analytics.snapshot_paths(settings.OUTPUT_DIRECTORY, "gametime", event_date="2023-07-29")
+#   stats = analytics.section_stats(paths, settings.OUTPUT_DIRECTORY, settings.ANALYTICS_CACHE_DIRECTORY)
+#   stats.rows()
+#
+# Stats of the latest snapshot of every event, run from the folder that contains scrapy.cfg:
+#   python -m secondary_tix.analytics gametime [--team Giants] [--event-date 2023-07-29] [--all]
+
+import os
+import re
+import csv
+import argparse
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+# Only needed for the analytics
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from secondary_tix.items import EVENT_LISTING_HEADERS
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cached stats change so the old files are computed again
+CACHE_VERSION = 1
+# Full snapshots only, not the .part-[worker] / .delta / .checkpoint files
+SNAPSHOT_NAME = re.compile(r"^(\d{4})(\d{2})(\d{2})\.csv$")
+STAT_FIELDS = ["listings", "min", "p10", "median", "p90"]
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for the analytics: pip install numpy")
+
+
+@dataclass
+class Snapshot:
+    """
+    Listings of one snapshot CSV as column arrays
+    sections / rows are the distinct values, section / row the code of every listing in them
+    """
+
+    path: Path
+    run: str
+    event_date: str
+    sections: "np.ndarray"
+    section: "np.ndarray"
+    rows: "np.ndarray"
+    row: "np.ndarray"
+    quantity: "np.ndarray"
+    price: "np.ndarray"
+    listing_valid_as_of: "np.ndarray"
+
+    def __len__(self):
+        return len(self.price)
+
+
+@dataclass
+class SectionStats:
+    """
+    Price stats of every (section, quantity) of one or many snapshots, one entry per group
+    runs / event_dates have one entry per snapshot, snapshot is the index of a group's snapshot in them
+    """
+
+    runs: "np.ndarray"
+    event_dates: "np.ndarray"
+    sections: "np.ndarray"
+    snapshot: "np.ndarray"
+    section: "np.ndarray"
+    quantity: "np.ndarray"
+    listings: "np.ndarray"
+    min: "np.ndarray"
+    p10: "np.ndarray"
+    median: "np.ndarray"
+    p90: "np.ndarray"
+
+    def __len__(self):
+        return len(self.listings)
+
+    def rows(self) -> list[tuple]:
+        """
+        return: list of (run, event_date, section, quantity, # listings, min, p10, median, p90)
+        """
+
+        return list(zip(
+            self.runs[self.snapshot].tolist(),
+            self.event_dates[self.snapshot].tolist(),
+            self.sections[self.section].tolist(),
+            self.quantity.tolist(),
+            self.listings.tolist(),
+            self.min.tolist(),
+            self.p10.tolist(),
+            self.median.tolist(),
+            self.p90.tolist(),
+        ))
+
+
+def snapshot_paths(
+        output_directory,
+        spider_name: str,
+        team: str=None,
+        event_date: str=None,
+        latest: bool=False
+    ) -> list[Path]:
+    """
+    Snapshot CSVs of a spider, oldest run first
+
+    output_directory: OUTPUT_DIRECTORY
+    spider_name: name of the spider the listings are from
+    team: only the snapshots of this team of a batch crawl (see batch.py)
+    event_date: only the snapshots of this YYYY-MM-DD event
+    latest: only the most recent snapshot of every event (and team)
+    """
+
+    spider_directory = Path(output_directory) / f"output/{spider_name}"
+    if team is not None:
+        spider_directory = spider_directory / team
+    file_name = f"{event_date.replace('-', '')}.csv" if event_date else "*.csv"
+
+    paths = [
+        path for path in spider_directory.rglob(file_name)
+        if SNAPSHOT_NAME.match(path.name) and not path.parent.name.startswith("_")
+    ]
+    # [team/]run/YYYYMMDD.csv, run timestamps sort like the time
+    paths.sort(key=lambda path: (path.parent.name, str(path)))
+    if latest:
+        # (team folder, event) -> most recent path
+        paths = list({(path.parent.parent, path.name): path for path in paths}.values())
+    return paths
+
+
+def load_snapshot(path) -> Snapshot:
+    """
+    Read a snapshot CSV into column arrays
+
+    path: path of an output/[spider]/.../[YYYYMMDD].csv file
+    """
+
+    _require_numpy()
+    path = Path(path)
+    text = path.read_text()
+    header_line, _, body = text.partition("\n")
+    header = header_line.strip().split(",") if header_line else EVENT_LISTING_HEADERS
+    # Without quoted fields every line has exactly one value per column, so the whole body is
+    #     split at once and every column is a slice of it, 2-3x faster than the csv module
+    fields = body.rstrip("\r\n").replace("\r\n", ",").replace("\n", ",").split(",") if body.strip() else []
+    if '"' in text or len(fields) % len(header):
+        with open(path, newline="") as file:
+            reader = csv.reader(file)
+            header = next(reader, None) or EVENT_LISTING_HEADERS
+            # One tuple per column, parsed in bulk by numpy below
+            columns = list(zip(*reader)) or [()] * len(header)
+    else:
+        columns = [fields[i::len(header)] for i in range(len(header))]
+    column = {name: columns[i] for i, name in enumerate(header)}
+
+    sections, section = np.unique(np.array(column["section"], dtype=str), return_inverse=True)
+    rows, row = np.unique(np.array(column["row"], dtype=str), return_inverse=True)
+    year, month, day = SNAPSHOT_NAME.match(path.name).groups()
+    return Snapshot(
+        path=path,
+        run=path.parent.name,
+        event_date=f"{year}-{month}-{day}",
+        sections=sections,
+        section=section.astype(np.int32),
+        rows=rows,
+        row=row.astype(np.int32),
+        quantity=np.array(column["quantity"], dtype=np.int32),
+        price=np.array(column["price"], dtype=np.float64),
+        listing_valid_as_of=np.array(column["listing_valid_as_of"], dtype="datetime64[s]"),
+    )
+
+
+def _percentile(prices, starts, counts, q: float):
+    """
+    q percentile of every group of the sorted prices, interpolated like numpy.percentile
+    """
+
+    position = starts + q * (counts - 1)
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, starts + counts - 1)
+    return prices[low] + (prices[high] - prices[low]) * (position - low)
+
+
+def price_stats(section, quantity, price) -> dict:
+    """
+    Price stats of every (section, quantity) group of listings
+
+    section: section code of every listing
+    quantity: quantity of every listing
+    price: price of every listing
+    return: dict of arrays with one entry per group, section, quantity and STAT_FIELDS
+    """
+
+    _require_numpy()
+    if len(price) == 0:
+        empty = np.array([], dtype=np.float64)
+        return {
+            "section": np.array([], dtype=np.int32), "quantity": np.array([], dtype=np.int32),
+            "listings": np.array([], dtype=np.int32), "min": empty, "p10": empty, "median": empty, "p90": empty,
+        }
+
+    # Sorted by group then price, every group is a contiguous run of prices
+    order = np.lexsort((price, quantity, section))
+    section, quantity, price = section[order], quantity[order], price[order]
+    new_group = np.empty(len(price), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = (section[1:] != section[:-1]) | (quantity[1:] != quantity[:-1])
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.append(starts, len(price)))
+
+    return {
+        "section": section[starts].astype(np.int32),
+        "quantity": quantity[starts].astype(np.int32),
+        "listings": counts.astype(np.int32),
+        "min": price[starts],
+        "p10": _percentile(price, starts, counts, 0.1),
+        "median": _percentile(price, starts, counts, 0.5),
+        "p90": _percentile(price, starts, counts, 0.9),
+    }
+
+
+def _read_cache(cache_path: Path, source) -> dict:
+    """
+    Stats cached by _write_cache, None if there are none or the snapshot changed since
+
+    source: os.stat_result of the snapshot CSV
+    """
+
+    try:
+        with np.load(cache_path) as cached:
+            key, names, table = cached["key"], cached["names"], cached["stats"]
+    except (OSError, ValueError, KeyError):
+        return None
+    if key.tolist() != [CACHE_VERSION, source.st_size, source.st_mtime_ns]:
+        return None
+    return {
+        "run": names[0], "event_date": names[1], "sections": names[2:],
+        "section": table[0].astype(np.int32), "quantity": table[1].astype(np.int32),
+        **{field: table[i + 2] for i, field in enumerate(STAT_FIELDS)},
+    }
+
+
+def _write_cache(cache_path: Path, source, stats: dict):
+    """
+    Save the stats of a snapshot as 3 arrays, every array of a .npz is a separate file to
+        find and parse when loading so the many small ones are packed together
+    """
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and moved so a reader never sees a partial file
+    temp_path = cache_path.with_suffix(f".{os.getpid()}.tmp.npz")
+    np.savez(
+        temp_path,
+        key=np.array([CACHE_VERSION, source.st_size, source.st_mtime_ns], dtype=np.int64),
+        names=np.concatenate([[str(stats["run"]), str(stats["event_date"])], stats["sections"]]),
+        stats=np.vstack([stats[field] for field in ["section", "quantity", *STAT_FIELDS]]).astype(np.float64),
+    )
+    os.replace(temp_path, cache_path)
+
+
+def snapshot_stats(path, output_directory=None, cache_directory=None) -> dict:
+    """
+    Price stats of a snapshot, read from the cache when the CSV didn't change since they were computed
+
+    path: path of the snapshot CSV
+    output_directory: OUTPUT_DIRECTORY, the cache keeps the layout of the CSVs relative to it
+    cache_directory: ANALYTICS_CACHE_DIRECTORY, None to not cache
+    return: price_stats of the snapshot plus run, event_date and sections (the section names)
+    """
+
+    path = Path(path)
+    source = path.stat()
+    cache_path = None
+    if cache_directory is not None:
+        relative = path.relative_to(Path(output_directory) / "output") if output_directory else Path(path.name)
+        cache_path = (Path(cache_directory) / relative).with_suffix(".npz")
+        stats = _read_cache(cache_path, source)
+        if stats is not None:
+            return stats
+
+    snapshot = load_snapshot(path)
+    stats = price_stats(snapshot.section, snapshot.quantity, snapshot.price)
+    stats.update(run=snapshot.run, event_date=snapshot.event_date, sections=snapshot.sections)
+    if cache_path is not None:
+        _write_cache(cache_path, source, stats)
+    return stats
+
+
+def section_stats(paths: list, output_directory=None, cache_directory=None) -> SectionStats:
+    """
+    Price stats of every (section, quantity) of every snapshot
+
+    paths: snapshot CSVs, see snapshot_paths
+    output_directory: OUTPUT_DIRECTORY
+    cache_directory: ANALYTICS_CACHE_DIRECTORY, None to not cache
+    """
+
+    _require_numpy()
+    parts = [snapshot_stats(path, output_directory, cache_directory) for path in paths]
+    if not parts:
+        return SectionStats(
+            np.array([], dtype=str), np.array([], dtype=str), np.array([], dtype=str),
+            *[np.array([], dtype=np.int32)] * 4, *[np.array([], dtype=np.float64)] * 4,
+        )
+
+    # Codes of each snapshot are into its own sections, move them into the sections of all snapshots
+    sections = np.unique(np.concatenate([part["sections"] for part in parts]))
+    section = np.concatenate([
+        np.searchsorted(sections, part["sections"]).astype(np.int32)[part["section"]] for part in parts
+    ])
+    snapshot = np.repeat(
+        np.arange(len(parts), dtype=np.int32), [len(part["listings"]) for part in parts]
+    )
+    return SectionStats(
+        runs=np.array([str(part["run"]) for part in parts]),
+        event_dates=np.array([str(part["event_date"]) for part in parts]),
+        sections=sections,
+        snapshot=snapshot,
+        section=section,
+        quantity=np.concatenate([part["quantity"] for part in parts]),
+        **{field: np.concatenate([part[field] for part in parts]) for field in STAT_FIELDS},
+    )
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "secondary_tix.settings")
+    from scrapy.utils.project import get_project_settings
+
+    parser = argparse.ArgumentParser(description="Price stats per section and quantity of the listing snapshots")
+    parser.add_argument("spider", help="name of the spider the listings are from")
+    parser.add_argument("--team", help="only this team of a batch crawl")
+    parser.add_argument("--event-date", help="only this YYYY-MM-DD event")
+    parser.add_argument("--all", action="store_true", help="every snapshot instead of the latest of each event")
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    output_directory = settings.get("OUTPUT_DIRECTORY")
+    paths = snapshot_paths(output_directory, args.spider, args.team, args.event_date, latest=not args.all)
+    stats = section_stats(paths, output_directory, settings.get("ANALYTICS_CACHE_DIRECTORY"))
+    print(f"{len(paths)} snapshots, {len(stats)} (section, quantity) groups")
+    print(f"  {'run':<16} {'event':<10}  {'section':<20} {'qty':>3} {'#':>5} {'min':>9} {'p10':>9} {'median':>9} {'p90':>9}")
+    for run, event_date, section, quantity, listings, low, p10, median, p90 in stats.rows():
+        print(
+            f"  {run:<16} {event_date:<10}  {section:<20} {quantity:>3} {listings:>5} "
+            f"{low:>9.2f} {p10:>9.2f} {median:>9.2f} {p90:>9.2f}"
+        )
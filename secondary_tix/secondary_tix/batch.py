@@ -0,0 +1,112 @@
+# Batch crawl of many teams in a single process
+#
+# The teams and marketplaces come from a JSON config (see batch.example.json):
+#   {
+#       "marketplaces": ["gametime", "vivid"],
+#       "event_date": null,
+#       "teams": [
+#           {"team": "dodgers", "gametime_url": "https://gametime.co/...", "vivid_url": "https://www.vividseats.com/..."},
+#           ...
+#       ]
+#   }
+#
+# Every marketplace is one spider covering all the teams, so the Gametime browser is launched
+# once and an event listed for two teams (ex - Giants at Dodgers on both team pages) is only
+# crawled once. Listings are written to output/[spider]/[team]/[file_timestamp]/[YYYYMMDD].csv
+#
+# Run from the folder that contains scrapy.cfg:
+#   python -m secondary_tix.batch ../batch.json
+# or a single marketplace:
+#   scrapy crawl vivid -a batch=../batch.json
+
+import sys
+import json
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MARKETPLACES = ["gametime", "vivid"]
+
+
+def load_batch_config(path) -> dict:
+    """
+    Read and check a batch config
+
+    path: path of the JSON config
+    return: config with "marketplaces", "event_date" and "teams" set
+    """
+
+    config = json.loads(Path(path).read_text())
+    teams = config.get("teams") or []
+    if not teams:
+        raise ValueError(f"No teams in the batch config {path}")
+    for team in teams:
+        if not team.get("team"):
+            raise ValueError(f"Every team in the batch config needs a 'team' name: {team}")
+
+    marketplaces = config.get("marketplaces") or MARKETPLACES
+    unknown = set(marketplaces) - set(MARKETPLACES)
+    if unknown:
+        raise ValueError(f"Unknown marketplaces {sorted(unknown)}, expected some of {MARKETPLACES}")
+
+    return {"marketplaces": marketplaces, "event_date": config.get("event_date"), "teams": teams}
+
+
+def batch_teams(config: dict, marketplace: str) -> list[tuple[str, str]]:
+    """
+    Teams to crawl on a marketplace, teams without a URL for it are skipped
+
+    config: config returned by load_batch_config
+    marketplace: "gametime" or "vivid"
+    return: list of (team, url of the team page on the marketplace)
+    """
+
+    return [
+        (team["team"], team[f"{marketplace}_url"])
+        for team in config["teams"]
+        if team.get(f"{marketplace}_url")
+    ]
+
+
+def run_batch(path, settings=None):
+    """
+    Crawl every marketplace of the batch config in one CrawlerProcess
+    The BATCH_CONCURRENT_REQUESTS budget is split between the marketplaces
+
+    path: path of the JSON config
+    settings: project settings to crawl with, get_project_settings() by default
+    """
+
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+    from secondary_tix.spiders.gametime import GametimeSpider
+    from secondary_tix.spiders.vivid import VividSpider
+
+    spiders = {"gametime": GametimeSpider, "vivid": VividSpider}
+    config = load_batch_config(path)
+    marketplaces = [x for x in config["marketplaces"] if batch_teams(config, x)]
+    if not marketplaces:
+        raise ValueError(f"No team in the batch config {path} has a URL for {config['marketplaces']}")
+
+    settings = settings if settings is not None else get_project_settings()
+    concurrent_requests = max(1, settings.getint("BATCH_CONCURRENT_REQUESTS", 16) // len(marketplaces))
+    settings.set("CONCURRENT_REQUESTS", concurrent_requests, priority="cmdline")
+    # The polling daemon's request budget is split the same way (see polling.py)
+    request_budget = settings.getfloat("POLL_REQUEST_BUDGET", 600) / len(marketplaces)
+    settings.set("POLL_REQUEST_BUDGET", request_budget, priority="cmdline")
+
+    process = CrawlerProcess(settings)
+    for marketplace in marketplaces:
+        logger.info(
+            f"Batch crawl of {len(batch_teams(config, marketplace))} teams on {marketplace}, "
+            f"{concurrent_requests} concurrent requests"
+        )
+        process.crawl(spiders[marketplace], batch=str(path), event_date=config["event_date"])
+    process.start()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m secondary_tix.batch [batch config].json")
+    run_batch(sys.argv[1])
@@ -0,0 +1,123 @@
+# Helpers for the requests rendered with Playwright
+#
+# Pages are spread over a fixed pool of named browser contexts that are reused
+# across events, and requests for resources the spiders never read are aborted.
+# See: https://github.com/scrapy-plugins/scrapy-playwright#supported-settings
+
+import re
+import logging
+from itertools import count
+
+logger = logging.getLogger(__name__)
+
+# Resources aborted by abort_request, set from the crawler settings by BrowserSettingsExtension
+_blocked_resource_types = frozenset()
+_blocked_url_pattern = re.compile(r"(?!)")
+
+_context_counter = count()
+
+# Bytes transferred and load time of the current page, from the Navigation and Resource Timing APIs
+PAGE_METRICS_JS = """
+() => {
+    const navigation = performance.getEntriesByType("navigation")[0];
+    const resources = performance.getEntriesByType("resource");
+    let bytes = navigation ? navigation.transferSize : 0;
+    for (const resource of resources) {
+        bytes += resource.transferSize;
+    }
+    return {
+        bytes: bytes,
+        load_ms: navigation ? navigation.loadEventEnd - navigation.startTime : 0,
+        resources: resources.length,
+    };
+}
+"""
+
+
+class BrowserSettingsExtension:
+    """
+    Applies the browser settings of the crawler
+        - the contexts of the pool must fit in PLAYWRIGHT_MAX_CONTEXTS, scrapy-playwright doesn't close
+          contexts during a crawl so a page for a context past the limit would wait forever
+        - PLAYWRIGHT_BLOCKED_RESOURCE_TYPES and PLAYWRIGHT_BLOCKED_URL_PATTERNS are kept at module level
+          for abort_request, scrapy-playwright calls it with the playwright request only
+    """
+
+    def __init__(self, resource_types: list[str], url_patterns: list[str]):
+        global _blocked_resource_types, _blocked_url_pattern
+        _blocked_resource_types = frozenset(resource_types)
+        _blocked_url_pattern = re.compile("|".join(url_patterns) or r"(?!)")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pool_size = settings.getint('PLAYWRIGHT_CONTEXT_POOL_SIZE', 1)
+        max_contexts = settings.getint('PLAYWRIGHT_MAX_CONTEXTS')
+        if max_contexts and pool_size > max_contexts:
+            raise ValueError(
+                f"PLAYWRIGHT_CONTEXT_POOL_SIZE ({pool_size}) is larger than PLAYWRIGHT_MAX_CONTEXTS ({max_contexts}), "
+                "the crawl would hang waiting for a browser context"
+            )
+        return cls(
+            settings.getlist('PLAYWRIGHT_BLOCKED_RESOURCE_TYPES'),
+            settings.getlist('PLAYWRIGHT_BLOCKED_URL_PATTERNS'),
+        )
+
+
+def abort_request(request) -> bool:
+    """
+    Used as PLAYWRIGHT_ABORT_REQUEST
+    Abort the resources we never read (images, fonts, analytics, ads etc.)
+    The resources are set by BrowserSettingsExtension
+
+    request: playwright request made by the page
+    return: True if the request should be aborted
+    """
+
+    return (
+        request.resource_type in _blocked_resource_types
+        or _blocked_url_pattern.search(request.url) is not None
+    )
+
+
+def playwright_meta(settings, **kwargs) -> dict:
+    """
+    Request meta for a page rendered by Playwright
+    Each call picks the next browser context of the pool so pages are spread
+        evenly over the contexts and the contexts are reused across events
+
+    settings: crawler settings, PLAYWRIGHT_CONTEXT_POOL_SIZE is the # of contexts of the pool
+    kwargs: extra meta keys for the request
+    return: meta dict for a scrapy.Request
+    """
+
+    pool_size = max(settings.getint('PLAYWRIGHT_CONTEXT_POOL_SIZE', 1), 1)
+    meta = {
+        "playwright": True,
+        "playwright_include_page": True,
+        "playwright_context": f"pool-{next(_context_counter) % pool_size}",
+    }
+    meta.update(kwargs)
+    return meta
+
+
+async def record_page_metrics(page, stats) -> dict:
+    """
+    Add the bytes downloaded and the load time of the page to the crawl stats
+
+    page: playwright page that finished loading
+    stats: stats collector of the crawler
+    return: dict with the bytes, load_ms and # of resources of the page
+    """
+
+    metrics = await page.evaluate(PAGE_METRICS_JS)
+    stats.inc_value("browser/pages")
+    stats.inc_value("browser/bytes", metrics["bytes"])
+    stats.inc_value("browser/resources", metrics["resources"])
+    stats.inc_value("browser/page_load_ms", int(metrics["load_ms"]))
+    stats.max_value("browser/page_load_ms_max", int(metrics["load_ms"]))
+    logger.info(
+        f"{page.url} loaded in {metrics['load_ms']:.0f}ms, "
+        f"{metrics['bytes']} bytes over {metrics['resources']} resources"
+    )
+    return metrics
@@ -0,0 +1,255 @@
+# Delta snapshots
+#
+# Instead of the full set of listings, each run only writes the listings that
+# appeared, disappeared or changed price since the last run of the spider:
+#
+#   output/[spider]/[file_timestamp]/[YYYYMMDD].delta.csv       add / remove / change records
+#   output/[spider]/[file_timestamp]/[YYYYMMDD].checkpoint.csv  every listing (periodic full snapshot)
+#   output/[spider]/_index/[YYYYMMDD].idx                        fingerprints of the last snapshot
+#
+# The snapshot of any run can be rebuilt from the last checkpoint before it
+# plus the deltas that follow (see reconstruct_snapshot).
+
+import csv
+import struct
+import hashlib
+import logging
+from array import array
+from decimal import Decimal
+from pathlib import Path
+
+from secondary_tix.items import EVENT_LISTING_HEADERS
+
+logger = logging.getLogger(__name__)
+
+
+DELTA_HEADERS = ["change", "fingerprint"] + EVENT_LISTING_HEADERS
+
+# magic, version, runs since the last checkpoint, # of listings
+INDEX_HEADER = struct.Struct("<4sHII")
+INDEX_MAGIC = b"STIX"
+INDEX_VERSION = 1
+
+
+def listing_fingerprint(section, row, quantity, listing_id=None, occurrence: int=0) -> int:
+    """
+    Stable 64 bit fingerprint of a listing, the same listing gets the same
+        fingerprint across runs so its price can be compared
+
+    section, row, quantity: where the listing is and how many tickets it has
+    listing_id: id of the listing on the website (Vivid), if there is one
+    occurrence: tells apart listings without an id in the same section / row / quantity
+    """
+
+    key = f"{section}\x1f{row}\x1f{quantity}\x1f{listing_id if listing_id is not None else ''}\x1f{occurrence}"
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+def price_cents(price) -> int:
+    """
+    Price as an int # of cents
+        ex - "1234" -> 123400, "123.45" -> 12345
+    """
+
+    return int(Decimal(str(price)) * 100)
+
+
+def fingerprint_listings(listings: list[dict]) -> dict:
+    """
+    Fingerprint the listings of one event
+
+    listings: listing dicts with the EVENT_LISTING_HEADERS fields (and optional listing_id)
+    return: fingerprint -> listing dict
+    """
+
+    fingerprinted = {}
+    # Listings without an id in the same section / row / quantity are numbered by price
+    occurrences = {}
+    for listing in sorted(listings, key=lambda x: price_cents(x["price"])):
+        listing_id = listing.get("listing_id")
+        occurrence = 0
+        if listing_id is None:
+            spot = (listing["section"], listing["row"], listing["quantity"])
+            occurrence = occurrences[spot] = occurrences.get(spot, -1) + 1
+        fingerprint = listing_fingerprint(
+            listing["section"], listing["row"], listing["quantity"], listing_id, occurrence
+        )
+        fingerprinted[fingerprint] = listing
+    return fingerprinted
+
+
+class FingerprintIndex:
+    """
+    Fingerprint -> price (in cents) of every listing of the last snapshot of an event
+    Stored as two packed arrays so it stays small and loads without parsing
+    """
+
+    def __init__(self, prices: dict=None, runs_since_checkpoint: int=0):
+        self.prices = prices if prices is not None else {}
+        self.runs_since_checkpoint = runs_since_checkpoint
+
+    @classmethod
+    def load(cls, path: Path):
+        """
+        Load the index, None if there is no usable index yet
+        """
+
+        if not path.exists():
+            return None
+        data = path.read_bytes()
+        magic, version, runs_since_checkpoint, count = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            logger.warning(f"Ignoring index with unknown format: {path}")
+            return None
+        offset = INDEX_HEADER.size
+        fingerprints = array("Q")
+        fingerprints.frombytes(data[offset:offset + count * 8])
+        prices = array("q")
+        prices.frombytes(data[offset + count * 8:offset + count * 16])
+        return cls(dict(zip(fingerprints, prices)), runs_since_checkpoint)
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.runs_since_checkpoint, len(self.prices)))
+            f.write(array("Q", self.prices.keys()).tobytes())
+            f.write(array("q", self.prices.values()).tobytes())
+        # Replace the old index in one step so a crash never leaves half an index
+        tmp_path.replace(path)
+
+
+def diff_listings(index: FingerprintIndex, listings: dict) -> list[tuple]:
+    """
+    Compare the listings of this run to the last snapshot
+
+    index: fingerprints of the last snapshot
+    listings: fingerprint -> listing dict of this run
+    return: list of (change, fingerprint, listing dict or None)
+        change is "add", "remove" or "change" (same listing, new price)
+    """
+
+    changes = []
+    for fingerprint, listing in listings.items():
+        last_price = index.prices.get(fingerprint)
+        if last_price is None:
+            changes.append(("add", fingerprint, listing))
+        elif last_price != price_cents(listing["price"]):
+            changes.append(("change", fingerprint, listing))
+    for fingerprint in index.prices.keys() - listings.keys():
+        changes.append(("remove", fingerprint, None))
+    return changes
+
+
+def write_records(path: Path, records: list[tuple]):
+    """
+    Write (change, fingerprint, listing dict or None) records as a CSV
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(DELTA_HEADERS)
+        for change, fingerprint, listing in records:
+            if listing is None:
+                writer.writerow([change, fingerprint] + [""] * len(EVENT_LISTING_HEADERS))
+            else:
+                writer.writerow([change, fingerprint] + [listing.get(x) for x in EVENT_LISTING_HEADERS])
+
+
+def save_delta_snapshot(
+        output_directory: Path,
+        file_timestamp: str,
+        website: str,
+        event_date_str: str,
+        listings: list[dict],
+        checkpoint_every: int
+    ) -> tuple[str, int]:
+    """
+    Write the listings of one event for this run as a delta or a checkpoint
+
+    output_directory: folder the output folder is created in
+    file_timestamp: timestamp of the run, used for the folder name
+    website: name of the website the listings are from
+    event_date_str: YYYYMMDD of the event the listings are for
+    listings: listing dicts of this run
+    checkpoint_every: a full checkpoint is written every `checkpoint_every` runs
+    return: "checkpoint" or "delta" and the # of records written,
+        None and 0 for an event without listings that has no snapshot yet
+    """
+
+    website_dir = output_directory / f"output/{website}"
+    index_path = website_dir / f"_index/{event_date_str}.idx"
+    run_dir = website_dir / file_timestamp
+
+    fingerprinted = fingerprint_listings(listings)
+    index = FingerprintIndex.load(index_path)
+    if index is None and not listings:
+        return None, 0
+
+    if index is None or index.runs_since_checkpoint + 1 >= checkpoint_every:
+        kind = "checkpoint"
+        records = [("checkpoint", fingerprint, listing) for fingerprint, listing in fingerprinted.items()]
+        runs_since_checkpoint = 0
+    else:
+        kind = "delta"
+        records = diff_listings(index, fingerprinted)
+        runs_since_checkpoint = index.runs_since_checkpoint + 1
+
+    write_records(run_dir / f"{event_date_str}.{kind}.csv", records)
+    FingerprintIndex(
+        {fingerprint: price_cents(listing["price"]) for fingerprint, listing in fingerprinted.items()},
+        runs_since_checkpoint,
+    ).save(index_path)
+
+    logger.info(f"{website} {event_date_str}: {len(records)} {kind} records for {len(listings)} listings")
+    return kind, len(records)
+
+
+def reconstruct_snapshot(
+        output_directory: Path,
+        website: str,
+        event_date_str: str,
+        file_timestamp: str
+    ) -> list[dict]:
+    """
+    Rebuild the full set of listings of an event as of a run
+
+    output_directory: folder the output folder is created in
+    website: name of the website the listings are from
+    event_date_str: YYYYMMDD of the event
+    file_timestamp: timestamp of the run to rebuild
+    return: listing dicts of the snapshot
+    """
+
+    website_dir = output_directory / f"output/{website}"
+    run_dirs = sorted(
+        x for x in website_dir.iterdir()
+        if x.is_dir() and not x.name.startswith("_") and x.name <= file_timestamp
+    )
+
+    # Start from the last checkpoint at or before the run
+    start = None
+    for i in range(len(run_dirs) - 1, -1, -1):
+        if (run_dirs[i] / f"{event_date_str}.checkpoint.csv").exists():
+            start = i
+            break
+    if start is None:
+        raise FileNotFoundError(f"No checkpoint for {website} {event_date_str} at or before {file_timestamp}")
+
+    state = {}
+    for run_dir in run_dirs[start:]:
+        for kind in ("checkpoint", "delta"):
+            path = run_dir / f"{event_date_str}.{kind}.csv"
+            if not path.exists():
+                continue
+            with open(path, newline="") as f:
+                for record in csv.DictReader(f):
+                    change = record.pop("change")
+                    fingerprint = record.pop("fingerprint")
+                    if change == "remove":
+                        state.pop(fingerprint, None)
+                    else:
+                        state[fingerprint] = record
+
+    return list(state.values())
@@ -0,0 +1,114 @@
+# Event discovery cache
+#
+# The events found on a team's page (Gametime hrefs, Vivid production ids, with their dates
+# and titles) are saved per spider and team so the next runs can go straight to the listings:
+#
+#   [DISCOVERY_CACHE_DIRECTORY]/[spider]_[team].json
+#
+# An entry is used for DISCOVERY_CACHE_TTL seconds. Events that already happened are dropped
+# when it is read. Run a spider with -a refresh_discovery=1 (or DISCOVERY_CACHE_REFRESH = True)
+# to rediscover the events and replace the entry.
+# The cache always holds every event of the team, the event_date filter is applied on top of it.
+
+import re
+import json
+import time
+import hashlib
+import logging
+from datetime import date
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryCache:
+    """
+    Events discovered per (spider, team), see the top of the module
+    """
+
+    def __init__(self, directory, ttl: int, refresh: bool=False):
+        """
+        directory: folder the entries are saved in
+        ttl: seconds an entry is used for
+        refresh: ignore the saved entries (they are replaced once the events are rediscovered)
+        """
+
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.refresh = refresh
+
+    @classmethod
+    def from_settings(cls, settings, refresh: bool=False):
+        """
+        Cache configured with the DISCOVERY_CACHE_* settings, None if it is disabled
+        """
+
+        if not settings.getbool('DISCOVERY_CACHE_ENABLED'):
+            return None
+        return cls(
+            settings.get('DISCOVERY_CACHE_DIRECTORY'),
+            settings.getint('DISCOVERY_CACHE_TTL', 6 * 60 * 60),
+            refresh or settings.getbool('DISCOVERY_CACHE_REFRESH'),
+        )
+
+    def path(self, spider_name: str, key: str) -> Path:
+        """
+        key: team name, or the URL of the schedule page when there is no team
+        """
+
+        slug = re.sub(r"[^a-z0-9]+", "-", key.lower()).strip("-")
+        if key.startswith("http"):
+            # URLs make long and ambiguous slugs
+            slug = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return self.directory / f"{spider_name}_{slug}.json"
+
+    def load(self, spider_name: str, key: str):
+        """
+        Events of a team saved less than `ttl` seconds ago, without the events that already happened
+
+        spider_name: name of the spider the events were discovered by
+        key: team name, or the URL of the schedule page when there is no team
+        return: list of event dicts, None if there is no usable entry
+        """
+
+        if self.refresh:
+            return None
+        path = self.path(spider_name, key)
+        try:
+            entry = json.loads(path.read_text())
+            discovered_at, events = entry["discovered_at"], entry["events"]
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable discovery cache entry {path}: {e!r}")
+            return None
+
+        if time.time() - discovered_at > self.ttl:
+            return None
+        today = date.today().isoformat()
+        return [x for x in events if not x.get("event_date") or x["event_date"] >= today]
+
+    def save(self, spider_name: str, key: str, events: list[dict]):
+        """
+        Replace the entry of a team
+
+        spider_name: name of the spider the events were discovered by
+        key: team name, or the URL of the schedule page when there is no team
+        events: every event found for the team, before the event_date filter
+        """
+
+        path = self.path(spider_name, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"discovered_at": time.time(), "events": events}))
+        tmp_path.replace(path)
+        logger.info(f"Saved {len(events)} discovered events to {path}")
+
+    def invalidate(self, spider_name: str, key: str=None):
+        """
+        Delete the entry of a team, or every entry of the spider if no key is given
+        """
+
+        paths = [self.path(spider_name, key)] if key is not None else self.directory.glob(f"{spider_name}_*.json")
+        for path in paths:
+            path.unlink(missing_ok=True)
@@ -0,0 +1,371 @@
+# Distributed crawl over a shared work queue (see workqueue.py)
+#
+# The coordinator runs the spider as usual but the event requests it finds (and, with
+# GAMETIME_QUANTITY_TASKS, the ticket quantity requests) are put in the queue as tasks instead
+# of being crawled. Workers, in other processes or on other machines sharing WORKQUEUE_PATH,
+# lease the tasks, crawl them and ack them once their listings are processed. A task whose
+# worker died is leased again after WORKQUEUE_VISIBILITY_TIMEOUT seconds.
+#
+# Every worker writes output/[spider]/[run]/[YYYYMMDD].part-[worker].csv and the last worker
+# to close merges the parts into the usual output/[spider]/[run]/[YYYYMMDD].csv
+# Only the CSV output is merged, keep the parquet / delta outputs off in distributed runs.
+#
+# Run from the folder that contains scrapy.cfg, spider arguments are given with -a like scrapy crawl:
+#   python -m secondary_tix.distributed run gametime --workers 4 -a team=dodgers
+# or start the processes yourself (workers get the same spider arguments as the coordinator):
+#   python -m secondary_tix.distributed coordinate gametime --run 20230729 -a team=dodgers
+#   python -m secondary_tix.distributed work gametime --run 20230729 -a team=dodgers
+#   python -m secondary_tix.distributed status gametime --run 20230729
+
+import os
+import sys
+import csv
+import time
+import socket
+import logging
+import argparse
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from scrapy import signals, Request
+from scrapy.exceptions import NotConfigured, DontCloseSpider
+from twisted.internet import task
+
+from secondary_tix.workqueue import WorkQueue
+
+logger = logging.getLogger(__name__)
+
+
+# Meta keys of the event / quantity requests that make up a task, spiders rebuild
+# the request from them with task_request
+TASK_META_KEYS = (
+    "event_id",
+    "event_date",
+    "event_title",
+    "event_href",
+    "event_url",
+    "team",
+    "ticket_quantity_index",
+    "ticket_quantity",
+)
+
+
+def task_key(request) -> str:
+    """
+    Key of the task of a request, None if the request isn't an event or quantity request
+    """
+
+    meta = request.meta
+    if meta.get("ticket_quantity_index") is not None:
+        return f"quantity:{meta['event_url']}:{meta['ticket_quantity_index']}"
+    if meta.get("event_id") is not None:
+        return f"event:{meta['event_id']}"
+    return None
+
+
+def merge_parts(output_directory, spider_name: str, run: str) -> int:
+    """
+    Merge the CSV parts of the workers of a run into the usual [YYYYMMDD].csv files
+
+    output_directory: OUTPUT_DIRECTORY
+    spider_name: name of the spider
+    run: id of the run, the folder name of its output
+    return: # of parts merged
+    """
+
+    spider_directory = Path(output_directory) / "output" / spider_name
+    # output/[spider]/[run] or output/[spider]/[team]/[run] in batch mode
+    run_directories = [spider_directory / run, *spider_directory.glob(f"*/{run}")]
+    merged = 0
+    for run_directory in run_directories:
+        parts = {}
+        for part in sorted(run_directory.glob("*.part-*.csv")):
+            parts.setdefault(part.name.split(".part-")[0], []).append(part)
+        for event_date_str, paths in parts.items():
+            full_path = run_directory / f"{event_date_str}.csv"
+            with open(full_path, "a", newline="") as file:
+                writer = csv.writer(file)
+                write_header = file.tell() == 0
+                for path in paths:
+                    with open(path, newline="") as part_file:
+                        reader = csv.reader(part_file)
+                        header = next(reader, None)
+                        if write_header and header is not None:
+                            writer.writerow(header)
+                            write_header = False
+                        writer.writerows(reader)
+            for path in paths:
+                path.unlink()
+            merged += len(paths)
+            logger.info(f"Merged {len(paths)} parts into {full_path}")
+    return merged
+
+
+class WorkQueueMiddleware:
+    """
+    Spider middleware of the coordinator and the workers of a distributed run
+    See the top of the module, enabled with WORKQUEUE_ROLE = "coordinator" or "worker"
+    """
+
+    def __init__(self, crawler, role: str):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.role = role
+        self.queue_path = settings.get('WORKQUEUE_PATH')
+        self.max_attempts = settings.getint('WORKQUEUE_MAX_ATTEMPTS', 3)
+        self.run = settings.get('WORKQUEUE_RUN')
+        self.worker = settings.get('WORKQUEUE_WORKER') or f"{socket.gethostname()}-{os.getpid()}"
+        self.prefetch = settings.getint('WORKQUEUE_PREFETCH', 2)
+        self.visibility_timeout = settings.getfloat('WORKQUEUE_VISIBILITY_TIMEOUT', 10 * 60)
+        self.tick_seconds = settings.getfloat('WORKQUEUE_TICK_SECONDS', 1)
+        self.output_directory = settings.get('OUTPUT_DIRECTORY')
+        self.queue = None
+        self.spider = None
+        self.loop = None
+        self.opened = False
+        self.extended_at = time.time()
+        # ids of the tasks leased by this worker and not acked yet
+        self.in_flight = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        role = crawler.settings.get('WORKQUEUE_ROLE')
+        if role not in ("coordinator", "worker"):
+            raise NotConfigured
+        middleware = cls(crawler, role)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        if role == "coordinator":
+            crawler.signals.connect(middleware.seal, signal=signals.spider_closed)
+        else:
+            crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+            crawler.signals.connect(middleware.request_dropped, signal=signals.request_dropped)
+            # After the pipelines closed their files, so the parts are complete when they are merged
+            crawler.signals.connect(middleware.engine_stopped, signal=signals.engine_stopped)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.queue = WorkQueue(self.queue_path, spider.name, self.max_attempts)
+        if self.role == "coordinator":
+            self.run = self.run or spider.file_timestamp
+            self.queue.create_run(self.run)
+            logger.info(f"Coordinating run {self.run} of {spider.name}, tasks go to {self.queue_path}")
+        else:
+            spider.output_part = self.worker
+            self.loop = task.LoopingCall(self.tick)
+            self.loop.start(self.tick_seconds)
+
+    def seal(self, spider, reason):
+        if reason == "finished":
+            self.queue.seal(self.run)
+            logger.info(f"Run {self.run} sealed with {self.queue.counts(self.run)}")
+        else:
+            logger.warning(
+                f"Coordinator closed ({reason}) before finding every event, run it again with "
+                f"WORKQUEUE_RUN={self.run} so the workers of the run can finish"
+            )
+        self.queue.close()
+
+    def process_start_requests(self, start_requests, spider):
+        if self.role == "worker":
+            # Workers only crawl the tasks of the queue, the spider's own requests are the coordinator's
+            return
+        for request in start_requests:
+            if not self.put(request):
+                yield request
+
+    def process_spider_output(self, response, result, spider):
+        task_id = response.meta.get("workqueue_task")
+        try:
+            for x in result:
+                if not self.put(x):
+                    yield x
+        except Exception:
+            self.release(task_id)
+            raise
+        self.ack(task_id)
+
+    async def process_spider_output_async(self, response, result, spider):
+        task_id = response.meta.get("workqueue_task")
+        try:
+            async for x in result:
+                if not self.put(x):
+                    yield x
+        except Exception:
+            self.release(task_id)
+            raise
+        self.ack(task_id)
+
+    def put(self, request) -> bool:
+        """
+        Put an event / quantity request in the queue
+
+        request: output of the spider
+        return: True if it was a task request, it is then crawled by a worker
+        """
+
+        if not isinstance(request, Request):
+            return False
+        key = task_key(request)
+        if key is None:
+            return False
+        if self.run is None:
+            # A worker yields quantity tasks only once it found its run
+            return False
+        task = {k: request.meta[k] for k in TASK_META_KEYS if k in request.meta}
+        if self.queue.put(self.run, key, task):
+            self.stats.inc_value('workqueue/tasks_put')
+        else:
+            self.stats.inc_value('workqueue/duplicate_tasks')
+        return True
+
+    def tick(self):
+        """
+        Lease tasks up to WORKQUEUE_PREFETCH and keep the leases of the tasks in flight
+        """
+
+        if self.run is None:
+            self.run = self.queue.latest_run()
+            if self.run is None:
+                return
+        if not self.opened:
+            self.opened = True
+            # The worker's files go in the run's folder
+            self.spider.file_timestamp = self.run
+            self.queue.open_worker(self.run, self.worker)
+            logger.info(f"Worker {self.worker} joined run {self.run} of {self.spider.name}")
+
+        now = time.time()
+        if self.in_flight and now - self.extended_at > self.visibility_timeout / 3:
+            self.queue.extend(list(self.in_flight), self.worker, self.visibility_timeout)
+            self.extended_at = now
+
+        free = self.prefetch - len(self.in_flight)
+        if free <= 0:
+            return
+        if not self.in_flight and self.queue.drained(self.run):
+            # Without waiting for the next idle check of the engine
+            logger.info(f"Run {self.run} drained: {self.queue.counts(self.run)}")
+            self.loop.stop()
+            self.crawler.engine.close_spider(self.spider, "finished")
+            return
+        for task_id, task in self.queue.lease(self.run, self.worker, free, self.visibility_timeout):
+            request = self.spider.task_request(task)
+            request = request.replace(dont_filter=True, errback=self.task_failed)
+            request.meta["workqueue_task"] = task_id
+            self.in_flight.add(task_id)
+            self.stats.inc_value('workqueue/tasks_leased')
+            self.crawler.engine.crawl(request)
+
+    def ack(self, task_id):
+        if task_id in self.in_flight:
+            self.in_flight.discard(task_id)
+            self.queue.ack(task_id, self.worker)
+            self.stats.inc_value('workqueue/tasks_acked')
+
+    def release(self, task_id):
+        if task_id in self.in_flight:
+            self.in_flight.discard(task_id)
+            self.queue.release(task_id, self.worker)
+            self.stats.inc_value('workqueue/tasks_released')
+
+    def task_failed(self, failure):
+        logger.error(f"Task {failure.request.meta.get('workqueue_task')} failed: {failure.value!r}")
+        self.release(failure.request.meta.get("workqueue_task"))
+
+    def request_dropped(self, request, spider):
+        self.release(request.meta.get("workqueue_task"))
+
+    def spider_idle(self, spider):
+        # Tasks are leased by tick, the spider is closed there once the run is drained
+        raise DontCloseSpider
+
+    def engine_stopped(self):
+        if self.queue is None:
+            return
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        if self.opened:
+            for task_id in list(self.in_flight):
+                self.release(task_id)
+            if self.queue.close_worker(self.run, self.worker):
+                merge_parts(self.output_directory, self.spider.name, self.run)
+        self.queue.close()
+
+
+def crawl(role: str, spider_name: str, spider_args: dict, run: str=None, worker: str=None):
+    """
+    Run the coordinator or a worker of a distributed run in this process
+    """
+
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    settings.set("WORKQUEUE_ROLE", role, priority="cmdline")
+    if run is not None:
+        settings.set("WORKQUEUE_RUN", run, priority="cmdline")
+    if worker is not None:
+        settings.set("WORKQUEUE_WORKER", worker, priority="cmdline")
+    process = CrawlerProcess(settings)
+    process.crawl(spider_name, **spider_args)
+    process.start()
+
+
+def run_local(spider_name: str, spider_args: list[str], workers: int, run: str):
+    """
+    Start a coordinator and `workers` workers as subprocesses of this one and wait for them
+    """
+
+    command = [sys.executable, "-m", "secondary_tix.distributed"]
+    args = ["--run", run, *[x for arg in spider_args for x in ("-a", arg)]]
+    processes = [subprocess.Popen([*command, "coordinate", spider_name, *args])]
+    processes += [
+        subprocess.Popen([*command, "work", spider_name, "--worker", f"{socket.gethostname()}-{i}", *args])
+        for i in range(workers)
+    ]
+    start = time.perf_counter()
+    codes = [x.wait() for x in processes]
+    logger.info(f"Run {run} done in {time.perf_counter() - start:.1f}s, exit codes {codes}")
+    return max(codes)
+
+
+def print_status(spider_name: str, run: str=None):
+    from scrapy.utils.project import get_project_settings
+
+    queue = WorkQueue(get_project_settings().get('WORKQUEUE_PATH'), spider_name)
+    run = run or queue.latest_run()
+    if run is None:
+        print(f"No run of {spider_name} in progress")
+        return
+    state = queue.run_state(run)
+    print(f"{spider_name} run {run}: sealed={state[0]} merged={state[1]} {queue.counts(run)}")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "secondary_tix.settings")
+    parser = argparse.ArgumentParser(description="Distributed crawl over a shared work queue")
+    parser.add_argument("command", choices=["run", "coordinate", "work", "status", "merge"])
+    parser.add_argument("spider", help="name of the spider, ex - gametime")
+    parser.add_argument("-a", dest="spider_args", action="append", default=[], help="spider argument, NAME=VALUE")
+    parser.add_argument("--run", help="id of the run, the output folder name")
+    parser.add_argument("--worker", help="id of the worker, host-pid by default")
+    parser.add_argument("--workers", type=int, default=2, help="# of workers started by run")
+    args = parser.parse_args()
+    spider_args = dict(x.split("=", 1) for x in args.spider_args)
+
+    if args.command == "run":
+        run = args.run or datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        sys.exit(run_local(args.spider, args.spider_args, args.workers, run))
+    elif args.command == "coordinate":
+        crawl("coordinator", args.spider, spider_args, args.run)
+    elif args.command == "work":
+        crawl("worker", args.spider, spider_args, args.run, args.worker)
+    elif args.command == "status":
+        print_status(args.spider, args.run)
+    elif args.command == "merge":
+        from scrapy.utils.project import get_project_settings
+        if not args.run:
+            parser.error("merge needs --run")
+        print(f"Merged {merge_parts(get_project_settings().get('OUTPUT_DIRECTORY'), args.spider, args.run)} parts")
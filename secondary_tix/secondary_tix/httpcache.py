@@ -0,0 +1,61 @@
+# HTTP cache of the plain (non browser) requests, ex - the Vivid schedule page and listings API
+#
+# Responses are stored on disk (HTTPCACHE_DIR) with their ETag / Last-Modified. When the same
+# request is made again:
+#   - within HTTPCACHE_FRESHNESS_SECONDS of the stored response, the stored response is used as is
+#   - after that, it is sent with If-None-Match / If-Modified-Since and a 304 from the server
+#     returns the stored response
+# Either way the response carries the "cached" flag, so the spider knows the content didn't change
+# since the last crawl (see HTTPCACHE_SKIP_UNCHANGED). Playwright requests are never cached.
+#
+# On top of Scrapy's httpcache/* stats, httpcache/bytes_saved counts the body bytes that weren't
+# downloaded again and httpcache/not_modified the 304s.
+
+import logging
+from time import time
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import RFC2616Policy
+
+logger = logging.getLogger(__name__)
+
+
+class ConditionalCachePolicy(RFC2616Policy):
+    """
+    RFC2616Policy with a fixed freshness window instead of the server's (or heuristic) one,
+        stale responses are always revalidated with the stored validators
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.freshness_seconds = settings.getfloat('HTTPCACHE_FRESHNESS_SECONDS', 60)
+
+    def should_cache_request(self, request):
+        # Browser pages depend on the scripts they run, only plain HTTP responses are reused
+        if request.meta.get("playwright"):
+            return False
+        return super().should_cache_request(request)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if self._compute_current_age(cachedresponse, request, time()) < self.freshness_seconds:
+            return True
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+
+class ConditionalHttpCacheMiddleware(HttpCacheMiddleware):
+    """
+    Scrapy's HttpCacheMiddleware that also counts the bytes the cache saved
+    """
+
+    def process_request(self, request, spider):
+        cachedresponse = super().process_request(request, spider)
+        if cachedresponse is not None:
+            self.stats.inc_value('httpcache/bytes_saved', len(cachedresponse.body), spider=spider)
+        return cachedresponse
+
+    def process_response(self, request, response, spider):
+        result = super().process_response(request, response, spider)
+        if response.status == 304 and result is not response:
+            self.stats.inc_value('httpcache/not_modified', spider=spider)
+            self.stats.inc_value('httpcache/bytes_saved', len(result.body) - len(response.body), spider=spider)
+        return result
@@ -0,0 +1,255 @@
+# Per-stage crawl instrumentation
+#
+# Time spent in each stage of a crawl is recorded as a latency histogram:
+#
+#   discover_events   finding the events on the team / venue page
+#   load_event        downloading an event page (download latency)
+#   click_quantity    clicking a ticket quantity and waiting for its listings
+#   extract_html      reading the listings out of the page
+#   parse_listings    building the listing items
+#   write_output      writing the items (pipelines)
+#
+# Count / total / max of each stage go into the Scrapy stats as instrument/[stage]/...
+# When the spider closes the histograms and counters are dumped to
+#   [INSTRUMENTATION_DIRECTORY]/[spider]_[file_timestamp].json
+#   [INSTRUMENTATION_PROMETHEUS_DIRECTORY]/secondary_tix_[spider].prom  (node exporter textfile format)
+#
+# ex -
+#   with stage(self, "parse_listings"):
+#       ...
+
+import json
+import logging
+import os
+from bisect import bisect_left
+from pathlib import Path
+from time import perf_counter, time
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+
+STAGES = ["discover_events", "load_event", "click_quantity", "extract_html", "parse_listings", "write_output"]
+# Upper bounds (seconds) of the histogram buckets, the last bucket is +Inf
+BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+METRIC_PREFIX = "secondary_tix"
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets (cumulative counts are built on export)
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """
+        return: list of (le, # observations <= le) like a Prometheus histogram
+        """
+
+        buckets, running = [], 0
+        for bound, count in zip(list(BUCKETS) + ["+Inf"], self.counts):
+            running += count
+            buckets.append((str(bound), running))
+        return buckets
+
+    def quantile(self, q: float):
+        """
+        Upper bound of the bucket holding the q quantile, None if nothing was observed
+        """
+
+        if not self.count:
+            return None
+        rank, running = q * self.count, 0
+        for bound, count in zip(BUCKETS, self.counts):
+            running += count
+            if running >= rank:
+                return bound
+        return self.max
+
+
+class StageTimer:
+    """
+    Context manager that times a block and records it for a stage
+    """
+
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.observe(self.name, perf_counter() - self.start)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_TIMER = _NoopTimer()
+
+
+def stage(spider, name: str):
+    """
+    Time a block of code as one observation of a stage
+    Does nothing if the CrawlInstrumentation extension is not enabled
+
+    spider: spider the work is done for
+    name: name of the stage (see STAGES)
+    """
+
+    instrumentation = getattr(spider, "instrumentation", None)
+    if instrumentation is None:
+        return NOOP_TIMER
+    return StageTimer(instrumentation, name)
+
+
+class CrawlInstrumentation:
+    """
+    Record per-stage latencies and crawl counters, see the top of the module
+    Enabled with INSTRUMENTATION_ENABLED
+    """
+
+    def __init__(self, stats, directory, prometheus_directory):
+        self.stats = stats
+        self.directory = Path(directory)
+        self.prometheus_directory = Path(prometheus_directory)
+        self.histograms = {name: Histogram() for name in STAGES}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INSTRUMENTATION_ENABLED'):
+            raise NotConfigured
+        directory = crawler.settings.get('INSTRUMENTATION_DIRECTORY')
+        extension = cls(
+            crawler.stats,
+            directory,
+            crawler.settings.get('INSTRUMENTATION_PROMETHEUS_DIRECTORY') or directory,
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def observe(self, name: str, seconds: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+        self.stats.inc_value(f'instrument/{name}/count')
+        self.stats.inc_value(f'instrument/{name}/seconds_total', seconds)
+        self.stats.max_value(f'instrument/{name}/seconds_max', seconds)
+
+    def spider_opened(self, spider):
+        # stage() finds the extension through the spider
+        spider.instrumentation = self
+
+    def response_received(self, response, request, spider):
+        self.stats.inc_value('instrument/response_bytes', len(response.body))
+        # Requests tag themselves with the stage their download counts towards
+        name = request.meta.get("instrument_stage")
+        if name is None:
+            return
+        if name == "load_event":
+            self.stats.inc_value('instrument/events')
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            self.observe(name, latency)
+
+    def counters(self) -> dict:
+        get = self.stats.get_value
+        return {
+            "listings": get('item_scraped_count', 0),
+            "events": get('instrument/events', 0),
+            "response_bytes": get('instrument/response_bytes', 0),
+            "browser_bytes": get('browser/bytes', 0),
+            "retries": get('retry/count', 0),
+        }
+
+    def spider_closed(self, spider, reason):
+        file_timestamp = getattr(spider, "file_timestamp", None) or str(int(time()))
+        counters = self.counters()
+        stages = {
+            name: {
+                "count": histogram.count,
+                "seconds_total": round(histogram.total, 6),
+                "seconds_max": round(histogram.max, 6),
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "buckets": dict(histogram.cumulative()),
+            }
+            for name, histogram in self.histograms.items()
+        }
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        json_path = self.directory / f"{spider.name}_{file_timestamp}.json"
+        with open(json_path, "w") as f:
+            json.dump({"spider": spider.name, "run": file_timestamp, "reason": reason,
+                       "counters": counters, "stages": stages}, f, indent=2)
+
+        prometheus_path = self.prometheus_directory / f"{METRIC_PREFIX}_{spider.name}.prom"
+        write_prometheus(prometheus_path, spider.name, self.histograms, counters)
+        logger.info(f"Instrumentation saved to {json_path} and {prometheus_path}")
+
+
+def write_prometheus(path: Path, spider_name: str, histograms: dict, counters: dict):
+    """
+    Write the histograms and counters in the Prometheus text exposition format
+    The file is replaced in one step so the node exporter never reads half a file
+
+    path: .prom file to write
+    spider_name: value of the spider label
+    histograms: stage name -> Histogram
+    counters: counter name -> value
+    """
+
+    labels = f'spider="{spider_name}"'
+    lines = [
+        f"# HELP {METRIC_PREFIX}_stage_duration_seconds Time spent in each stage of the crawl",
+        f"# TYPE {METRIC_PREFIX}_stage_duration_seconds histogram",
+    ]
+    for name, histogram in histograms.items():
+        stage_labels = f'{labels},stage="{name}"'
+        for le, count in histogram.cumulative():
+            lines.append(f'{METRIC_PREFIX}_stage_duration_seconds_bucket{{{stage_labels},le="{le}"}} {count}')
+        lines.append(f"{METRIC_PREFIX}_stage_duration_seconds_sum{{{stage_labels}}} {histogram.total:.6f}")
+        lines.append(f"{METRIC_PREFIX}_stage_duration_seconds_count{{{stage_labels}}} {histogram.count}")
+
+    # Counters of the last run, reset every run so they are exported as gauges
+    for name, value in counters.items():
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_{name} gauge")
+        lines.append(f"{METRIC_PREFIX}_last_run_{name}{{{labels}}} {value}")
+    lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+    lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds{{{labels}}} {time():.0f}")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
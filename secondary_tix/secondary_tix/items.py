@@ -4,6 +4,9 @@
 # https://docs.scrapy.org/en/latest/topics/items.html
 
 import scrapy
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
 
 
 class SecondaryTixItem(scrapy.Item):
@@ -27,6 +30,8 @@ class EventListing(scrapy.Item):
     quantity = scrapy.Field()
     price = scrapy.Field()
     listing_valid_as_of = scrapy.Field()
+    # Not written to the CSVs, used to tell listings apart across runs
+    listing_id = scrapy.Field()
 
 
 class EventListingGametime(scrapy.Item):
@@ -38,7 +43,8 @@ class EventListingGametime(scrapy.Item):
     price = scrapy.Field()
     listing_valid_as_of = scrapy.Field()
 
-EVENT_LISTING_GAMETIME_HEADERS = [
+# Columns of the listings CSVs, in order
+EVENT_LISTING_HEADERS = [
     "event_date",
     "opponent",
     "section",
@@ -47,3 +53,35 @@ EVENT_LISTING_GAMETIME_HEADERS = [
     "price",
     "listing_valid_as_of"
 ]
+EVENT_LISTING_GAMETIME_HEADERS = EVENT_LISTING_HEADERS
+
+# Sent by the spiders with spider, response (of the event's request) and listings (# of listings)
+#     once every listing of an event is parsed, also when there are none (see DeltaSnapshotPipeline)
+event_parsed = object()
+
+
+@dataclass(slots=True)
+class ListingRecord:
+    """
+    Compact listing yielded by both spiders
+    Same fields as EventListing but slotted and typed, so building thousands of them
+        per event is cheap. Pipelines handle it like any other item through ItemAdapter
+    """
+
+    event_date: str
+    opponent: str
+    section: str
+    row: str
+    quantity: int
+    price: Decimal
+    listing_valid_as_of: datetime
+    # Not written to the CSVs, used to tell listings apart across runs
+    listing_id: str = None
+    # Not written to the CSVs, team the event was found for in batch mode (see batch.py)
+    team: str = None
+    # Not written to the CSVs, home team of the event, tells the venue (see normalize.py)
+    home_team: str = None
+    # Not written to the CSVs, run of the listing when it isn't the spider's file_timestamp
+    #     (each poll of the polling daemon is a run, see polling.py)
+    run: str = None
+
@@ -0,0 +1,168 @@
+# Logging helpers
+#
+#   - QueueLoggingExtension moves the root log handlers behind a queue so records are
+#     formatted and written by a background thread instead of the reactor thread
+#   - JsonFormatter writes one JSON object per log line (LOG_JSON = True)
+#   - SampledLogger only logs 1 of every N calls, for lines inside per-listing loops
+
+import copy
+import json
+import queue
+import logging
+import logging.handlers
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.log import LogCounterHandler, get_scrapy_root_handler
+
+_listener = None
+_listener_users = 0
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record
+        ex - {"time": "2023-07-29 18:00:00", "level": "INFO", "logger": "...", "message": "..."}
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredFormatQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the formatting to the listener thread
+    The stock QueueHandler formats the message before putting it on the queue, which
+        is exactly the work we want off the reactor thread
+    Only the arguments are merged into the message here, they can be objects that are
+        still changed after the call (ex - a ListingRecord gets its team once it's built)
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SampledLogger:
+    """
+    Wraps a logger and only emits 1 of every `every` calls
+    Arguments are formatted lazily, nothing is built for the calls that are skipped
+
+    ex -
+        listing_logger = SampledLogger(logger, 100)
+        listing_logger.debug("%s, %s, %s", section, row, price)
+    """
+
+    def __init__(self, logger: logging.Logger, every: int=100):
+        self.logger = logger
+        self.every = max(every, 1)
+        self.calls = 0
+
+    def log(self, level: int, msg: str, *args):
+        self.calls += 1
+        if self.calls % self.every == 1 or self.every == 1:
+            if self.logger.isEnabledFor(level):
+                self.logger.log(level, msg, *args)
+
+    def debug(self, msg: str, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg: str, *args):
+        self.log(logging.INFO, msg, *args)
+
+
+def install_queue_logging(json_format: bool=False):
+    """
+    Move the handlers of the root logger behind a queue
+    Log counters stay on the root logger so Scrapy's log_count stats are still exact
+
+    json_format: switch the moved handlers to the JsonFormatter
+    """
+
+    global _listener, _listener_users, _queue_handler
+
+    root = logging.getLogger()
+    new_handlers = [
+        x for x in root.handlers
+        if not isinstance(x, (LogCounterHandler, logging.handlers.QueueHandler))
+    ]
+    _listener_users += 1
+    if not new_handlers:
+        return
+
+    handlers = new_handlers
+    if _listener is not None:
+        # A new crawler reinstalled Scrapy's root handler, it replaces the one already moved
+        _listener.stop()
+        replaced = get_scrapy_root_handler() in new_handlers
+        handlers = [
+            x for x in _listener.handlers
+            if not (replaced and getattr(x, "_scrapy_root", False))
+        ] + new_handlers
+
+    for handler in new_handlers:
+        root.removeHandler(handler)
+        handler._scrapy_root = handler is get_scrapy_root_handler()
+        if json_format:
+            handler.setFormatter(JsonFormatter(datefmt="%Y-%m-%d %H:%M:%S"))
+
+    if _queue_handler is None:
+        _queue_handler = DeferredFormatQueueHandler(queue.SimpleQueue())
+        root.addHandler(_queue_handler)
+    # Records no handler would write are dropped before they reach the queue
+    _queue_handler.setLevel(min(x.level for x in handlers))
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def uninstall_queue_logging():
+    """
+    Write out the queued records and put the handlers back on the root logger
+        once the last crawler using the queue is done
+    """
+
+    global _listener, _listener_users, _queue_handler
+
+    _listener_users -= 1
+    if _listener_users > 0 or _listener is None:
+        return
+
+    _listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener = None
+    _queue_handler = None
+
+
+class QueueLoggingExtension:
+    """
+    Write the logs from a background thread for the duration of the crawl
+    Enabled with LOG_QUEUE_ENABLED, LOG_JSON switches the output to JSON lines
+    """
+
+    def __init__(self, json_format: bool):
+        install_queue_logging(json_format)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('LOG_QUEUE_ENABLED'):
+            raise NotConfigured
+        extension = cls(crawler.settings.getbool('LOG_JSON'))
+        crawler.signals.connect(extension.engine_stopped, signal=signals.engine_stopped)
+        return extension
+
+    def engine_stopped(self):
+        uninstall_queue_logging()
@@ -105,36 +105,141 @@ from itemadapter import is_item, ItemAdapter
 
 
 
-from urllib.parse import urlencode
-from random import randint
+import json
+import time
+import random
+import logging
+from itertools import cycle
+from pathlib import Path
 import requests
+from urllib.parse import urlencode
+from twisted.internet.threads import deferToThread
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+# Used until the ScrapeOps list has been downloaded once, or when it can't be (offline runs)
+FALLBACK_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36 Edg/114.0.1823.82",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/115.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5.2 Safari/605.1.15",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:109.0) Gecko/20100101 Firefox/115.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 13; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Mobile Safari/537.36",
+]
+
 
 class ScrapeOpsFakeUserAgentMiddleware:
+    """
+    Attach a user agent from the ScrapeOps list to every request
+
+    The list is cached in USER_AGENT_CACHE_PATH so starting a crawl doesn't wait on ScrapeOps
+    When the cache is older than USER_AGENT_CACHE_TTL seconds (or missing) it is refreshed
+        in a thread once the spider opens, requests use the cached / fallback list meanwhile
+    Disabled when SCRAPEOPS_FAKE_USER_AGENT_ENABLED is False or there is no SCRAPEOPS_API_KEY
+    """
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(crawler.settings)
+        middleware = cls(crawler.settings, crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        return middleware
     
-    def __init__(self, settings):
+    def __init__(self, settings, stats=None):
         self.scrapeops_api_key = settings.get('SCRAPEOPS_API_KEY')
         self.scrapeops_endpoint = settings.get('SCRAPEOPS_FAKE_USER_AGENT_ENDPOINT', 'http://headers.scrapeops.io/v1/user-agents?') 
-        self.scrapeops_fake_user_agents_active = settings.get('SCRAPEOPS_FAKE_USER_AGENT_ENABLED', False)
+        self.scrapeops_fake_user_agents_active = settings.getbool('SCRAPEOPS_FAKE_USER_AGENT_ENABLED', False)
         self.scrapeops_num_results = settings.get('SCRAPEOPS_NUM_RESULTS')
-        self.headers_list = []
-        self._get_user_agents_list()
+        self.scrapeops_timeout = settings.getfloat('SCRAPEOPS_REQUEST_TIMEOUT', 10)
         self._scrapeops_fake_user_agents_enabled()
+        if not self.scrapeops_fake_user_agents_active:
+            raise NotConfigured
+
+        self.stats = stats
+        self.cache_path = Path(settings.get('USER_AGENT_CACHE_PATH'))
+        self.cache_ttl = settings.getint('USER_AGENT_CACHE_TTL', 24 * 60 * 60)
+        self.refreshing = False
+
+        user_agents, fetched_at = self._load_cache()
+        self.cache_stale = time.time() - fetched_at > self.cache_ttl
+        self._set_user_agents(user_agents or FALLBACK_USER_AGENTS)
+        self._inc_stat('user_agents/cache_hit' if user_agents else 'user_agents/fallback')
+
+    def _inc_stat(self, key: str):
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+    def _load_cache(self) -> tuple[list[str], float]:
+        """
+        return: cached user agents and the time they were downloaded, ([], 0) if there is no usable cache
+        """
+
+        try:
+            cache = json.loads(self.cache_path.read_text())
+            return cache["user_agents"], cache["fetched_at"]
+        except FileNotFoundError:
+            return [], 0
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable user agent cache {self.cache_path}: {e!r}")
+            return [], 0
+
+    def _save_cache(self, user_agents: list[str]):
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"fetched_at": time.time(), "user_agents": user_agents}))
+        tmp_path.replace(self.cache_path)
+
+    def _set_user_agents(self, user_agents: list[str]):
+        # Shuffled once, then handed out in turn
+        user_agents = list(user_agents)
+        random.shuffle(user_agents)
+        self.user_agents_list = user_agents
+        self._user_agents = cycle(user_agents)
+
+    def _get_user_agents_list(self) -> list[str]:
+        """
+        Download the user agents from ScrapeOps (blocking, run in a thread)
+        """
 
-    def _get_user_agents_list(self):
         payload = {'api_key': self.scrapeops_api_key}
         if self.scrapeops_num_results is not None:
             payload['num_results'] = self.scrapeops_num_results
-        response = requests.get(self.scrapeops_endpoint, params=urlencode(payload))
-        json_response = response.json()
-        self.user_agents_list = json_response.get('result', [])
+        response = requests.get(self.scrapeops_endpoint, params=urlencode(payload), timeout=self.scrapeops_timeout)
+        response.raise_for_status()
+        return response.json().get('result', [])
+
+    def spider_opened(self, spider):
+        if self.cache_stale and not self.refreshing:
+            self.refreshing = True
+            d = deferToThread(self._get_user_agents_list)
+            d.addCallbacks(self._refreshed, self._refresh_failed)
+
+    def _refreshed(self, user_agents: list[str]):
+        self.refreshing = False
+        if not user_agents:
+            logger.warning("ScrapeOps returned no user agents, keeping the current list")
+            self._inc_stat('user_agents/refresh_failures')
+            return
+        self._set_user_agents(user_agents)
+        self.cache_stale = False
+        self._inc_stat('user_agents/refreshes')
+        try:
+            self._save_cache(user_agents)
+        except OSError as e:
+            logger.warning(f"Could not save the user agent cache {self.cache_path}: {e!r}")
+        logger.info(f"Refreshed {len(user_agents)} user agents from ScrapeOps")
+
+    def _refresh_failed(self, failure):
+        self.refreshing = False
+        self._inc_stat('user_agents/refresh_failures')
+        logger.warning(f"Could not refresh the user agents from ScrapeOps, keeping the current list: {failure.value!r}")
 
     def _get_random_user_agent(self):
-        random_index = randint(0, len(self.user_agents_list) - 1)
-        return self.user_agents_list[random_index]
+        return next(self._user_agents)
 
     def _scrapeops_fake_user_agents_enabled(self):
         if self.scrapeops_api_key is None or self.scrapeops_api_key == '' or self.scrapeops_fake_user_agents_active == False:
@@ -146,5 +251,4 @@ class ScrapeOpsFakeUserAgentMiddleware:
         random_user_agent = self._get_random_user_agent()
         request.headers['User-Agent'] = random_user_agent
 
-        print("************NEW HEADER ATTACHED****************")
-        print(request.headers["User-Agent"])
\ No newline at end of file
+        logger.debug("User-Agent attached to %s: %s", request.url, random_user_agent)
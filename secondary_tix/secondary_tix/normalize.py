@@ -0,0 +1,394 @@
+# Listings of both marketplaces in one index of equivalent seats
+#
+# Vivid lists the raw section / row codes (ex - "112", "5") and Gametime the display text
+# (ex - "Section 112", "Row 5"), and some venues name their levels instead (ex - "Field Box 12"
+# and "12FD" are the same seat at Dodger Stadium). Sections and rows are normalized with the rules
+# of the venue (VENUES, the venue of an event is the one of its home team) so the listings of
+# both marketplaces can be compared directly.
+#
+# ListingIndex keeps the cheapest listing of every marketplace per
+#   (venue, event_date, normalized section, normalized row, quantity)
+# built as the items stream in (see NormalizedIndexPipeline) and saved to
+# NORMALIZED_INDEX_DIRECTORY/[marketplace].json when a spider closes, so the next run starts
+# with the listings of every marketplace. The venue is part of the key since a batch crawl has
+# several games on the same date.
+#
+# ex -
+#   index = normalize.ListingIndex.load(settings.NORMALIZED_INDEX_DIRECTORY)
+#   index.cheapest("dodger-stadium", "2023-07-29", "Field Box 12", "Row 5", 2)
+#
+# Seats listed on more than one marketplace for an event, run from the folder that contains scrapy.cfg:
+#   python -m secondary_tix.normalize dodgers 2023-07-29 [--quantity 2]
+
+import os
+import re
+import json
+import argparse
+import logging
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+# Venue of the events whose home team isn't in VENUES, sections are only cleaned up
+UNKNOWN_VENUE = "unknown"
+
+# teams: home teams of the venue, as in the event titles / URLs (ex - "Dodgers", "giants-at-dodgers")
+# levels: level names and codes -> code that is added to the section number, for venues that
+#     reuse the same section numbers on every level. "" to only drop the level name
+VENUES = {
+    "dodger-stadium": {
+        "teams": ["dodgers"],
+        "levels": {
+            "TOP DECK": "TD",
+            "RESERVE": "RS",
+            "RESERVED": "RS",
+            "LOGE BOX": "LG",
+            "LOGE": "LG",
+            "FIELD BOX": "FD",
+            "FIELD": "FD",
+            "PAVILION": "PV",
+            "TD": "TD",
+            "RS": "RS",
+            "LG": "LG",
+            "FD": "FD",
+            "PV": "PV",
+        },
+    },
+    "oracle-park": {
+        "teams": ["giants"],
+        "levels": {
+            "LOWER BOX": "",
+            "FIELD CLUB": "",
+            "CLUB LEVEL": "",
+            "VIEW RESERVED": "",
+            "VIEW BOX": "",
+            "VIEW LEVEL": "",
+            "BLEACHERS": "",
+            "ARCADE": "",
+        },
+    },
+}
+
+# home team slug -> venue
+TEAM_VENUES = {team: venue for venue, config in VENUES.items() for team in config["teams"]}
+# Level name or code of every venue (longest first so "LOGE BOX" wins over "LOGE"),
+# or a code right after the number (ex - "12FD")
+LEVEL_PATTERNS = {
+    venue: re.compile(
+        r"\b(" + "|".join(re.escape(x) for x in sorted(config["levels"], key=len, reverse=True)) + r")\b"
+        + "".join(
+            r"|(?<=\d)(" + "|".join(re.escape(x) for x in codes) + r")\b"
+            for codes in [sorted({x for x in config["levels"].values() if x})] if codes
+        )
+    )
+    for venue, config in VENUES.items() if config["levels"]
+}
+SECTION_PREFIX = re.compile(r"^(SECTION|SECT|SEC)\b\.?\s*#?\s*")
+ROW_PREFIX = re.compile(r"^ROW\b\.?\s*")
+NUMBER = re.compile(r"\d+")
+
+
+def team_slug(team: str) -> str:
+    """
+    ex - "Los Angeles Dodgers" -> "los-angeles-dodgers"
+    """
+
+    return re.sub(r"[^a-z0-9]+", "-", team.lower()).strip("-")
+
+
+@lru_cache(maxsize=1024)
+def venue_for(home_team: str) -> str:
+    """
+    Venue of the events of a home team, ex - "Dodgers" or "los-angeles-dodgers" -> "dodger-stadium"
+
+    home_team: home team as in the event title or URL, None if it isn't known
+    """
+
+    if not home_team:
+        return UNKNOWN_VENUE
+    slug = team_slug(home_team)
+    for team, venue in TEAM_VENUES.items():
+        if slug == team or slug.endswith(f"-{team}"):
+            return venue
+    return UNKNOWN_VENUE
+
+
+@lru_cache(maxsize=65536)
+def normalize_section(venue: str, section: str) -> str:
+    """
+    Section as the same text on every marketplace
+        ex - "Section 112" / "112" -> "112", "Field Box 12" / "12FD" -> "12FD" at dodger-stadium
+    Normalizing a normalized section gives it back unchanged
+
+    venue: venue of the event, see venue_for
+    section: section as listed by the marketplace
+    """
+
+    text = " ".join(str(section).upper().split())
+    text = SECTION_PREFIX.sub("", text)
+    pattern = LEVEL_PATTERNS.get(venue)
+    if pattern is not None:
+        level = pattern.search(text)
+        number = NUMBER.search(text)
+        if level and number:
+            return f"{int(number.group())}{VENUES[venue]['levels'][level.group(level.lastindex)]}"
+    if text.isdigit():
+        return str(int(text))
+    return text
+
+
+@lru_cache(maxsize=4096)
+def normalize_row(row: str) -> str:
+    """
+    ex - "Row 05" / "5" -> "5", "Row AA" -> "AA"
+    """
+
+    text = ROW_PREFIX.sub("", " ".join(str(row).upper().split()))
+    if text.isdigit():
+        return str(int(text))
+    return text
+
+
+@dataclass(slots=True)
+class Offer:
+    """
+    Cheapest listing of a marketplace for a seat of the index
+    """
+
+    marketplace: str
+    price: float
+    section: str
+    row: str
+    listing_id: str = None
+
+
+class ListingIndex:
+    """
+    Cheapest listing of every marketplace per (venue, event_date, section, row, quantity)
+
+    Listings of a marketplace replace the ones of an older crawl of the same event and quantity:
+        a listing newer than the ones in the index drops them first (listing_valid_as_of),
+        so listings that are gone don't stay around as the cheapest
+    """
+
+    def __init__(self):
+        # (venue, event_date, section, row, quantity) -> {marketplace: Offer}
+        self.offers = {}
+        # (venue, event_date, section, quantity) -> sorted [(price, row, marketplace)] of the offers
+        self.sections = {}
+        # (marketplace, venue, event_date, quantity) -> listing_valid_as_of of its listings
+        self.crawled_at = {}
+        # (marketplace, venue, event_date, quantity) -> keys of self.offers with an offer of it
+        self.crawl_keys = {}
+
+    def __len__(self):
+        return len(self.offers)
+
+    def add(self, marketplace: str, listing: dict) -> bool:
+        """
+        Add a listing, kept if it is the cheapest of its marketplace for the seat
+
+        marketplace: name of the spider the listing is from
+        listing: listing dict (or ItemAdapter) with the ListingRecord fields
+        return: True if the listing is now in the index
+        """
+
+        venue = venue_for(listing.get("home_team"))
+        quantity = int(listing["quantity"])
+        crawl = (marketplace, venue, listing["event_date"], quantity)
+        crawled_at = str(listing["listing_valid_as_of"])
+        last_crawled_at = self.crawled_at.get(crawl)
+        if last_crawled_at is not None and crawled_at != last_crawled_at:
+            if crawled_at < last_crawled_at:
+                return False
+            self.drop(crawl)
+        self.crawled_at[crawl] = crawled_at
+
+        offer = Offer(
+            marketplace, float(listing["price"]), str(listing["section"]), str(listing["row"]), listing.get("listing_id")
+        )
+        return self._add_offer(crawl, offer)
+
+    def _add_offer(self, crawl: tuple, offer: Offer) -> bool:
+        marketplace, venue, event_date, quantity = crawl
+        section = normalize_section(venue, offer.section)
+        row = normalize_row(offer.row)
+        key = (venue, event_date, section, row, quantity)
+        offers = self.offers.setdefault(key, {})
+        current = offers.get(offer.marketplace)
+        if current is not None and current.price <= offer.price:
+            return False
+
+        section_offers = self.sections.setdefault((venue, event_date, section, quantity), [])
+        if current is not None:
+            del section_offers[bisect_left(section_offers, (current.price, row, marketplace))]
+        offers[marketplace] = offer
+        insort(section_offers, (offer.price, row, marketplace))
+        self.crawl_keys.setdefault(crawl, set()).add(key)
+        return True
+
+    def drop(self, crawl: tuple):
+        """
+        Remove the listings of a crawl
+
+        crawl: (marketplace, venue, event_date, quantity)
+        """
+
+        marketplace = crawl[0]
+        for key in self.crawl_keys.pop(crawl, ()):
+            offers = self.offers[key]
+            offer = offers.pop(marketplace)
+            section_key = (*key[:3], key[4])
+            section_offers = self.sections[section_key]
+            del section_offers[bisect_left(section_offers, (offer.price, key[3], marketplace))]
+            if not section_offers:
+                del self.sections[section_key]
+            if not offers:
+                del self.offers[key]
+        self.crawled_at.pop(crawl, None)
+
+    def seat_offers(self, venue: str, event_date: str, section: str, row: str, quantity: int) -> dict:
+        """
+        Cheapest listing of every marketplace for a seat
+
+        venue: venue of the event, see venue_for
+        event_date: YYYY-MM-DD of the event
+        section: section as listed by any marketplace, or normalized
+        row: row as listed by any marketplace, or normalized
+        quantity: # of tickets
+        return: {marketplace: Offer}
+        """
+
+        key = (venue, event_date, normalize_section(venue, section), normalize_row(row), int(quantity))
+        return dict(self.offers.get(key, {}))
+
+    def cheapest(self, venue: str, event_date: str, section: str, row: str, quantity: int) -> Offer:
+        """
+        Cheapest listing of a seat across the marketplaces, None if it isn't listed
+            Arguments like seat_offers
+        """
+
+        offers = self.seat_offers(venue, event_date, section, row, quantity)
+        return min(offers.values(), key=lambda offer: offer.price, default=None)
+
+    def cheapest_in_section(self, venue: str, event_date: str, section: str, quantity: int) -> tuple:
+        """
+        Cheapest listing of a section across the rows and marketplaces
+
+        return: (price, normalized row, marketplace), None if the section isn't listed
+        """
+
+        section_offers = self.sections.get((venue, event_date, normalize_section(venue, section), int(quantity)))
+        return section_offers[0] if section_offers else None
+
+    def marketplaces(self) -> set:
+        return {crawl[0] for crawl in self.crawled_at}
+
+    def save(self, directory, marketplace: str):
+        """
+        Save the listings of a marketplace to [directory]/[marketplace].json, past events are left out
+
+        directory: NORMALIZED_INDEX_DIRECTORY
+        marketplace: name of the spider
+        """
+
+        today = date.today().isoformat()
+        crawls = [
+            crawl for crawl in self.crawled_at
+            if crawl[0] == marketplace and crawl[2] >= today
+        ]
+        data = {
+            "version": INDEX_VERSION,
+            "marketplace": marketplace,
+            "crawls": [
+                {
+                    "venue": venue,
+                    "event_date": event_date,
+                    "quantity": quantity,
+                    "crawled_at": self.crawled_at[(marketplace, venue, event_date, quantity)],
+                    "offers": [
+                        (offer.price, offer.section, offer.row, offer.listing_id)
+                        for offer in (
+                            self.offers[key][marketplace]
+                            for key in self.crawl_keys.get((marketplace, venue, event_date, quantity), ())
+                        )
+                    ],
+                }
+                for marketplace, venue, event_date, quantity in crawls
+            ],
+        }
+        path = Path(directory) / f"{marketplace}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and moved so a reader never sees a partial file
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_text(json.dumps(data))
+        os.replace(temp_path, path)
+        logger.info(f"Saved {sum(len(x['offers']) for x in data['crawls'])} {marketplace} seats to {path}")
+
+    def load_marketplace(self, path):
+        """
+        Add the listings saved by save, an unreadable or outdated file is skipped
+
+        path: [directory]/[marketplace].json
+        """
+
+        try:
+            data = json.loads(Path(path).read_text())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read the listing index {path}: {e!r}")
+            return
+        if data.get("version") != INDEX_VERSION:
+            logger.info(f"Skipping the listing index {path} of another version")
+            return
+        marketplace = data["marketplace"]
+        for crawl_data in data["crawls"]:
+            crawl = (marketplace, crawl_data["venue"], crawl_data["event_date"], crawl_data["quantity"])
+            self.drop(crawl)
+            self.crawled_at[crawl] = crawl_data["crawled_at"]
+            for offer in crawl_data["offers"]:
+                self._add_offer(crawl, Offer(marketplace, *offer))
+
+    @classmethod
+    def load(cls, directory) -> "ListingIndex":
+        """
+        Index of the listings of every marketplace saved in a directory
+
+        directory: NORMALIZED_INDEX_DIRECTORY
+        """
+
+        index = cls()
+        for path in sorted(Path(directory).glob("*.json")):
+            index.load_marketplace(path)
+        return index
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "secondary_tix.settings")
+    from scrapy.utils.project import get_project_settings
+
+    parser = argparse.ArgumentParser(description="Seats listed on more than one marketplace for an event")
+    parser.add_argument("home_team", help="home team of the event, ex - dodgers")
+    parser.add_argument("event_date", help="YYYY-MM-DD of the event")
+    parser.add_argument("--quantity", type=int, help="only this # of tickets")
+    args = parser.parse_args()
+
+    index = ListingIndex.load(get_project_settings().get("NORMALIZED_INDEX_DIRECTORY"))
+    venue = venue_for(args.home_team)
+    seats = sorted(
+        (key, offers) for key, offers in index.offers.items()
+        if key[:2] == (venue, args.event_date) and len(offers) > 1
+        and (args.quantity is None or key[4] == args.quantity)
+    )
+    print(f"{venue} {args.event_date}: {len(seats)} seats on more than one of {sorted(index.marketplaces())}")
+    for (_, _, section, row, quantity), offers in seats:
+        ranked = sorted(offers.values(), key=lambda offer: offer.price)
+        print(
+            f"  section {section:<8} row {row:<5} x{quantity}  "
+            + "  ".join(f"{offer.marketplace} {offer.price:.2f}" for offer in ranked)
+            + f"  saves {ranked[-1].price - ranked[0].price:.2f}"
+        )
@@ -0,0 +1,195 @@
+# HTML parser backends for the Gametime pages
+#
+#   "lxml" (default)  lxml tree + CSS selectors compiled to XPath once when the parser is built
+#   "soup"            BeautifulSoup html.parser, only the containers we read are built (SoupStrainer)
+#                     Slower, kept as a fallback and to check the lxml output against
+#
+# Both take the same selectors and return the same values
+#
+# ex -
+#   parser = get_parser("lxml", GAMES_SECTION, LISTING_SELECTORS["listing"], [section_row, price])
+#   hrefs = parser.event_links(html)
+#   listing_rows, title = parser.listings_page(html)
+#
+# ParserPool runs the same methods in a pool of processes so a multi-megabyte page doesn't
+# block the reactor (and every page and download in flight) while it is parsed
+#   pool = ParserPool(2, "lxml", GAMES_SECTION, LISTING_SELECTORS["listing"], [section_row, price])
+#   hrefs = await pool.run("event_links", html)
+
+import re
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import lxml.html
+from lxml.cssselect import CSSSelector
+from bs4 import BeautifulSoup, SoupStrainer
+
+# "div._2h7x6MAQ0R9rPi2f7MFJXo" -> ("div", "_2h7x6MAQ0R9rPi2f7MFJXo")
+SIMPLE_SELECTOR = re.compile(r"^(\w+)\.([\w-]+)$")
+
+
+class LxmlParser:
+    """
+    Parse with lxml, selectors are compiled to XPath once
+    """
+
+    def __init__(self, links_container: str, listing: str, fields: list[str]):
+        """
+        links_container: selector of the element that holds the event links
+        listing: selector of a single listing
+        fields: selectors of the text to read in a listing, ex - section / row and price
+        """
+
+        self.links = CSSSelector(f"{links_container} a", translator="html")
+        self.listing = CSSSelector(listing, translator="html")
+        self.fields = [CSSSelector(x, translator="html") for x in fields]
+
+    def event_links(self, html: str) -> list[str]:
+        """
+        href of every link in the links container
+        """
+
+        return [a.get("href") for a in self.links(lxml.html.document_fromstring(html)) if a.get("href")]
+
+    def listings_page(self, html: str) -> tuple[list[tuple], str]:
+        """
+        Text of the fields of every listing and the title of the page
+        """
+
+        doc = lxml.html.document_fromstring(html)
+        rows = [
+            tuple(field(listing)[0].text_content() for field in self.fields)
+            for listing in self.listing(doc)
+        ]
+        title = doc.find(".//title")
+        return rows, title.text_content() if title is not None else ""
+
+
+class SoupParser:
+    """
+    Parse with BeautifulSoup html.parser
+    Only the links container / the listings and the title are built into the tree
+    """
+
+    def __init__(self, links_container: str, listing: str, fields: list[str]):
+        """
+        links_container: selector of the element that holds the event links, "tag.class"
+        listing: selector of a single listing, "tag.class"
+        fields: selectors of the text to read in a listing, ex - section / row and price
+        """
+
+        self.listing = listing
+        self.fields = fields
+        self.links_strainer = SoupStrainer(*self._tag_class(links_container))
+
+        listing_tag, listing_class = self._tag_class(listing)
+
+        def listing_or_title(name, attrs) -> bool:
+            if name == "title":
+                return True
+            classes = attrs.get("class") or []
+            if isinstance(classes, str):
+                classes = classes.split()
+            return name == listing_tag and listing_class in classes
+
+        self.listings_strainer = SoupStrainer(listing_or_title)
+
+    @staticmethod
+    def _tag_class(selector: str) -> tuple[str, str]:
+        match = SIMPLE_SELECTOR.match(selector)
+        if match is None:
+            raise ValueError(f"SoupParser containers must be 'tag.class' selectors, got {selector!r}")
+        return match.group(1), match.group(2)
+
+    def event_links(self, html: str) -> list[str]:
+        """
+        href of every link in the links container
+        """
+
+        soup = BeautifulSoup(html, "html.parser", parse_only=self.links_strainer)
+        return [a["href"] for a in soup.find_all("a") if a.get("href")]
+
+    def listings_page(self, html: str) -> tuple[list[tuple], str]:
+        """
+        Text of the fields of every listing and the title of the page
+        """
+
+        soup = BeautifulSoup(html, "html.parser", parse_only=self.listings_strainer)
+        rows = [
+            tuple(listing.select_one(field).text for field in self.fields)
+            for listing in soup.select(self.listing)
+        ]
+        return rows, soup.title.text if soup.title is not None else ""
+
+
+PARSERS = {
+    "lxml": LxmlParser,
+    "soup": SoupParser,
+}
+
+
+def get_parser(name: str, links_container: str, listing: str, fields: list[str]):
+    """
+    Build the parser backend `name` (see PARSERS) for the given selectors
+    """
+
+    if name not in PARSERS:
+        raise ValueError(f"Unknown HTML parser {name!r}, expected one of {list(PARSERS)}")
+    return PARSERS[name](links_container, listing, fields)
+
+
+# Parser of a ParserPool process, built once per process by _init_pool_process
+_pool_parser = None
+
+
+def _init_pool_process(name: str, links_container: str, listing: str, fields: list[str]):
+    global _pool_parser
+    _pool_parser = get_parser(name, links_container, listing, fields)
+
+
+def _run_in_pool_process(method: str, html: str):
+    return getattr(_pool_parser, method)(html)
+
+
+class ParserPool:
+    """
+    Parser methods run in a pool of processes
+    The page goes to a process as a string and the plain lists / tuples the parser returns come back
+    """
+
+    def __init__(self, processes: int, name: str, links_container: str, listing: str, fields: list[str]):
+        """
+        processes: # of processes of the pool
+        name, links_container, listing, fields: arguments of get_parser
+        """
+
+        if name not in PARSERS:
+            raise ValueError(f"Unknown HTML parser {name!r}, expected one of {list(PARSERS)}")
+        # spawn, forking the crawler would copy the reactor, the browser connections and the logging threads
+        self.executor = ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_pool_process,
+            initargs=(name, links_container, listing, fields),
+        )
+
+    def submit(self, method: str, html: str):
+        """
+        Start a parser method in the pool
+
+        method: "event_links" or "listings_page"
+        html: page to parse
+        return: concurrent.futures.Future of the result
+        """
+
+        return self.executor.submit(_run_in_pool_process, method, html)
+
+    async def run(self, method: str, html: str):
+        """
+        Parser method run in the pool, awaited without blocking the event loop
+        """
+
+        return await asyncio.wrap_future(self.submit(method, html))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
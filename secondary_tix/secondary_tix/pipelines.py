@@ -3,11 +3,382 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import csv
+import logging
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from secondary_tix.items import EVENT_LISTING_HEADERS
+from secondary_tix.spiders.utility import save_to_parquet
+from secondary_tix.delta import save_delta_snapshot
+from secondary_tix import store
+from secondary_tix.normalize import ListingIndex
+from secondary_tix.polling import poll_finished
+from secondary_tix.items import event_parsed
+from secondary_tix.instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+
+def output_name(spider, adapter) -> str:
+    """
+    Folder of the spider's output, [spider]/[team] in batch mode (see batch.py)
+        so every team keeps the layout of a single team run
+    """
+
+    team = adapter.get("team") if getattr(spider, "batch", False) else None
+    return f"{spider.name}/{team}" if team else spider.name
+
+
+def listing_run(spider, adapter) -> str:
+    """
+    Run of a listing, its poll in the polling daemon (see polling.py), the spider's file_timestamp otherwise
+    """
+
+    return adapter.get("run") or spider.file_timestamp
+
+
+class CsvWriterPipeline:
+    """
+    Write the listings to output/[spider]/[file_timestamp]/[YYYYMMDD].csv
+        (same layout as utility.save_to_csv), output/[spider]/[team]/... in batch mode
+    Workers of a distributed run write [YYYYMMDD].part-[worker].csv files that are merged
+        once the run is over (see distributed.py)
+
+    One file handle is kept open per (spider, run, event date) for the whole crawl
+    Rows are buffered in memory and flushed to disk every CSV_FLUSH_EVERY_ITEMS items
+    Handles are flushed and closed when the spider closes, or when their poll is done in the polling daemon
+    """
+
+    def __init__(self, output_directory, buffer_size: int, flush_every: int, stats):
+        self.output_directory = output_directory
+        self.buffer_size = buffer_size
+        self.flush_every = flush_every
+        self.stats = stats
+        # (spider, output name, run, event_date_str) -> [file, csv writer, # rows since last flush]
+        self.writers = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # The DeltaSnapshotPipeline writes the listings instead
+        if crawler.settings.getbool('DELTA_SNAPSHOTS_ENABLED'):
+            raise NotConfigured
+        pipeline = cls(
+            crawler.settings.get('OUTPUT_DIRECTORY'),
+            crawler.settings.getint('CSV_WRITE_BUFFER_BYTES', 1024 * 1024),
+            crawler.settings.getint('CSV_FLUSH_EVERY_ITEMS', 5000),
+            crawler.stats,
+        )
+        crawler.signals.connect(pipeline.poll_finished, signal=poll_finished)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        event_date_str = adapter["event_date"].replace("-", "")
+        key = (spider.name, output_name(spider, adapter), listing_run(spider, adapter), event_date_str)
+
+        with stage(spider, "write_output"):
+            writer = self.writers.get(key)
+            if writer is None:
+                writer = self.writers[key] = self._open(*key[1:], getattr(spider, "output_part", None))
+
+            writer[1].writerow([adapter.get(field) for field in EVENT_LISTING_HEADERS])
+            writer[2] += 1
+            self.stats.inc_value('csv_writer/items')
+            if writer[2] >= self.flush_every:
+                self._flush(writer)
+
+        return item
+
+    def _open(self, website: str, file_timestamp: str, event_date_str: str, part: str=None) -> list:
+        """
+        Open the CSV for an event and write the header row if the file is new
+
+        website: name of the website the listings are from (see output_name)
+        file_timestamp: timestamp of the run, used for the folder name
+        event_date_str: YYYYMMDD of the event the listings are for
+        part: id of the worker in a distributed run, None otherwise
+        return: [file, csv writer, # rows since last flush]
+        """
+
+        output_dir = self.output_directory / f"output/{website}/{file_timestamp}"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        full_path = output_dir / (f"{event_date_str}.part-{part}.csv" if part else f"{event_date_str}.csv")
+
+        logger.info(f"Saving to {full_path}")
+        file = open(full_path, 'a', buffering=self.buffer_size)
+        writer = csv.writer(file)
+        if file.tell() == 0:
+            writer.writerow(EVENT_LISTING_HEADERS)
+        self.stats.inc_value('csv_writer/files_opened')
+        return [file, writer, 0]
+
+    def _flush(self, writer: list):
+        writer[0].flush()
+        writer[2] = 0
+        self.stats.inc_value('csv_writer/flushes')
+
+    def poll_finished(self, spider, run: str, event_dates: list):
+        event_date_strs = [x.replace("-", "") for x in event_dates]
+        self._close(spider, [
+            key for key in self.writers if key[0] == spider.name and key[2] == run and key[3] in event_date_strs
+        ])
+
+    def spider_closed(self, spider):
+        self._close(spider, [key for key in self.writers if key[0] == spider.name])
+
+    def _close(self, spider, keys: list):
+        for key in keys:
+            writer = self.writers.pop(key)
+            with stage(spider, "write_output"):
+                self._flush(writer)
+                writer[0].close()
+
+
+class ParquetWriterPipeline:
+    """
+    Write the listings as typed, compressed parquet files next to the CSVs
+        output/parquet/spider=[spider]/event_date=[YYYY-MM-DD]/[file_timestamp].parquet
+        with a team=[team] partition under the event date in batch mode
+
+    Listings are kept in memory per event and each event is written as one file
+        when the spider closes, or when its poll is done in the polling daemon
+    Enabled with PARQUET_OUTPUT_ENABLED, requires pyarrow
+    """
+
+    def __init__(self, output_directory, row_group_size: int, compression: str, stats):
+        self.output_directory = output_directory
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.stats = stats
+        # (spider, run, event_date, team) -> list of listing dicts
+        self.listings = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PARQUET_OUTPUT_ENABLED'):
+            raise NotConfigured
+        pipeline = cls(
+            crawler.settings.get('OUTPUT_DIRECTORY'),
+            crawler.settings.getint('PARQUET_ROW_GROUP_SIZE', 65536),
+            crawler.settings.get('PARQUET_COMPRESSION', 'zstd'),
+            crawler.stats,
+        )
+        crawler.signals.connect(pipeline.poll_finished, signal=poll_finished)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
 
-class SecondaryTixPipeline:
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        team = adapter.get("team") if getattr(spider, "batch", False) else None
+        key = (spider.name, listing_run(spider, adapter), adapter["event_date"], team)
+        self.listings.setdefault(key, []).append(adapter.asdict())
         return item
+
+    def poll_finished(self, spider, run: str, event_dates: list):
+        self._write(spider, [
+            key for key in self.listings if key[0] == spider.name and key[1] == run and key[2] in event_dates
+        ])
+
+    def spider_closed(self, spider):
+        self._write(spider, [key for key in self.listings if key[0] == spider.name])
+
+    def _write(self, spider, keys: list):
+        for key in keys:
+            data = self.listings.pop(key)
+            with stage(spider, "write_output"):
+                save_to_parquet(
+                    self.output_directory,
+                    key[1],
+                    spider.name,
+                    key[2],
+                    data,
+                    row_group_size=self.row_group_size,
+                    compression=self.compression,
+                    team=key[3],
+                )
+            self.stats.inc_value('parquet_writer/files')
+            self.stats.inc_value('parquet_writer/items', len(data))
+
+
+class DeltaSnapshotPipeline:
+    """
+    Only write the listings that appeared, disappeared or changed price since
+        the last run, with a full checkpoint every DELTA_CHECKPOINT_EVERY runs
+    See delta.py for the layout and how to rebuild a snapshot
+
+    Listings are kept in memory per event and diffed when the spider closes,
+        or when their poll is done in the polling daemon
+    An event that comes back without listings gets a delta that removes its last listings
+    Enabled with DELTA_SNAPSHOTS_ENABLED, replaces the CsvWriterPipeline
+    """
+
+    def __init__(self, output_directory, checkpoint_every: int, stats):
+        self.output_directory = output_directory
+        self.checkpoint_every = checkpoint_every
+        self.stats = stats
+        # (spider, output name, run, event_date_str) -> list of listing dicts
+        self.listings = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('DELTA_SNAPSHOTS_ENABLED'):
+            raise NotConfigured
+        pipeline = cls(
+            crawler.settings.get('OUTPUT_DIRECTORY'),
+            crawler.settings.getint('DELTA_CHECKPOINT_EVERY', 12),
+            crawler.stats,
+        )
+        crawler.signals.connect(pipeline.poll_finished, signal=poll_finished)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipeline.event_parsed, signal=event_parsed)
+        return pipeline
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        event_date_str = adapter["event_date"].replace("-", "")
+        key = (spider.name, output_name(spider, adapter), listing_run(spider, adapter), event_date_str)
+        self.listings.setdefault(key, []).append(adapter.asdict())
+        return item
+
+    def event_parsed(self, spider, response, listings: int):
+        # No item comes through for an event without listings, save it as an empty snapshot
+        #   so the listings of its last snapshot are removed (skipped if it has no snapshot yet)
+        event_date = response.meta.get("event_date")
+        if listings or not event_date:
+            return
+        meta = {"team": response.meta.get("team"), "run": response.meta.get("poll_run")}
+        key = (spider.name, output_name(spider, meta), listing_run(spider, meta), event_date.replace("-", ""))
+        self.listings.setdefault(key, [])
+
+    def poll_finished(self, spider, run: str, event_dates: list):
+        event_date_strs = [x.replace("-", "") for x in event_dates]
+        self._save(spider, [
+            key for key in self.listings if key[0] == spider.name and key[2] == run and key[3] in event_date_strs
+        ])
+
+    def spider_closed(self, spider):
+        # Oldest run first, every delta is against the run before it
+        self._save(spider, sorted(key for key in self.listings if key[0] == spider.name))
+
+    def _save(self, spider, keys: list):
+        for key in keys:
+            with stage(spider, "write_output"):
+                kind, records_cnt = save_delta_snapshot(
+                    self.output_directory,
+                    key[2],
+                    key[1],
+                    key[3],
+                    self.listings.pop(key),
+                    self.checkpoint_every,
+                )
+            if kind is None:
+                continue
+            self.stats.inc_value(f'delta_writer/{kind}s')
+            self.stats.inc_value('delta_writer/records', records_cnt)
+
+
+class SqliteStorePipeline:
+    """
+    Add the listings to the SQLite listing history store (see store.py and query.py)
+    Rows are inserted in bulk, one transaction every SQLITE_STORE_BATCH_SIZE listings
+        and one when a poll is done in the polling daemon
+    Enabled with SQLITE_STORE_ENABLED
+    """
+
+    def __init__(self, path, batch_size: int, stats):
+        self.path = path
+        self.batch_size = batch_size
+        self.stats = stats
+        self.conn = None
+        self.rows = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('SQLITE_STORE_ENABLED'):
+            raise NotConfigured
+        pipeline = cls(
+            crawler.settings.get('SQLITE_STORE_PATH'),
+            crawler.settings.getint('SQLITE_STORE_BATCH_SIZE', 5000),
+            crawler.stats,
+        )
+        crawler.signals.connect(pipeline.poll_finished, signal=poll_finished)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.conn = store.connect(self.path)
+
+    def process_item(self, item, spider):
+        with stage(spider, "write_output"):
+            adapter = ItemAdapter(item)
+            self.rows.append(store.listing_row(spider.name, listing_run(spider, adapter), adapter))
+            if len(self.rows) >= self.batch_size:
+                self._insert()
+        return item
+
+    def _insert(self):
+        store.insert_listings(self.conn, self.rows)
+        self.stats.inc_value('sqlite_store/items', len(self.rows))
+        self.stats.inc_value('sqlite_store/transactions')
+        self.rows = []
+
+    def poll_finished(self, spider, run: str, event_dates: list):
+        # Commits the rows of the polls before it too, a transaction per poll at most
+        if self.rows:
+            with stage(spider, "write_output"):
+                self._insert()
+
+    def spider_closed(self, spider):
+        if self.rows:
+            with stage(spider, "write_output"):
+                self._insert()
+        self.conn.close()
+
+
+class NormalizedIndexPipeline:
+    """
+    Add the listings to the index of equivalent seats across marketplaces (see normalize.py)
+    The spiders of a process share one index, loaded with the listings saved by the last runs,
+        and each spider saves the listings of its marketplace when it closes
+    Enabled with NORMALIZED_INDEX_ENABLED
+    """
+
+    # NORMALIZED_INDEX_DIRECTORY -> ListingIndex, shared by the spiders of a batch crawl
+    indexes = {}
+
+    def __init__(self, directory, stats):
+        self.directory = directory
+        self.stats = stats
+        self.index = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('NORMALIZED_INDEX_ENABLED'):
+            raise NotConfigured
+        pipeline = cls(crawler.settings.get('NORMALIZED_INDEX_DIRECTORY'), crawler.stats)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        key = str(self.directory)
+        if key not in self.indexes:
+            self.indexes[key] = ListingIndex.load(self.directory)
+        self.index = self.indexes[key]
+
+    def process_item(self, item, spider):
+        with stage(spider, "write_output"):
+            kept = self.index.add(spider.name, ItemAdapter(item))
+        self.stats.inc_value('normalized_index/items')
+        if kept:
+            self.stats.inc_value('normalized_index/kept')
+        return item
+
+    def spider_closed(self, spider):
+        with stage(spider, "write_output"):
+            self.index.save(self.directory, spider.name)
+        self.stats.set_value('normalized_index/seats', len(self.index))
@@ -0,0 +1,552 @@
+# Continuous polling of the events (see runner.py)
+#
+# Instead of crawling every event once and closing, the spider stays open and each event is
+# polled again and again. The next poll of an event is due after an interval that depends on:
+#   - the time left before the event starts, POLL_INTERVALS maps hours before the event to seconds
+#     between polls (tonight's game every few minutes, a game months away once a day)
+#   - how much its prices moved, the interval is divided by 1 + POLL_VOLATILITY_WEIGHT * volatility,
+#     volatility being the mean relative change of the median listing price between its last polls
+# Due events are polled in order of their due time while the POLL_REQUEST_BUDGET (requests per hour,
+# schedule pages included) allows it. Events are dropped POLL_EVENT_GRACE_HOURS after they start and
+# the schedule pages are crawled again every POLL_DISCOVERY_INTERVAL seconds to find new events.
+#
+# Every poll is its own run: its listings get the time the poll was sent (YYYYMMDDHHMMSS) as their
+# run instead of the spider's file_timestamp, so each poll of an event is a separate snapshot
+# (output/[spider]/[run]/[YYYYMMDD].csv, a run of the SQLite store ...). Once the output of a poll,
+# and of the requests it led to, is processed the poll_finished signal is sent and the pipelines
+# write out the listings of that run instead of keeping them until the spider closes.
+#
+# What will be polled next is written to [POLL_STATUS_DIRECTORY]/[spider]_schedule.json,
+#   python -m secondary_tix.runner --status
+# prints it.
+
+import json
+import time
+import heapq
+import logging
+import statistics
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from itemadapter import ItemAdapter, is_item
+from scrapy import signals, Request
+from scrapy.exceptions import NotConfigured, DontCloseSpider
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+# Sent with spider, run and event_dates (YYYY-MM-DD of the polled event and of the listings it got)
+#     once a poll is processed
+poll_finished = object()
+# Run of the listings of a poll
+POLL_RUN_FORMAT = "%Y%m%d%H%M%S"
+
+
+def poll_run() -> str:
+    """
+    Run id of a new poll, in UTC like the file_timestamp of the spiders
+    Runs are compared as strings (delta.py, query.py, analytics.py), so the daemon's runs and the
+        runs of one-off crawls only sort in time order if they use the same clock
+    """
+
+    return datetime.utcnow().strftime(POLL_RUN_FORMAT)
+
+
+DEFAULT_INTERVALS = [
+    # (hours before the event, seconds between polls), the last interval is used past the last bound
+    (6, 5 * 60),
+    (24, 15 * 60),
+    (3 * 24, 60 * 60),
+    (14 * 24, 6 * 60 * 60),
+    (None, 24 * 60 * 60),
+]
+
+
+@dataclass
+class PolledEvent:
+    """
+    An event of the schedule
+    """
+
+    event_id: str
+    request: Request
+    starts_at: datetime
+    team: str = None
+    next_poll_at: float = 0
+    interval: float = 0
+    polls: int = 0
+    # Median price of the last polls, and the prices received since the last poll was sent
+    medians: deque = field(default_factory=lambda: deque(maxlen=6))
+    pending_prices: list = field(default_factory=list)
+
+    def volatility(self) -> float:
+        """
+        Mean relative change of the median price between the last polls, 0 before 2 polls
+        """
+
+        medians = list(self.medians)
+        changes = [abs(b - a) / a for a, b in zip(medians, medians[1:]) if a]
+        return sum(changes) / len(changes) if changes else 0.0
+
+
+class PollSchedule:
+    """
+    Priority queue of the events by next poll time
+    Every method takes the current time so the schedule can be driven by any clock
+    """
+
+    def __init__(
+        self,
+        intervals: list=None,
+        min_interval: float=2 * 60,
+        volatility_weight: float=10,
+        grace: timedelta=timedelta(hours=4),
+    ):
+        """
+        intervals: list of (hours before the event or None, seconds between polls), see DEFAULT_INTERVALS
+        min_interval: shortest interval, however volatile the prices are
+        volatility_weight: how much price moves shorten the interval
+        grace: how long after it starts an event is still polled
+        """
+
+        self.intervals = [tuple(x) for x in (intervals or DEFAULT_INTERVALS)]
+        self.min_interval = min_interval
+        self.volatility_weight = volatility_weight
+        self.grace = grace
+        # event_id -> PolledEvent
+        self.events = {}
+        # (next_poll_at, sequence, event_id), entries of rescheduled events are skipped when popped
+        self._heap = []
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def __contains__(self, event_id):
+        return event_id in self.events
+
+    def add(self, event_id: str, request: Request, starts_at: datetime, team: str=None, now: float=None):
+        """
+        Add an event, its first poll is due now
+
+        event_id: id of the event on the marketplace
+        request: request that polls the event
+        starts_at: when the event starts
+        team: team the event was found for
+        now: current timestamp
+        """
+
+        now = time.time() if now is None else now
+        event = self.events[event_id] = PolledEvent(event_id, request, starts_at, team)
+        self._push(event, now)
+
+    def record_price(self, event_id: str, price: float):
+        event = self.events.get(event_id)
+        if event is not None:
+            event.pending_prices.append(price)
+
+    def interval(self, event: PolledEvent, now: float) -> float:
+        """
+        Seconds until the next poll of an event, see the top of the module
+        """
+
+        hours_left = (event.starts_at.timestamp() - now) / 3600
+        base = self.intervals[-1][1]
+        for max_hours, seconds in self.intervals:
+            if max_hours is None or hours_left <= max_hours:
+                base = seconds
+                break
+        return max(self.min_interval, base / (1 + self.volatility_weight * event.volatility()))
+
+    def pop_due(self, now: float=None):
+        """
+        Event with the earliest due poll, None if no poll is due
+        Events past their grace period are dropped on the way
+
+        now: current timestamp
+        return: PolledEvent, reschedule it once its poll is sent
+        """
+
+        now = time.time() if now is None else now
+        while self._heap and self._heap[0][0] <= now:
+            next_poll_at, _, event_id = heapq.heappop(self._heap)
+            event = self.events.get(event_id)
+            if event is None or event.next_poll_at != next_poll_at:
+                continue
+            if datetime.fromtimestamp(now) > event.starts_at + self.grace:
+                logger.info(f"Event {event_id} has started, no longer polled")
+                del self.events[event_id]
+                continue
+            return event
+        return None
+
+    def has_due(self, now: float=None) -> bool:
+        """
+        True if a poll is due, without taking it out of the schedule
+        """
+
+        now = time.time() if now is None else now
+        while self._heap:
+            next_poll_at, _, event_id = self._heap[0]
+            event = self.events.get(event_id)
+            if event is not None and event.next_poll_at == next_poll_at:
+                return next_poll_at <= now
+            heapq.heappop(self._heap)
+        return False
+
+    def reschedule(self, event: PolledEvent, now: float=None):
+        """
+        Count a poll of the event and schedule the next one
+        The prices received since the previous poll are summed up first
+
+        event: event returned by pop_due
+        now: current timestamp
+        """
+
+        now = time.time() if now is None else now
+        if event.pending_prices:
+            event.medians.append(statistics.median(event.pending_prices))
+            event.pending_prices = []
+        event.polls += 1
+        event.interval = self.interval(event, now)
+        self._push(event, now + event.interval)
+
+    def postpone(self, event: PolledEvent, delay: float, now: float=None):
+        """
+        Put an event back without counting a poll
+        """
+
+        now = time.time() if now is None else now
+        self._push(event, now + delay)
+
+    def upcoming(self, limit: int=20) -> list[PolledEvent]:
+        """
+        Next events to poll, earliest first
+        """
+
+        return sorted(self.events.values(), key=lambda x: x.next_poll_at)[:limit]
+
+    def _push(self, event: PolledEvent, next_poll_at: float):
+        event.next_poll_at = next_poll_at
+        self._sequence += 1
+        heapq.heappush(self._heap, (next_poll_at, self._sequence, event.event_id))
+
+
+class RequestBudget:
+    """
+    Token bucket of requests per hour, holds at most a minute of requests
+    """
+
+    def __init__(self, per_hour: float, now: float=None):
+        self.per_hour = per_hour
+        self.capacity = max(1.0, per_hour / 60)
+        self.tokens = self.capacity
+        self.updated_at = time.time() if now is None else now
+
+    def refill(self, now: float=None):
+        now = time.time() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.per_hour / 3600)
+        self.updated_at = now
+
+    def take(self, now: float=None) -> bool:
+        """
+        Use a request of the budget, False if there is none left
+        """
+
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def charge(self, requests: int=1):
+        """
+        Count requests that are sent anyway (schedule pages), the budget can go negative
+        """
+
+        self.tokens -= requests
+
+
+class PollingMiddleware:
+    """
+    Spider middleware that keeps the spider open and polls its events
+    Requests with an "event_id" meta key are taken out of the spider output and added
+        to the schedule, see the top of the module. Enabled with POLL_DAEMON_ENABLED
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.schedule = PollSchedule(
+            settings.getlist('POLL_INTERVALS') or None,
+            settings.getfloat('POLL_MIN_INTERVAL', 2 * 60),
+            settings.getfloat('POLL_VOLATILITY_WEIGHT', 10),
+            timedelta(hours=settings.getfloat('POLL_EVENT_GRACE_HOURS', 4)),
+        )
+        self.budget = RequestBudget(settings.getfloat('POLL_REQUEST_BUDGET', 600))
+        self.tick_seconds = settings.getfloat('POLL_TICK_SECONDS', 5)
+        self.discovery_interval = settings.getfloat('POLL_DISCOVERY_INTERVAL', 6 * 60 * 60)
+        self.event_start_hour = settings.getint('POLL_EVENT_START_HOUR', 19)
+        self.status_directory = Path(settings.get('POLL_STATUS_DIRECTORY'))
+        self.status_size = settings.getint('POLL_STATUS_SIZE', 20)
+        self.spider = None
+        self.loop = None
+        self.discovered_at = time.time()
+        # event_id of the polls sent and not answered yet
+        self.in_flight = set()
+        # (run, event_id) of a poll -> [# of its responses not processed yet, event dates of its listings]
+        self.pending = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('POLL_DAEMON_ENABLED'):
+            raise NotConfigured
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(middleware.request_done, signal=signals.request_left_downloader)
+        crawler.signals.connect(middleware.request_dropped, signal=signals.request_dropped)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.loop = task.LoopingCall(self.tick)
+        self.loop.start(self.tick_seconds, now=False)
+        logger.info(
+            f"Polling the events of {spider.name}, budget of {self.budget.per_hour:g} requests per hour"
+        )
+
+    def spider_idle(self, spider):
+        # Polls are sent by tick, an empty queue doesn't mean the crawl is over
+        raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.write_status()
+
+    def item_scraped(self, item, response, spider):
+        event_id = response.meta.get("event_id")
+        price = getattr(item, "price", None)
+        if event_id is not None and price is not None:
+            self.schedule.record_price(event_id, float(price))
+
+    def request_done(self, request, spider):
+        self.in_flight.discard(request.meta.get("event_id"))
+
+    def request_dropped(self, request, spider):
+        self.request_done(request, spider)
+        self.output_done(self.poll_of(request))
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            if self.add_event(request):
+                continue
+            self.budget.charge()
+            yield request
+
+    def process_spider_output(self, response, result, spider):
+        poll = self.poll_of(response.request)
+        try:
+            for x in result:
+                if not self.add_event(x):
+                    yield self.stamp(x, poll)
+        finally:
+            self.output_done(poll)
+
+    async def process_spider_output_async(self, response, result, spider):
+        poll = self.poll_of(response.request)
+        try:
+            async for x in result:
+                if not self.add_event(x):
+                    yield self.stamp(x, poll)
+        finally:
+            self.output_done(poll)
+
+    def poll_of(self, request) -> tuple:
+        """
+        (run, event_id) of the poll a request is part of, None if it isn't
+        """
+
+        if request is None or request.meta.get("poll_run") is None:
+            return None
+        return request.meta["poll_run"], request.meta["poll_event_id"]
+
+    def stamp(self, x, poll: tuple):
+        """
+        Give the output of a poll's response the run of the poll
+
+        x: listing, or request that is part of the poll (ex - the other ticket quantities of the event)
+        poll: (run, event_id), None if the response isn't part of a poll
+        """
+
+        entry = self.pending.get(poll)
+        if entry is None:
+            return x
+        if isinstance(x, Request):
+            x.meta["poll_run"], x.meta["poll_event_id"] = poll
+            if x.errback is None:
+                x = x.replace(errback=self.poll_failed)
+            entry[0] += 1
+        elif is_item(x):
+            adapter = ItemAdapter(x)
+            if "run" in adapter.field_names():
+                adapter["run"] = poll[0]
+            entry[1].add(adapter.get("event_date"))
+        return x
+
+    def output_done(self, poll: tuple):
+        """
+        Count a processed response of a poll, send poll_finished after the last one
+        """
+
+        entry = self.pending.get(poll)
+        if entry is None:
+            return
+        entry[0] -= 1
+        if entry[0] > 0:
+            return
+        del self.pending[poll]
+        self.stats.inc_value('polling/polls_finished')
+        self.crawler.signals.send_catch_log(
+            poll_finished, spider=self.spider, run=poll[0], event_dates=sorted(x for x in entry[1] if x)
+        )
+
+    def poll_failed(self, failure):
+        request = failure.request
+        logger.error(f"Poll request {request} failed: {failure.value!r}")
+        self.stats.inc_value('polling/polls_failed')
+        self.request_done(request, self.spider)
+        self.output_done(self.poll_of(request))
+
+    def add_event(self, request) -> bool:
+        """
+        Add the event of a request to the schedule
+
+        request: output of the spider
+        return: True if it was an event request, it is then sent by the schedule
+        """
+
+        if not isinstance(request, Request) or request.meta.get("event_id") is None:
+            return False
+        event_id = request.meta["event_id"]
+        if event_id in self.schedule:
+            return True
+        self.schedule.add(event_id, request, self.starts_at(request.meta.get("event_date")), request.meta.get("team"))
+        self.stats.inc_value('polling/events_added')
+        self.stats.set_value('polling/events', len(self.schedule))
+        return True
+
+    def starts_at(self, event_date: str) -> datetime:
+        """
+        Start time of an event, the marketplaces only give the date so it is assumed to
+            start at POLL_EVENT_START_HOUR. Unknown dates are treated as far away
+        """
+
+        try:
+            return datetime.strptime(event_date, "%Y-%m-%d") + timedelta(hours=self.event_start_hour)
+        except (TypeError, ValueError):
+            return datetime.max - timedelta(days=1)
+
+    def tick(self):
+        """
+        Send the due polls the budget allows, crawl the schedule pages again when it's time
+        """
+
+        now = time.time()
+        if now - self.discovered_at >= self.discovery_interval:
+            self.discovered_at = now
+            self.rediscover()
+
+        sent = 0
+        while self.budget.take(now):
+            event = self.schedule.pop_due(now)
+            if event is None:
+                # Give the request back
+                self.budget.tokens += 1
+                break
+            if event.event_id in self.in_flight:
+                self.stats.inc_value('polling/skipped_in_flight')
+                self.budget.tokens += 1
+                self.schedule.postpone(event, self.tick_seconds, now)
+                continue
+            self.poll(event)
+            self.schedule.reschedule(event, now)
+            sent += 1
+        else:
+            if self.schedule.has_due(now):
+                self.stats.inc_value('polling/budget_exhausted')
+
+        self.stats.set_value('polling/events', len(self.schedule))
+        if sent:
+            self.write_status()
+
+    def poll(self, event: PolledEvent):
+        """
+        Send a new request of the event
+        """
+
+        poll_request = getattr(self.spider, "poll_request", None)
+        if poll_request is not None:
+            request = poll_request(event.request)
+        else:
+            request = event.request.replace(dont_filter=True)
+        # replace shares the meta dict with the request it was made from
+        run = poll_run()
+        request = request.replace(
+            meta={**request.meta, "poll_run": run, "poll_event_id": event.event_id},
+            errback=request.errback or self.poll_failed,
+        )
+        # The event's date is in even if the poll gets no listings, so its pipelines still write it out
+        self.pending[(run, event.event_id)] = [1, {request.meta.get("event_date")}]
+        self.in_flight.add(event.event_id)
+        self.stats.inc_value('polling/polls')
+        logger.debug(f"Polling {event.event_id} ({event.team}), poll #{event.polls + 1}")
+        self.crawler.engine.crawl(request)
+
+    def rediscover(self):
+        """
+        Crawl the schedule pages again (or read the discovery cache) to add the new events
+        """
+
+        logger.info(f"Looking for new events of {self.spider.name}")
+        self.stats.inc_value('polling/rediscoveries')
+        for request in self.spider.start_requests():
+            if not self.add_event(request):
+                self.budget.charge()
+                self.crawler.engine.crawl(request.replace(dont_filter=True))
+
+    def write_status(self):
+        """
+        Write the next polls to [POLL_STATUS_DIRECTORY]/[spider]_schedule.json
+        """
+
+        if self.spider is None:
+            return
+        status = {
+            "spider": self.spider.name,
+            "updated_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "events": len(self.schedule),
+            "budget": {"per_hour": self.budget.per_hour, "available": round(self.budget.tokens, 2)},
+            "next": [
+                {
+                    "event_id": x.event_id,
+                    "team": x.team,
+                    "starts_at": x.starts_at.isoformat() if x.starts_at.year < 9999 else None,
+                    "next_poll_at": datetime.utcfromtimestamp(x.next_poll_at).isoformat(timespec="seconds"),
+                    "interval": round(x.interval),
+                    "volatility": round(x.volatility(), 4),
+                    "polls": x.polls,
+                }
+                for x in self.schedule.upcoming(self.status_size)
+            ],
+        }
+        path = self.status_directory / f"{self.spider.name}_schedule.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(status, indent=2))
+        tmp_path.replace(path)
@@ -0,0 +1,154 @@
+# Common lookups over the listing history store (store.py)
+#
+# ex -
+#   conn = store.connect(settings.SQLITE_STORE_PATH)
+#   query.price_history(conn, "gametime", "2023-07-29", "Section 112", since="2023-07-22")
+
+import sqlite3
+from statistics import median
+
+# Runs started at or after the run_prefix parameter, the prefix is cut to the length of each run
+#   so "202307221830" (Gametime) is compared to "202307221830", not "20230722183000" which sorts after it
+RUN_SINCE = " AND run >= substr(?, 1, length(run))"
+# Listings of one team, batch crawls store the listings of every team of a marketplace together
+TEAM = " AND team = ?"
+
+
+def run_prefix(since: str) -> str:
+    """
+    Time as the start of a run timestamp so it can be compared to the indexed run column
+        ex - "2023-07-22 18:30:00" -> "20230722183000"
+    Runs are named YYYYMMDDHHMM (Gametime) or YYYYMMDDHHMMSS (Vivid, polls) when the spider starts,
+        which sorts like the time itself once the prefix is cut to the length of the run, see RUN_SINCE
+    """
+
+    return since.replace("-", "").replace(" ", "").replace(":", "")
+
+
+def latest_run(conn: sqlite3.Connection, spider_name: str, event_date: str, team: str=None):
+    """
+    Timestamp of the most recent run that has listings for the event, None if there are none
+
+    conn: connection returned by store.connect
+    spider_name: name of the spider the listings are from
+    event_date: YYYY-MM-DD of the event
+    team: only the listings crawled for this team (batch mode), None for every team
+    """
+
+    sql = "SELECT MAX(run) FROM listings WHERE spider = ? AND event_date = ?"
+    params = [spider_name, event_date]
+    if team is not None:
+        sql += TEAM
+        params.append(team)
+    return conn.execute(sql, params).fetchone()[0]
+
+
+def latest_snapshot(conn: sqlite3.Connection, spider_name: str, event_date: str, team: str=None) -> list[tuple]:
+    """
+    Listings of the most recent run for the event, cheapest first
+
+    conn: connection returned by store.connect
+    spider_name: name of the spider the listings are from
+    event_date: YYYY-MM-DD of the event
+    team: only the listings crawled for this team (batch mode), None for every team
+    return: list of (section, row, quantity, price, listing_valid_as_of)
+    """
+
+    run = latest_run(conn, spider_name, event_date, team)
+    if run is None:
+        return []
+    sql = """
+        SELECT section, row, quantity, price, listing_valid_as_of
+        FROM listings
+        WHERE spider = ? AND event_date = ? AND run = ?
+    """
+    params = [spider_name, event_date, run]
+    if team is not None:
+        sql += TEAM
+        params.append(team)
+    sql += " ORDER BY price"
+    return conn.execute(sql, params).fetchall()
+
+
+def price_history(
+        conn: sqlite3.Connection,
+        spider_name: str,
+        event_date: str,
+        section: str,
+        row: str=None,
+        since: str=None,
+        team: str=None
+    ) -> list[tuple]:
+    """
+    Cheapest price and # of listings in a section (or row) for every snapshot
+        ex - cheapest seat in section 112 over the last week for the 2023-07-29 game
+
+    conn: connection returned by store.connect
+    spider_name: name of the spider the listings are from
+    event_date: YYYY-MM-DD of the event
+    section: section as it is stored (ex - "Section 112" for gametime, "112" for vivid)
+    row: only listings in this row, None for the whole section
+    since: only runs started at or after this "YYYY-MM-DD[ HH:MM:SS]" time
+    team: only the listings crawled for this team (batch mode), None for every team
+    return: list of (listing_valid_as_of, min price, # listings), oldest first
+    """
+
+    sql = """
+        SELECT MIN(listing_valid_as_of), MIN(price), COUNT(*)
+        FROM listings
+        WHERE spider = ? AND event_date = ? AND section = ?
+    """
+    params = [spider_name, event_date, section]
+    if row is not None:
+        sql += " AND row = ?"
+        params.append(row)
+    if team is not None:
+        sql += TEAM
+        params.append(team)
+    if since is not None:
+        sql += RUN_SINCE
+        params.append(run_prefix(since))
+    sql += " GROUP BY run ORDER BY run"
+    return conn.execute(sql, params).fetchall()
+
+
+def snapshot_price_stats(
+        conn: sqlite3.Connection,
+        spider_name: str,
+        event_date: str,
+        since: str=None,
+        team: str=None
+    ) -> list[tuple]:
+    """
+    Min / median price and # of listings of every snapshot of the event
+
+    conn: connection returned by store.connect
+    spider_name: name of the spider the listings are from
+    event_date: YYYY-MM-DD of the event
+    since: only runs started at or after this "YYYY-MM-DD[ HH:MM:SS]" time
+    team: only the listings crawled for this team (batch mode), None for every team
+    return: list of (run, min price, median price, # listings), oldest first
+    """
+
+    sql = "SELECT run, price FROM listings WHERE spider = ? AND event_date = ?"
+    params = [spider_name, event_date]
+    if team is not None:
+        sql += TEAM
+        params.append(team)
+    if since is not None:
+        sql += RUN_SINCE
+        params.append(run_prefix(since))
+    # Reads the (spider, event_date, run, price, team) index only, prices come back sorted per run
+    sql += " ORDER BY run, price"
+
+    stats = []
+    current_run, prices = None, []
+    for run, price in conn.execute(sql, params):
+        if run != current_run and prices:
+            stats.append((current_run, prices[0], median(prices), len(prices)))
+            prices = []
+        current_run = run
+        prices.append(price)
+    if prices:
+        stats.append((current_run, prices[0], median(prices), len(prices)))
+    return stats
@@ -1,10 +1,78 @@
-from scrapy.crawler import CrawlerProcess
-from spiders.gametime_selenium import MySpider
-
-process = CrawlerProcess(settings={
-    'SELENIUM_DRIVER_NAME': 'chrome',
-    'SELENIUM_DRIVER_EXECUTABLE_PATH': '/users/jimmymorrow/downloads/chromedriver',
-    'SELENIUM_DRIVER_ARGUMENTS': ['--headless'],  # Optional: Run in headless mode
-})
-process.crawl(MySpider)
-process.start()
+# Long running polling daemon
+#
+# Crawls the teams of a batch config (see batch.py) like a batch crawl, but the spiders stay
+# open: the browser and the crawler are started once and every event is polled again on a
+# schedule that favours the games that are close and the events whose prices move (see polling.py).
+# Every poll is a run of its own, written out as soon as the poll is done, so
+# output/[spider]/[run]/ holds one poll. Stop it with Ctrl-C, the polls still open are written out on close.
+#
+# Run from the folder that contains scrapy.cfg:
+#   python -m secondary_tix.runner ../batch.json
+# What each spider will poll next:
+#   python -m secondary_tix.runner --status
+
+import os
+import sys
+import json
+import argparse
+import logging
+from pathlib import Path
+
+os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "secondary_tix.settings")
+
+from scrapy.utils.project import get_project_settings
+from secondary_tix.batch import run_batch
+
+logger = logging.getLogger(__name__)
+
+
+def run_daemon(path):
+    """
+    Poll the events of every team of the batch config until stopped
+
+    path: path of the JSON batch config
+    """
+
+    settings = get_project_settings()
+    settings.set("POLL_DAEMON_ENABLED", True, priority="cmdline")
+    run_batch(path, settings)
+
+
+def print_status(directory):
+    """
+    Print the next polls written by the running daemon
+
+    directory: POLL_STATUS_DIRECTORY
+    """
+
+    paths = sorted(Path(directory).glob("*_schedule.json"))
+    if not paths:
+        print(f"No daemon status in {directory}")
+        return
+    for path in paths:
+        status = json.loads(path.read_text())
+        print(
+            f"{status['spider']}: {status['events']} events, updated {status['updated_at']} UTC, "
+            f"{status['budget']['available']} of {status['budget']['per_hour']:g}/h requests available"
+        )
+        for event in status["next"]:
+            print(
+                f"  {event['next_poll_at']} UTC  {event['event_id']:<12} {str(event['team']):<12} "
+                f"starts {event['starts_at']}  every {event['interval']}s  "
+                f"volatility {event['volatility']:.2%}  {event['polls']} polls"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Poll the events of a batch config until stopped")
+    parser.add_argument("batch", nargs="?", help="path of the JSON batch config")
+    parser.add_argument("--status", action="store_true", help="print what the running daemon will poll next")
+    args = parser.parse_args()
+
+    if args.status:
+        print_status(get_project_settings().get("POLL_STATUS_DIRECTORY"))
+    elif args.batch:
+        run_daemon(args.batch)
+    else:
+        parser.print_usage()
+        sys.exit(1)
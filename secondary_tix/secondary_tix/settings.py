@@ -27,10 +27,57 @@ LOG_DIRECTORY = Path(__file__).parents[2] / "logs"
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 #USER_AGENT = "secondary_tix (+http://www.yourdomain.com)"
 
-SCRAPEOPS_API_KEY = config.get('credentials', 'SCRAPEOPS_API_KEY')
+SCRAPEOPS_API_KEY = config.get('credentials', 'SCRAPEOPS_API_KEY', fallback=None)
 SCRAPEOPS_FAKE_USER_AGENT_ENDPOINT = "https://headers.scrapeops.io/v1/user-agents"
 SCRAPEOPS_FAKE_USER_AGENT_ENABLED = True
 SCRAPEOPS_NUM_RESULTS = 50
+SCRAPEOPS_REQUEST_TIMEOUT = 10
+# The user agent list is cached on disk and refreshed in the background once it is older than the TTL
+USER_AGENT_CACHE_PATH = OUTPUT_DIRECTORY / "output/cache/user_agents.json"
+USER_AGENT_CACHE_TTL = 24 * 60 * 60
+
+# Events found on the team pages are cached so repeat runs skip the schedule scraping (see discovery_cache.py)
+# Off by default, enable it with -s DISCOVERY_CACHE_ENABLED=True or here
+DISCOVERY_CACHE_ENABLED = False
+DISCOVERY_CACHE_DIRECTORY = OUTPUT_DIRECTORY / "output/cache/discovery"
+DISCOVERY_CACHE_TTL = 6 * 60 * 60
+# Ignore the cached events and rediscover them, same as -a refresh_discovery=1
+DISCOVERY_CACHE_REFRESH = False
+
+# How the Gametime spider expands the list of games with the SHOW MORE button
+#   "event" - wait until the games list grows or the button disappears
+#   "fixed" - wait a flat 5 seconds after every click
+GAMETIME_SHOW_MORE_MODE = "event"
+# Max seconds to wait for a single SHOW MORE click to load more games
+GAMETIME_SHOW_MORE_CLICK_TIMEOUT = 10
+# Max seconds for the whole SHOW MORE expansion
+GAMETIME_SHOW_MORE_MAX_SECONDS = 120
+# How the Gametime spider reads the listings for each ticket quantity
+#   "evaluate" - a single script in the browser returns the section / row and price of each listing
+#   "soup" - serialize the page and parse it with the GAMETIME_HTML_PARSER backend
+#   "network" - read all quantities from the listings JSON the event page downloads
+GAMETIME_EXTRACTION_MODE = "evaluate"
+# Parser for the events page and "soup" mode (see parsers.py)
+#   "lxml" - lxml with precompiled selectors
+#   "soup" - BeautifulSoup html.parser, slower, kept as a fallback
+GAMETIME_HTML_PARSER = "lxml"
+# Processes the Gametime pages are parsed in, so the parsing doesn't block the other pages and downloads
+# 0 parses in the crawler process. The time the reactor was blocked is in the parse/reactor_blocked_seconds stat
+GAMETIME_PARSE_PROCESSES = 0
+# Regex for the URL of the listings JSON the event page downloads ("network" mode only)
+GAMETIME_LISTINGS_URL_PATTERN = r"gametime\.co/v\d+/listings"
+# Max seconds to wait for the listings JSON before falling back to clicking the quantities
+GAMETIME_LISTINGS_CAPTURE_TIMEOUT = 15
+# Once a listings JSON arrived, seconds without another one before the capture is done
+# The page can load the listings in more than one request (pages of listings, more quantities)
+GAMETIME_LISTINGS_CAPTURE_QUIET = 2
+# Max # of pages per Gametime event that extract ticket quantities in parallel
+# 1 clicks through the quantities one after another on the event page
+# The extra pages count towards PLAYWRIGHT_MAX_PAGES_PER_CONTEXT like any other page
+GAMETIME_QUANTITY_CONCURRENCY = 1
+# Yield one request per ticket quantity of an event instead of reading them all on the event page
+# In a distributed run (see distributed.py) the quantities of an event are then spread over the workers
+GAMETIME_QUANTITY_TASKS = False
 
 
 # from pathlib import Path
@@ -42,16 +89,81 @@ SCRAPEOPS_NUM_RESULTS = 50
 ROBOTSTXT_OBEY = False
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
+# Raised to ADAPTIVE_RATE_CONCURRENT_REQUESTS when ADAPTIVE_RATE_ENABLED and to BATCH_CONCURRENT_REQUESTS in batch mode
 CONCURRENT_REQUESTS = 2
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
+# Only used when ADAPTIVE_RATE_ENABLED is False
 DOWNLOAD_DELAY = 10
 # The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN = 16
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
 #CONCURRENT_REQUESTS_PER_IP = 16
 
+# Total concurrent requests of a batch crawl (see batch.py), split between the marketplaces
+BATCH_CONCURRENT_REQUESTS = 16
+
+# Polling daemon (see polling.py and runner.py), set by runner.py, leave False for one-off crawls
+POLL_DAEMON_ENABLED = False
+# Requests per hour of the daemon (polls and schedule pages), split between the marketplaces
+POLL_REQUEST_BUDGET = 600
+# (hours before the event, seconds between polls), None for every event further away
+POLL_INTERVALS = [
+    (6, 5 * 60),
+    (24, 15 * 60),
+    (3 * 24, 60 * 60),
+    (14 * 24, 6 * 60 * 60),
+    (None, 24 * 60 * 60),
+]
+# Shortest interval between polls of an event, and how much price moves shorten the interval
+POLL_MIN_INTERVAL = 2 * 60
+POLL_VOLATILITY_WEIGHT = 10
+# The marketplaces only give the event date, events are assumed to start at this hour
+POLL_EVENT_START_HOUR = 19
+# Events are polled until this many hours after they start
+POLL_EVENT_GRACE_HOURS = 4
+# Seconds between two crawls of the schedule pages to find new events
+POLL_DISCOVERY_INTERVAL = 6 * 60 * 60
+# Seconds between two checks of the due polls
+POLL_TICK_SECONDS = 5
+# The next POLL_STATUS_SIZE polls are written to [POLL_STATUS_DIRECTORY]/[spider]_schedule.json
+POLL_STATUS_DIRECTORY = OUTPUT_DIRECTORY / "output/daemon"
+POLL_STATUS_SIZE = 20
+
+# Distributed runs (see distributed.py), set by distributed.py: "coordinator", "worker" or None
+WORKQUEUE_ROLE = None
+# SQLite database of the shared work queue, on a drive every worker can reach
+WORKQUEUE_PATH = OUTPUT_DIRECTORY / "output/cache/workqueue.sqlite"
+# Run to coordinate / work on, the file_timestamp of the coordinator or the latest run by default
+WORKQUEUE_RUN = None
+# Tasks leased at once by a worker, and seconds before the task of a worker that died is leased again
+WORKQUEUE_PREFETCH = 2
+WORKQUEUE_VISIBILITY_TIMEOUT = 10 * 60
+# Leases of a task before it is marked as failed
+WORKQUEUE_MAX_ATTEMPTS = 3
+WORKQUEUE_TICK_SECONDS = 1
+
+# Pace each (domain, request class) separately and adapt to the responses (see throttle.py)
+# Replaces the fixed DOWNLOAD_DELAY / CONCURRENT_REQUESTS_PER_DOMAIN, don't enable AutoThrottle with it
+ADAPTIVE_RATE_ENABLED = True
+# Upper bound over all download slots (CONCURRENT_REQUESTS), the controller sets the concurrency of each slot
+# Set CONCURRENT_REQUESTS on the command line to override it
+ADAPTIVE_RATE_CONCURRENT_REQUESTS = 16
+# Per request class: start / min / max delay (seconds), start / max concurrency and the latency
+# (seconds) above which a response counts as slow. Classes left out keep the defaults of throttle.py
+ADAPTIVE_RATE_BUDGETS = {
+    "browser": {"start_delay": 10, "min_delay": 3, "max_delay": 120, "concurrency": 1, "max_concurrency": 2, "target_latency": 20},
+    "api": {"start_delay": 1, "min_delay": 0.1, "max_delay": 60, "concurrency": 2, "max_concurrency": 8, "target_latency": 2},
+    "http": {"start_delay": 2, "min_delay": 0.5, "max_delay": 60, "concurrency": 1, "max_concurrency": 4, "target_latency": 5},
+}
+# Delay multiplier on 403 / 429 / 503, captcha pages and slow responses
+ADAPTIVE_RATE_BACKOFF_FACTOR = 2.0
+# Delay multiplier after ADAPTIVE_RATE_HEALTHY_STREAK healthy responses in a row
+ADAPTIVE_RATE_SPEEDUP_FACTOR = 0.75
+ADAPTIVE_RATE_HEALTHY_STREAK = 3
+ADAPTIVE_RATE_BLOCK_STATUSES = [403, 429, 503]
+
 # Disable cookies (enabled by default)
 #COOKIES_ENABLED = False
 
@@ -66,9 +178,13 @@ DOWNLOAD_DELAY = 10
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
 #    "secondary_tix.middlewares.SecondaryTixSpiderMiddleware": 543,
-#}
+    # Only enabled with POLL_DAEMON_ENABLED
+    "secondary_tix.polling.PollingMiddleware": 543,
+    # Only enabled with WORKQUEUE_ROLE
+    "secondary_tix.distributed.WorkQueueMiddleware": 544,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
@@ -78,19 +194,59 @@ DOWNLOADER_MIDDLEWARES = {
     # 'rotating_proxies.middlewares.RotatingProxyMiddleware': 610,
     # 'rotating_proxies.middlewares.BanDetectionMiddleware': 620,   
     'scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware': 810,    
+    # Conditional requests and bytes saved counters (see httpcache.py)
+    'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': None,
+    'secondary_tix.httpcache.ConditionalHttpCacheMiddleware': 900,
 }
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "secondary_tix.logging_utils.QueueLoggingExtension": 0,
+    "secondary_tix.instrumentation.CrawlInstrumentation": 500,
+    "secondary_tix.throttle.AdaptiveRateController": 510,
+    # Browser context pool and resources aborted by PLAYWRIGHT_ABORT_REQUEST (see browser.py)
+    "secondary_tix.browser.BrowserSettingsExtension": 520,
+}
+
+# Per-stage latency histograms and crawl counters (see instrumentation.py)
+INSTRUMENTATION_ENABLED = True
+# JSON dump of every run
+INSTRUMENTATION_DIRECTORY = OUTPUT_DIRECTORY / "output/metrics"
+# .prom file for the node exporter textfile collector, defaults to INSTRUMENTATION_DIRECTORY
+INSTRUMENTATION_PROMETHEUS_DIRECTORY = None
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "secondary_tix.pipelines.SecondaryTixPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "secondary_tix.pipelines.CsvWriterPipeline": 300,
+    "secondary_tix.pipelines.ParquetWriterPipeline": 310,
+    "secondary_tix.pipelines.DeltaSnapshotPipeline": 320,
+    "secondary_tix.pipelines.SqliteStorePipeline": 330,
+    "secondary_tix.pipelines.NormalizedIndexPipeline": 340,
+}
+# Write buffer of each open listings CSV and how many rows are written between flushes
+CSV_WRITE_BUFFER_BYTES = 1024 * 1024
+CSV_FLUSH_EVERY_ITEMS = 5000
+# Also write the listings as parquet files partitioned by spider and event date (requires pyarrow)
+PARQUET_OUTPUT_ENABLED = False
+PARQUET_ROW_GROUP_SIZE = 65536
+PARQUET_COMPRESSION = "zstd"
+# Only write the listings that changed since the last run instead of the full CSVs
+# A full checkpoint of every listing is written every DELTA_CHECKPOINT_EVERY runs
+DELTA_SNAPSHOTS_ENABLED = False
+DELTA_CHECKPOINT_EVERY = 12
+# Also add the listings to a SQLite database that keeps the price history (see query.py)
+SQLITE_STORE_ENABLED = False
+SQLITE_STORE_PATH = OUTPUT_DIRECTORY / "output/listings.sqlite"
+SQLITE_STORE_BATCH_SIZE = 5000
+# Also keep the cheapest listing of every marketplace per seat, with the sections / rows
+# normalized per venue, in an index saved between runs (see normalize.py)
+NORMALIZED_INDEX_ENABLED = False
+NORMALIZED_INDEX_DIRECTORY = OUTPUT_DIRECTORY / "output/index"
+# Price stats per section and quantity of every snapshot are cached here (see analytics.py)
+ANALYTICS_CACHE_DIRECTORY = OUTPUT_DIRECTORY / "output/cache/analytics"
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -107,11 +263,21 @@ DOWNLOADER_MIDDLEWARES = {
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
+# Only the plain HTTP requests (Vivid) are cached, and revalidated with ETag / Last-Modified (see httpcache.py)
+# Off by default, enable it with -s HTTPCACHE_ENABLED=True or here
+HTTPCACHE_ENABLED = False
+HTTPCACHE_POLICY = "secondary_tix.httpcache.ConditionalCachePolicy"
+# Kept until replaced, stale responses are revalidated instead of dropped
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = str(OUTPUT_DIRECTORY / "output/cache/http")
+HTTPCACHE_GZIP = True
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# Seconds a stored response is used without asking the server if it changed
+HTTPCACHE_FRESHNESS_SECONDS = 60
+# Don't parse / write the listings of an event whose listings didn't change since the last crawl
+# Off by default, the run then has no CSV / Parquet / SQLite rows for the event (its last snapshot still holds them)
+HTTPCACHE_SKIP_UNCHANGED = False
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -123,7 +289,38 @@ LOG_LEVEL = logging.INFO  # Set the desired log level (e.g., INFO, DEBUG, WARNIN
 LOG_FORMAT = "%(asctime)s [%(name)s] %(levelname)s: %(message)s"
 LOG_DATEFORMAT = "%Y-%m-%d %H:%M:%S"
 LOG_ENABLED = True  # Enable logging
+# Format and write the logs from a background thread instead of the reactor thread
+LOG_QUEUE_ENABLED = True
+# One JSON object per log line
+LOG_JSON = False
+# Lines logged for every listing (DEBUG) are only logged for 1 of every N listings
+LOG_LISTING_SAMPLE_EVERY = 100
+
+# Playwright browser contexts
+# Pages are spread over a pool of contexts that are reused across events
+# The pool is the only source of contexts, so it caps them: PLAYWRIGHT_MAX_CONTEXTS is left unset
+#   (a PLAYWRIGHT_MAX_CONTEXTS below the pool size is refused, see browser.py)
+PLAYWRIGHT_CONTEXT_POOL_SIZE = 2
+PLAYWRIGHT_MAX_PAGES_PER_CONTEXT = 4
+# Resources the pages request that the spiders never read are aborted
+PLAYWRIGHT_ABORT_REQUEST = "secondary_tix.browser.abort_request"
+PLAYWRIGHT_BLOCKED_RESOURCE_TYPES = ["image", "media", "font"]
+PLAYWRIGHT_BLOCKED_URL_PATTERNS = [
+    r"google-analytics\.com",
+    r"googletagmanager\.com",
+    r"doubleclick\.net",
+    r"googlesyndication\.com",
+    r"facebook\.(net|com)/tr",
+    r"connect\.facebook\.net",
+    r"segment\.(io|com)",
+    r"hotjar\.com",
+    r"branch\.io",
+    r"sentry\.io",
+]
 
+# Requests flagged with the `playwright` meta key are rendered by the browser, scrapy-playwright
+# downloads everything else with Scrapy's HTTP/1.1 handler (pooled, kept alive connections)
+# Spiders that never need a browser set DOWNLOAD_HANDLERS = {} (Scrapy's own handlers) so Playwright isn't started
 DOWNLOAD_HANDLERS = {
     "http": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
     "https": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
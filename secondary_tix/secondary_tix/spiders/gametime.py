@@ -1,28 +1,145 @@
 import scrapy
 from scrapy.selector import Selector
+from scrapy.utils.defer import maybe_deferred_to_future
 import time
-from secondary_tix.items import EventListingGametime, EVENT_LISTING_GAMETIME_HEADERS
+import re
+import asyncio
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from secondary_tix.items import ListingRecord, event_parsed
+from secondary_tix.browser import playwright_meta, record_page_metrics
+from secondary_tix.instrumentation import stage
+from secondary_tix.throttle import download_slot
+from secondary_tix.parsers import get_parser, ParserPool
+from secondary_tix.batch import load_batch_config, batch_teams
+from secondary_tix.discovery_cache import DiscoveryCache
 import logging
-from bs4 import BeautifulSoup
 from datetime import datetime, date
-from .utility import create_csv, save_to_csv, create_root_logger
-
-logger = create_root_logger(
-    output_to_file=False, # Set to True to output logs to file
-    log_filename=f'gametime_{datetime.now().strftime("%Y%m%d%H%M")}.log'
+from urllib.parse import urlparse
+from decimal import Decimal
+from secondary_tix.logging_utils import SampledLogger
+
+logger = logging.getLogger(__name__)
+
+# Section that holds the list of upcoming events on the venue page
+GAMES_SECTION = 'section._2nM98ETTbcRZ87usbOF3tM'
+# SHOW MORE button at the bottom of the list of games
+SHOW_MORE_BUTTON = 'button._2fYUaUKGPuVGvKyE_5wB0p'
+
+# Resolves once more games are rendered than `previous` or the SHOW MORE button is gone
+GAMES_LOADED_JS = """
+([section, button, previous]) => {
+    const games = document.querySelectorAll(`${section} a`).length;
+    return games > previous || document.querySelector(button) === null;
+}
+"""
+
+
+# Button that opens the ticket quantity dropdown on the event page
+TICKET_QUANTITY_BUTTON = 'div._3jbsE7bPH2773pyaT0ayCf > :nth-child(2)'
+# Dropdown that holds the ticket quantity options
+TICKET_QUANTITY_OPTIONS = 'div._1WI7N_Bs_b0gkDH7dzIdkV'
+
+# Selectors for a single listing and the section / row and price inside of it
+LISTING_SELECTORS = {
+    "listing": "div._2h7x6MAQ0R9rPi2f7MFJXo",
+    "section_row": "div._1EShqotjRsBqatpuDDtfZ7 ._1-M9Q0QPzQQPipMVX0voMp",
+    "price": "div._1Ez1uMaistdU48Vpp8XeO2 span",
+}
+
+# Returns [section_row, price] text for every listing on the page
+LISTINGS_JS = """
+(selectors) => Array.from(
+    document.querySelectorAll(selectors.listing),
+    (listing) => [
+        listing.querySelector(selectors.section_row).textContent,
+        listing.querySelector(selectors.price).textContent,
+    ]
 )
+"""
+
+
+class ListingsCapture:
+    """
+    Collects the listings JSON the event page downloads for itself
+    Attached to the event page through the `playwright_page_event_handlers` meta key
+    """
+
+    def __init__(self, url_pattern: str):
+        self.url_pattern = re.compile(url_pattern)
+        self.payloads = []
+        self.captured = asyncio.Event()
+
+    async def on_response(self, response):
+        """
+        Playwright "response" handler, keeps the body of the listings API responses
+        """
+
+        if response.status != 200 or not self.url_pattern.search(response.url):
+            return
+        try:
+            payload = await response.json()
+        except Exception as e:
+            logger.warning(f"Could not read listings payload from {response.url}: {e}")
+            return
+        logger.info(f"Captured listings payload from {response.url}")
+        self.payloads.append(payload)
+        self.captured.set()
+
+    async def wait(self, timeout: float, quiet: float) -> list[dict]:
+        """
+        Wait for the listings payloads
+        Keeps waiting after the first one until no other payload arrived for `quiet` seconds,
+            the page can request more listings (next pages, other quantities) after the first
+
+        timeout: max seconds to wait in total
+        quiet: seconds without a new payload after which the capture is done
+        return: payloads captured so far, empty if none arrived in time
+        """
+
+        deadline = asyncio.get_running_loop().time() + timeout
+        wait_for = timeout
+        while wait_for > 0:
+            try:
+                await asyncio.wait_for(self.captured.wait(), wait_for)
+            except asyncio.TimeoutError:
+                break
+            self.captured.clear()
+            wait_for = min(quiet, deadline - asyncio.get_running_loop().time())
+        return self.payloads
 
 
 class GametimeSpider(scrapy.Spider):
     name = 'gametime'
+    # Built on first use, see html_parser and parse_html
+    _html_parser = None
+    _parser_pool = None
+    # Per-listing lines, only 1 of every LOG_LISTING_SAMPLE_EVERY is logged (see from_crawler)
+    listing_logger = SampledLogger(logger)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(GametimeSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.listing_logger = SampledLogger(logger, crawler.settings.getint("LOG_LISTING_SAMPLE_EVERY", 100))
+        return spider
+
 
-    def __init__(self, team=None, event_date=None, *args, **kwargs):
+    def __init__(self, team=None, event_date=None, batch=None, refresh_discovery=None, *args, **kwargs):
         super(GametimeSpider, self).__init__(*args, **kwargs)
+        # Batch mode crawls every team of a batch config (see batch.py)
+        self.batch = batch is not None
+        if self.batch:
+            config = load_batch_config(batch)
+            self.teams = batch_teams(config, self.name)
+            event_date = event_date or config["event_date"]
         self.event_date_filter = self.format_event_date_filter(event_date)
         # Pass the team in as an argument or hardcode it below
         self.team = team 
-        if self.team is None:
+        if self.team is None and not self.batch:
             raise Exception("A team must be provided. See README for further instructions.")
+        # Events already requested, an event can be listed for more than one team in batch mode
+        self.seen_event_ids = set()
+        # Rediscover the events instead of using the discovery cache
+        self.refresh_discovery = refresh_discovery is not None and refresh_discovery not in ("0", "False", "false")
         
         current_datetime = datetime.utcnow()
         self.file_timestamp = current_datetime.strftime("%Y%m%d%H%M")
@@ -35,21 +152,96 @@ class GametimeSpider(scrapy.Spider):
         This is the format needed when filtering for a specific URL
         """
 
+        if event_date is None:
+            return None
         dt_object = datetime.strptime(event_date, "%Y-%m-%d")
         formatted_date = dt_object.strftime("%-m-%-d-%Y")
         return formatted_date
 
     
+    def html_parser(self):
+        """
+        HTML parser backend set with GAMETIME_HTML_PARSER ("lxml" or "soup"), see parsers.py
+        Built once so the selectors are only compiled once
+        """
+
+        if self._html_parser is None:
+            self._html_parser = get_parser(*self.parser_args())
+        return self._html_parser
+
+
+    def parser_args(self) -> tuple:
+        """
+        Backend name and selectors the HTML parser is built with
+        """
+
+        return (
+            self.settings.get("GAMETIME_HTML_PARSER", "lxml"),
+            GAMES_SECTION,
+            LISTING_SELECTORS["listing"],
+            [LISTING_SELECTORS["section_row"], LISTING_SELECTORS["price"]],
+        )
+
+
+    async def parse_html(self, method: str, html: str):
+        """
+        Run a method of the HTML parser on a page
+        With GAMETIME_PARSE_PROCESSES > 0 it runs in a pool of processes (see parsers.ParserPool)
+            so the other pages and downloads keep going while the page is parsed
+        The time the reactor spent on it is added to the parse/reactor_blocked_seconds stat
+
+        method: "event_links" or "listings_page"
+        html: page to parse
+        return: result of the parser method
+        """
+
+        stats = self.crawler.stats
+        processes = self.settings.getint("GAMETIME_PARSE_PROCESSES", 0)
+        start = time.perf_counter()
+        if processes <= 0:
+            result = getattr(self.html_parser(), method)(html)
+            stats.inc_value("parse/reactor_blocked_seconds", time.perf_counter() - start)
+            return result
+
+        if self._parser_pool is None:
+            self._parser_pool = ParserPool(processes, *self.parser_args())
+        future = self._parser_pool.submit(method, html)
+        # Only sending the page to the pool blocks the reactor
+        stats.inc_value("parse/reactor_blocked_seconds", time.perf_counter() - start)
+        result = await asyncio.wrap_future(future)
+        stats.inc_value("parse/offloaded")
+        stats.inc_value("parse/pool_seconds", time.perf_counter() - start)
+        return result
+
+
+    def closed(self, reason):
+        if self._parser_pool is not None:
+            self._parser_pool.close()
+
+    
     def start_requests(self):
         """
         Initial request to start the crawler
+        Teams whose events are in the discovery cache go straight to the event pages
         """
 
-        yield scrapy.Request(
-            url = "", # URL HERE
-            callback=self.parse_games,
-            meta={"playwright": True, "playwright_include_page": True}
-        )        
+        discovery_cache = DiscoveryCache.from_settings(self.settings, self.refresh_discovery)
+        teams = self.teams if self.batch else [(self.team, "")] # URL HERE
+        for team, url in teams:
+            cached_events = discovery_cache.load(self.name, team) if discovery_cache else None
+            if cached_events is not None:
+                logger.info(f"Using {len(cached_events)} cached events for {team}")
+                self.crawler.stats.inc_value("discovery_cache/hits")
+                for event_request in self.event_requests([x["href"] for x in cached_events], team):
+                    yield event_request
+                continue
+
+            self.crawler.stats.inc_value("discovery_cache/misses")
+            yield scrapy.Request(
+                url = url,
+                callback=self.parse_games,
+                meta=playwright_meta(self.settings, team=team)
+            )        
 
 
     async def parse_games(self, response):
@@ -60,43 +252,72 @@ class GametimeSpider(scrapy.Spider):
         """
 
         page = response.meta["playwright_page"]
+        await record_page_metrics(page, self.crawler.stats)
+        team = response.meta.get("team", self.team)
 
-        # Wait for selector that contains the upcoming events
-        await page.wait_for_selector('section._2nM98ETTbcRZ87usbOF3tM')
+        with stage(self, "discover_events"):
+            # Wait for selector that contains the upcoming events
+            await page.wait_for_selector(GAMES_SECTION)
 
-        # Find the SHOW MORE button at the bottom of the list of games        
-        show_more_button = await page.query_selector('button._2fYUaUKGPuVGvKyE_5wB0p')
-        logger.info(f"show_more_button exists: {True if show_more_button else False}")
+            # Only 15 games are initially displayed and each click of SHOW MORE
+            # produces 15 more games so we may need to click multiple times
+            await self.expand_games(page)
 
-        # Click the SHOW MORE button as long as it exists
-        # Only 15 games are initially displayed and each click produces 15 more games
-        # May need to click multiple times to display all the games
-        click_cnt = 1
-        while show_more_button is not None:
-            logger.info(f"Clicking SHOW MORE : {click_cnt}")
+            logger.info("Show more button no longer present. Extracting the HTML from the page")
+            updated_events_html = await page.content()
+
+            # Extract all the urls for the games
+            hrefs = await self.parse_html("event_links", updated_events_html)
+            # Some of the extracted URLS will be for concerts / non sports games
+            # This will filter them out
+            # HREFs are of the form: /mlb-baseball/AwayTeam-at-HomeTeam-tickets/date-city-venue/events/event_id
+            hrefs = [x for x in hrefs if x.split("/")[2].endswith(f"at-{team.lower()}-tickets")]
+
+        discovery_cache = DiscoveryCache.from_settings(self.settings)
+        if discovery_cache is not None:
+            discovery_cache.save(self.name, team, [
+                {"href": x, "event_id": x.rstrip("/").split("/")[-1], "event_date": self.href_event_date(x)}
+                for x in hrefs
+            ])
+
+        for event_request in self.event_requests(hrefs, team):
+            yield event_request
+
+
+    def href_event_date(self, href: str):
+        """
+        Date of the event in an href, None if it can't be read
+            ex - /mlb-baseball/giants-at-dodgers-tickets/7-29-2023-los-angeles-ca-dodger-stadium/events/64a0 -> 2023-07-29
+        """
+
+        try:
+            date_part = "-".join(href.split("/")[3].split("-")[:3])
+            return datetime.strptime(date_part, "%m-%d-%Y").strftime("%Y-%m-%d")
+        except (IndexError, ValueError):
+            return None
+
+
+    def href_home_team(self, href: str):
+        """
+        Home team of the event in an href, None if it can't be read
+            ex - /mlb-baseball/giants-at-dodgers-tickets/7-29-2023-los-angeles-ca-dodger-stadium/events/64a0 -> dodgers
+        """
+
+        try:
+            matchup = href.split("/")[2].removesuffix("-tickets")
+        except IndexError:
+            return None
+        return matchup.split("-at-")[1] if "-at-" in matchup else None
+
+
+    def event_requests(self, hrefs: list[str], team: str):
+        """
+        Requests of the event pages, with the event_date filter applied
+
+        hrefs: hrefs of the events of the team
+        team: team the events were found for
+        """
 
-            # Click on the "Show More" button
-            await page.click('button._2fYUaUKGPuVGvKyE_5wB0p')
-            
-            # Wait for some time to allow the content to load after clicking the button
-            await page.wait_for_timeout(5000)
-            
-            show_more_button = await page.query_selector('button._2fYUaUKGPuVGvKyE_5wB0p')
-            logger.info(f"show_more_button exists: {True if show_more_button else False}")
-            click_cnt += 1                   
-
-        logger.info("Show more button no longer present. Extracting the HTML from the page")
-        updated_events_html = await page.content()
-
-        # Extract all the urls for the games
-        soup = BeautifulSoup(updated_events_html, 'html.parser')
-        section = soup.find('section', class_='_2nM98ETTbcRZ87usbOF3tM')
-        hrefs = [a['href'] for a in section.find_all('a')]
-        # Some of the extracted URLS will be for concerts / non sports games
-        # This will filter them out
-        # HREFs are of the form: /mlb-baseball/AwayTeam-at-HomeTeam-tickets/date-city-venue/events/event_id
-        hrefs = [x for x in hrefs if x.split("/")[2].endswith(f"at-{self.team.lower()}-tickets")]
-        
         # If event date was provided, then filter for that game's URL
         if self.event_date_filter is not None:
             logger.info(f"event_date_filter = {self.event_date_filter} so filtering hrefs")
@@ -104,17 +325,120 @@ class GametimeSpider(scrapy.Spider):
 
         logger.info(f"# of events = {len(hrefs)}")
 
-        base_url = "https://gametime.co"
         for href in hrefs:
-            logger.info(f"{href = }")
-            event_url = base_url + href
-            logger.info(f"{event_url = }")
+            logger.debug("href = %s", href)
+            # HREFs end with the event id
+            event_id = href.rstrip("/").split("/")[-1]
+            if event_id in self.seen_event_ids:
+                self.crawler.stats.inc_value("batch/duplicate_events")
+                continue
+            self.seen_event_ids.add(event_id)
+            yield self.event_page_request(href, team)
 
-            yield scrapy.Request(
-                url = event_url,
-                callback=self.parse,
-                meta={"playwright": True, "playwright_include_page": True}
-            )                 
+
+    def event_page_request(self, href: str, team: str):
+        """
+        Request of an event page
+
+        href: href of the event
+        team: team the event was found for
+        """
+
+        base_url = "https://gametime.co"
+        event_url = base_url + href
+        logger.info("event_url = %s", event_url)
+
+        meta = playwright_meta(
+            self.settings,
+            instrument_stage="load_event",
+            team=team,
+            # Used by the polling daemon to schedule the event (see polling.py)
+            event_id=href.rstrip("/").split("/")[-1],
+            event_date=self.href_event_date(href),
+            event_href=href,
+        )
+        if self.settings.get("GAMETIME_EXTRACTION_MODE") == "network":
+            # Hook the page's responses before it navigates so the listings XHR isn't missed
+            capture = ListingsCapture(self.settings.get("GAMETIME_LISTINGS_URL_PATTERN"))
+            meta["playwright_page_event_handlers"] = {"response": capture.on_response}
+            meta["listings_capture"] = capture
+
+        return scrapy.Request(
+            url = event_url,
+            callback=self.parse,
+            meta=meta
+        )
+
+
+    def poll_request(self, request):
+        """
+        New request of an event page for the polling daemon
+        The meta of a page request can't be reused (browser context, listings capture)
+        """
+
+        return self.event_page_request(request.meta["event_href"], request.meta.get("team")).replace(dont_filter=True)
+
+
+    async def expand_games(self, page):
+        """
+        Click the SHOW MORE button until it no longer exists
+
+        In "event" mode (default) each click waits until the games section grows or the
+            button disappears, bounded by GAMETIME_SHOW_MORE_CLICK_TIMEOUT
+        In "fixed" mode each click waits a flat 5 seconds
+        The whole expansion is bounded by GAMETIME_SHOW_MORE_MAX_SECONDS
+
+        page: playwright page of the venue
+        return: number of games displayed once the expansion is done
+        """
+
+        mode = self.settings.get("GAMETIME_SHOW_MORE_MODE", "event")
+        click_timeout = self.settings.getfloat("GAMETIME_SHOW_MORE_CLICK_TIMEOUT", 10)
+        deadline = time.monotonic() + self.settings.getfloat("GAMETIME_SHOW_MORE_MAX_SECONDS", 120)
+        games_selector = f"{GAMES_SECTION} a"
+
+        games_cnt = await page.locator(games_selector).count()
+        show_more_button = await page.query_selector(SHOW_MORE_BUTTON)
+        logger.info(f"show_more_button exists: {True if show_more_button else False}, {games_cnt} games displayed")
+
+        click_cnt = 1
+        while show_more_button is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"SHOW MORE expansion stopped after {click_cnt - 1} clicks, time limit reached")
+                break
+
+            logger.info(f"Clicking SHOW MORE : {click_cnt}")
+            await page.click(SHOW_MORE_BUTTON)
+
+            if mode == "fixed":
+                # Wait for some time to allow the content to load after clicking the button
+                await page.wait_for_timeout(5000)
+            else:
+                try:
+                    await page.wait_for_function(
+                        GAMES_LOADED_JS,
+                        arg=[GAMES_SECTION, SHOW_MORE_BUTTON, games_cnt],
+                        timeout=min(click_timeout, remaining) * 1000,
+                    )
+                except PlaywrightTimeoutError:
+                    logger.warning(f"No new games loaded within {click_timeout}s of SHOW MORE click {click_cnt}")
+
+            new_games_cnt = await page.locator(games_selector).count()
+            added_cnt = new_games_cnt - games_cnt
+            games_cnt = new_games_cnt
+            self.crawler.stats.inc_value("gametime/show_more/clicks")
+            logger.info(f"SHOW MORE click {click_cnt} added {added_cnt} games ({games_cnt} total)")
+
+            show_more_button = await page.query_selector(SHOW_MORE_BUTTON)
+            logger.info(f"show_more_button exists: {True if show_more_button else False}")
+            if show_more_button is not None and added_cnt == 0 and mode != "fixed":
+                logger.warning("SHOW MORE click did not add any games, stopping expansion")
+                break
+            click_cnt += 1
+
+        self.crawler.stats.set_value("gametime/show_more/games", games_cnt)
+        return games_cnt
 
 
     async def parse(self, response):
@@ -127,67 +451,301 @@ class GametimeSpider(scrapy.Spider):
         """
 
         page = response.meta["playwright_page"]
+        await record_page_metrics(page, self.crawler.stats)
+        team = response.meta.get("team")
+        home_team = self.href_home_team(urlparse(response.url).path)
+
+        # "evaluate" reads the listings with a single script in the browser and only
+        # needs the event info once per page. "soup" reads and parses the page HTML per quantity
+        extraction_mode = self.settings.get("GAMETIME_EXTRACTION_MODE", "evaluate")
+        event_date = opponent = None
+        if extraction_mode in ("evaluate", "network"):
+            event_date, opponent = self.parse_event_title(await page.title())
+
+        # "network" reads every quantity from the listings JSON the page already downloaded
+        # Falls back to clicking through the quantities if no payload was captured
+        if extraction_mode == "network":
+            payloads = await response.meta["listings_capture"].wait(
+                self.settings.getfloat("GAMETIME_LISTINGS_CAPTURE_TIMEOUT", 15),
+                self.settings.getfloat("GAMETIME_LISTINGS_CAPTURE_QUIET", 2),
+            )
+            with stage(self, "parse_listings"):
+                event_listings = self.parse_listings_payloads(payloads, event_date, opponent)
+            if event_listings:
+                await page.close()
+                self.crawler.signals.send_catch_log(
+                    event_parsed, spider=self, response=response, listings=len(event_listings)
+                )
+                for event_listing in event_listings:
+                    event_listing.team = team
+                    event_listing.home_team = home_team
+                    yield event_listing
+                return
+            logger.warning(
+                f"No listings in the {len(payloads)} payloads captured for {response.url}, "
+                "clicking through the quantities"
+            )
+            extraction_mode = "evaluate"
 
         # The ticket quantity button will open a dropdown with the ticket quantity
         # options available. We must first click this and then we can click on each 
         # quantity option
-        ticket_quantity_button = 'div._3jbsE7bPH2773pyaT0ayCf > :nth-child(2)'
-        logger.info(f"ticket_quantity_button exists: {True if ticket_quantity_button else False}")
-        await page.click(ticket_quantity_button)   
+        logger.info(f"ticket_quantity_button exists: {True if TICKET_QUANTITY_BUTTON else False}")
+        await page.click(TICKET_QUANTITY_BUTTON)   
         
         logger.info("Ticket quantity button clicked, extracting the html")
         updated_html = await page.content()
 
         selector = Selector(text=updated_html)
         # This element holds all the ticket quantity options available
-        ticket_quantity_elements = selector.css("div._1WI7N_Bs_b0gkDH7dzIdkV div._2dcu_9HNIoUpC8-dQyqvMR")
+        ticket_quantity_elements = selector.css(f"{TICKET_QUANTITY_OPTIONS} div._2dcu_9HNIoUpC8-dQyqvMR")
         logger.info(f"Len ticket_quantity_elements = {len(ticket_quantity_elements)}")
         tq_len = len(ticket_quantity_elements)
         logger.info(f"{tq_len} ticket quantity elements")
 
-        # Loop through the ticket quantities and click each one
-        # The listings for the quantity selected will appear on the side of the screen
-        # Once we are done with the given quantity, we will need to click on the 
-        # ticket quantity button again before we can click on the next quantity
+        # Extract the ticket quantities, option i holds the quantity at index i - 1
+        ticket_quantities = []
         for i in range(1,tq_len+1):
-            # Extract the ticket quantity
             div_element = selector.css(f'div#{i}')
             tickets_text = div_element.css('span._7in0Cl45Y3DqI27Uw8KET::text').get()
             # tickets_text = div_element.css('span._7in0Cl45Y3DqI27Uw8KET::text')[i].get()
-            ticket_quantity = tickets_text.split(" ")[0]
-            logger.info(f"{ticket_quantity = }")
+            ticket_quantities.append(tickets_text.split(" ")[0])
+        logger.info(f"{ticket_quantities = }")
+
+        # Every quantity gets its own request, see GAMETIME_QUANTITY_TASKS
+        if self.settings.getbool("GAMETIME_QUANTITY_TASKS") and tq_len > 1:
+            await page.close()
+            for i, ticket_quantity in enumerate(ticket_quantities, start=1):
+                yield self.quantity_request(response.url, team, i, ticket_quantity)
+            return
+
+        concurrency = self.settings.getint("GAMETIME_QUANTITY_CONCURRENCY", 1)
+        if concurrency > 1 and tq_len > 1:
+            event_listings = await self.sweep_quantities(
+                response, ticket_quantities, extraction_mode, concurrency
+            )
+            self.crawler.signals.send_catch_log(
+                event_parsed, spider=self, response=response, listings=len(event_listings)
+            )
+            for event_listing in event_listings:
+                event_listing.team = team
+                event_listing.home_team = home_team
+                yield event_listing
+            return
 
+        # Loop through the ticket quantities and click each one
+        # The listings for the quantity selected will appear on the side of the screen
+        # Once we are done with the given quantity, we will need to click on the 
+        # ticket quantity button again before we can click on the next quantity
+        listings_cnt = 0
+        for i, ticket_quantity in enumerate(ticket_quantities, start=1):
             logger.info(f"Clicking the button for ticket quantity {ticket_quantity}")
-            tq_button = f'div._1WI7N_Bs_b0gkDH7dzIdkV > :nth-child({i})'
-            await page.click(tq_button)
-
-            # Extract the html so we can then parse the listings from it
-            listings_html = await page.content()
-            soup = BeautifulSoup(listings_html, 'html.parser')
-
-            await self.parse_listings(soup, ticket_quantity)
+            with stage(self, "click_quantity"):
+                await page.click(f'{TICKET_QUANTITY_OPTIONS} > :nth-child({i})')
+
+            listing_rows, event = await self.read_listings(page, extraction_mode)
+            if event is not None:
+                event_date, opponent = event
+
+            with stage(self, "parse_listings"):
+                event_listings = self.parse_listings(listing_rows, ticket_quantity, event_date, opponent)
+            listings_cnt += len(event_listings)
+            for event_listing in event_listings:
+                event_listing.team = team
+                event_listing.home_team = home_team
+                yield event_listing
  
             # Click on the ticket quantity button again so we can then click
             # on the next quantity
             if i < tq_len:
-                time.sleep(2)
+                await page.wait_for_timeout(2000)
                 logger.info("Clicking ticket quantity button...")
-                ticket_quantity_button = 'div._3jbsE7bPH2773pyaT0ayCf > :nth-child(2)'
-                await page.click(ticket_quantity_button)
+                await page.click(TICKET_QUANTITY_BUTTON)
 
         await page.close()
+        self.crawler.signals.send_catch_log(event_parsed, spider=self, response=response, listings=listings_cnt)
+
+
+    def quantity_request(self, event_url: str, team: str, ticket_quantity_index: int, ticket_quantity: str):
+        """
+        Request of the listings of a single ticket quantity of an event, see GAMETIME_QUANTITY_TASKS
+
+        event_url: url of the event
+        team: team the event was found for
+        ticket_quantity_index: position of the quantity in the dropdown, starting at 1
+        ticket_quantity: quantity of tickets
+        """
+
+        return scrapy.Request(
+            url=event_url,
+            callback=self.parse_quantity,
+            meta=playwright_meta(
+                self.settings,
+                instrument_stage="load_event",
+                team=team,
+                event_url=event_url,
+                ticket_quantity_index=ticket_quantity_index,
+                ticket_quantity=ticket_quantity,
+            ),
+            # Same URL as the event page and the other quantities
+            dont_filter=True
+        )
+
+
+    async def parse_quantity(self, response):
+        """
+        Select the ticket quantity of the request and parse its listings
 
+        response: response of a quantity_request
+        """
 
-    async def event_info(self, listings_soup: BeautifulSoup):
+        page = response.meta["playwright_page"]
+        team = response.meta.get("team")
+        home_team = self.href_home_team(urlparse(response.url).path)
+        ticket_quantity = response.meta["ticket_quantity"]
+        # "network" mode reads every quantity on the event page, a single quantity is clicked instead
+        extraction_mode = self.settings.get("GAMETIME_EXTRACTION_MODE", "evaluate")
+        extraction_mode = "evaluate" if extraction_mode == "network" else extraction_mode
+        try:
+            with stage(self, "click_quantity"):
+                await page.click(TICKET_QUANTITY_BUTTON)
+                await page.click(f'{TICKET_QUANTITY_OPTIONS} > :nth-child({response.meta["ticket_quantity_index"]})')
+            event_date, opponent = self.parse_event_title(await page.title())
+            listing_rows, _ = await self.read_listings(page, extraction_mode)
+        finally:
+            await page.close()
+
+        with stage(self, "parse_listings"):
+            event_listings = self.parse_listings(listing_rows, ticket_quantity, event_date, opponent)
+        for event_listing in event_listings:
+            event_listing.team = team
+            event_listing.home_team = home_team
+            yield event_listing
+
+
+    def task_request(self, task: dict):
         """
-        Extract event info from the html
+        Request of a task of a distributed run (see distributed.py)
+
+        task: meta of an event page or ticket quantity request
+        """
+
+        if "ticket_quantity_index" in task:
+            return self.quantity_request(
+                task["event_url"], task.get("team"), task["ticket_quantity_index"], task["ticket_quantity"]
+            )
+        return self.event_page_request(task["event_href"], task.get("team"))
 
-        listings_soup: BeautifulSoup object of the html page of ticket listings
+
+    def sweep_request(self, url: str):
+        """
+        Request of an extra page of the event for sweep_quantities
+        It is downloaded with engine.download, which skips the scheduler, so the AdaptiveRateController
+            doesn't see it: it is put in the browser slot of the site here, paced like the event pages
+
+        url: url of the event
+        """
+
+        request = scrapy.Request(url=url, meta=playwright_meta(self.settings, request_class="browser"), dont_filter=True)
+        if self.settings.getbool("ADAPTIVE_RATE_ENABLED"):
+            request.meta["download_slot"] = download_slot(request, "browser")
+        return request
+
+
+    async def sweep_quantities(
+        self,
+        response,
+        ticket_quantities: list[str],
+        extraction_mode: str,
+        concurrency: int
+    ):
+        """
+        Extract the listings for every ticket quantity in parallel
+        The first quantity is read on the event page, with the quantity dropdown open,
+            every other quantity gets its own page of the event, downloaded through
+            scrapy-playwright like any other page (blocked resources, page limits, user agent, stats)
+        At most `concurrency` pages are open at once, the event page included
+        Listings are returned once all quantities are done, in quantity order
+
+        response: response of the event page
+        ticket_quantities: ticket quantities in the order of the dropdown
+        extraction_mode: "evaluate" or "soup"
+        concurrency: max # of pages open at once
+        return: listing items of all the ticket quantities
+        """
+
+        url = response.url
+        semaphore = asyncio.Semaphore(concurrency)
+        logger.info(f"Sweeping {len(ticket_quantities)} ticket quantities over {concurrency} pages")
+
+        async def sweep_quantity(i: int):
+            async with semaphore:
+                if i == 1:
+                    quantity_page = response.meta["playwright_page"]
+                else:
+                    request = self.sweep_request(url)
+                    with stage(self, "load_event"):
+                        quantity_response = await maybe_deferred_to_future(self.crawler.engine.download(request))
+                    quantity_page = quantity_response.meta["playwright_page"]
+                try:
+                    with stage(self, "click_quantity"):
+                        if i > 1:
+                            await quantity_page.click(TICKET_QUANTITY_BUTTON)
+                        await quantity_page.click(f'{TICKET_QUANTITY_OPTIONS} > :nth-child({i})')
+                    event = self.parse_event_title(await quantity_page.title())
+                    listing_rows, _ = await self.read_listings(quantity_page, extraction_mode)
+                    return listing_rows, event
+                finally:
+                    await quantity_page.close()
+
+        results = await asyncio.gather(
+            *[sweep_quantity(i) for i in range(1, len(ticket_quantities) + 1)],
+            return_exceptions=True
+        )
+
+        event_listings = []
+        for ticket_quantity, result in zip(ticket_quantities, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to extract ticket quantity {ticket_quantity} for {url}: {result!r}")
+                continue
+            listing_rows, (event_date, opponent) = result
+            with stage(self, "parse_listings"):
+                event_listings.extend(self.parse_listings(listing_rows, ticket_quantity, event_date, opponent))
+        return event_listings
+
+
+    async def read_listings(self, page, extraction_mode: str):
+        """
+        Extract the listings currently displayed on the page
+
+        page: playwright page of the event with a ticket quantity selected
+        extraction_mode: "evaluate" or "soup"
+        return: (section_row, price) text of each listing and, in "soup" mode,
+            the event info (None in "evaluate" mode)
+            "soup" mode parses the page with the GAMETIME_HTML_PARSER backend
+        """
+
+        with stage(self, "extract_html"):
+            if extraction_mode == "evaluate":
+                # Pull the section / row and price text straight out of the DOM
+                return await page.evaluate(LISTINGS_JS, LISTING_SELECTORS), None
+
+            # Extract the html so we can then parse the listings from it
+            listings_html = await page.content()
+            listing_rows, title = await self.parse_html("listings_page", listings_html)
+            return listing_rows, self.parse_event_title(title)
+
+
+    def parse_event_title(self, title: str):
+        """
+        Extract event info from the title of the listings page
+            ex - Giants at Dodgers - 7/29/23 at 7:10 PM -> 2023-07-29, Giants
+
+        title: title of the html page of ticket listings
         return: event_date (string in YYYY-MM-DD format) and opponent
         """
 
         logger.info("Parsing the event info")
-        title = listings_soup.title.text
         title_split = title.split(" - ")
         opponent = title_split[0].split(" at ")[0]
         event_date_raw = title_split[1].split(" at ")[0]
@@ -199,66 +757,151 @@ class GametimeSpider(scrapy.Spider):
         return event_date, opponent 
 
 
-    async def parse_listings(
+    def parse_listings(
         self, 
-        listings_soup: BeautifulSoup, 
-        quantity: int
+        listing_rows: list[tuple[str, str]], 
+        quantity: int,
+        event_date: str,
+        opponent: str
     ):
         """
         Loop through all the listings and extract relevant info
 
-        listings_soup: BeautifulSoup object of the html page of ticket listings
+        listing_rows: (section_row, price) text of each listing on the page
         quantity: # of tickets in the listing
-            Each listings_soup contains a single quantity of tix per listing
+            Each page of listings contains a single quantity of tix per listing
+        event_date: YYYY-MM-DD date of the event
+        opponent: name of the away team
+        return: listing items
         """
 
-        event_date, opponent = await self.event_info(listings_soup)
-        event_date_str = event_date.replace("-","")
+        listings = []
+        for section_row, price in listing_rows:
+            # Extract section / row
+            #   ex - "Section 112, Row 5" -> "Section 112", "5"
+            section_row = section_row.split(",", 2)
+            section = section_row[0].strip()
+            row = section_row[1].replace("Row","").strip()
 
-        # Create a CSV that the listings will be appended to
-        # If file already exists it won't be recreated
-        # All listings for a game will be written to the same file
-        csv_file_path = create_csv(
-            self.file_timestamp, 
-            self.name, 
-            event_date_str, 
-            EVENT_LISTING_GAMETIME_HEADERS
-        )   
+            # Extract price
+            #   ex - "$1,234/ea" -> "1234"
+            #   anything else is left in, so an unexpected price fails on Decimal instead of being misread
+            price = price.strip().removesuffix("/ea").replace("$", "").replace(",", "")
+            listings.append((section, row, price, None))
 
-        # This element contains all of the listings
-        div_elements = listings_soup.find_all('div', class_='_2h7x6MAQ0R9rPi2f7MFJXo')
+        return self.build_listings(listings, quantity, event_date, opponent)
 
-        all_listings = []
-        for div_elem in div_elements:
-            # Extract section / row
-            section_row = div_elem.select_one('div._1EShqotjRsBqatpuDDtfZ7 ._1-M9Q0QPzQQPipMVX0voMp').text
-            logger.info(f"{section_row = }")
-            section = section_row.split(",")[0].strip()
-            row = section_row.split(",")[1].replace("Row","").strip()
 
-            # Extract price
-            price = div_elem.select_one('div._1Ez1uMaistdU48Vpp8XeO2 span').text
-            price = price.replace("/ea","").replace("$","").replace(",","")
-            logger.info(f"{section}, {row}, {price}")
-         
-            event_listing = EventListingGametime()
-            event_listing["event_date"] = event_date
-            event_listing["opponent"] = opponent
-            event_listing["section"] = section
-            event_listing["row"] = row
-            event_listing["quantity"] = quantity
-            event_listing["price"] = price 
-            # current time in YYYY-MM-DD H:M:S format
-            event_listing["listing_valid_as_of"] = datetime.strptime(datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
-            logger.debug(f"{event_listing = }")
+    def parse_listings_payloads(
+        self,
+        payloads: list[dict],
+        event_date: str,
+        opponent: str
+    ):
+        """
+        Extract the listings for every ticket quantity from the listings JSON
+            captured from the event page
+
+        Each payload is expected to be {"listings": [...]} (or the list of listings itself)
+            and each listing to look like
+            {"id": "abc", "spot": {"section": "112", "row": "5"}, "price": {"total": 123400}, "splits": [2, 4]}
+            price.total is the price per ticket in cents and splits are the ticket
+            quantities the listing can be bought in
+        Payloads and listings of any other shape are skipped
+        Sections and prices are written the same way they are when read from the page
+
+        payloads: listings JSON responses captured from the event page
+        event_date: YYYY-MM-DD date of the event
+        opponent: name of the away team
+        return: listing items of all the ticket quantities
+        """
+
+        # quantity -> [(section, row, price, listing_id)]
+        listings_by_quantity = {}
+        seen_listing_ids = set()
+        skipped = 0
+        for payload in payloads:
+            if isinstance(payload, dict):
+                payload = payload.get("listings")
+            if not isinstance(payload, list):
+                logger.warning(f"Skipping listings payload of unexpected shape: {type(payload).__name__}")
+                continue
+
+            for listing in payload:
+                if not isinstance(listing, dict):
+                    skipped += 1
+                    continue
+                price = listing.get("price")
+                price = price.get("total") if isinstance(price, dict) else None
+                spot = listing.get("spot")
+                splits = listing.get("splits")
+                if not isinstance(price, (int, float)) or not isinstance(spot, dict) or not isinstance(splits, list):
+                    skipped += 1
+                    continue
+
+                # The page can request the same listings more than once
+                listing_id = listing.get("id")
+                if listing_id is not None:
+                    listing_id = str(listing_id)
+                    if listing_id in seen_listing_ids:
+                        continue
+                    seen_listing_ids.add(listing_id)
+
+                # Match the section / price as they are displayed on the page
+                #   ex - "112", 123400 -> "Section 112", "1234"
+                section = str(spot.get("section", ""))
+                if not section.startswith("Section"):
+                    section = f"Section {section}"
+                row = str(spot.get("row", ""))
+                price = f'{price / 100:.2f}'.removesuffix(".00")
+                for quantity in splits:
+                    if not isinstance(quantity, int):
+                        continue
+                    listings_by_quantity.setdefault(str(quantity), []).append((section, row, price, listing_id))
+
+        if skipped:
+            logger.warning(f"Skipped {skipped} listings of unexpected shape in the listings payloads")
+
+        logger.info(f"{len(listings_by_quantity)} ticket quantities found in the listings payload")
+        event_listings = []
+        for quantity in sorted(listings_by_quantity, key=int):
+            event_listings.extend(
+                self.build_listings(listings_by_quantity[quantity], quantity, event_date, opponent)
+            )
+        return event_listings
+
+
+    def build_listings(
+        self,
+        listings: list[tuple[str, str, str, str]],
+        quantity: int,
+        event_date: str,
+        opponent: str
+    ):
+        """
+        Build the listing items
+        The items are written to the CSV for the event by the CsvWriterPipeline
+
+        listings: (section, row, price, listing_id) of each listing, listing_id is None
+            when the listing was read from the page
+        quantity: # of tickets in the listing
+        event_date: YYYY-MM-DD date of the event
+        opponent: name of the away team
+        return: listing items
+        """
+
+        # current time in YYYY-MM-DD H:M:S format, the same for every listing in the batch
+        listing_valid_as_of = datetime.utcnow().replace(microsecond=0)
+        quantity = int(quantity)
+
+        all_listings = []
+        for section, row, price, listing_id in listings:
+            event_listing = ListingRecord(
+                event_date, opponent, section, row, quantity, Decimal(price), listing_valid_as_of, listing_id
+            )
+            self.listing_logger.debug("event_listing = %r", event_listing)
             all_listings.append(event_listing)
 
-        logger.info(f"# listings for ticket quantity {quantity}: {len(all_listings)}")
+        logger.info("# listings for ticket quantity %s: %s", quantity, len(all_listings))
 
-        save_to_csv(
-            self.file_timestamp, 
-            self.name, 
-            event_date_str, 
-            all_listings, 
-            is_append=True
-        )   
\ No newline at end of file
+        return all_listings
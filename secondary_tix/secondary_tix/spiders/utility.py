@@ -3,8 +3,17 @@ import sys
 import logging
 from pathlib import Path
 import csv
+from datetime import date, datetime
 from scrapy.utils.project import get_project_settings
 
+# Only needed for the parquet output
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -89,9 +98,102 @@ def save_to_csv(
         writer.writerows(data)        
 
 
+def listing_schema():
+    """
+    Typed columns of the parquet listings
+    """
+
+    return pa.schema([
+        ("event_date", pa.date32()),
+        ("opponent", pa.dictionary(pa.int32(), pa.string())),
+        ("section", pa.dictionary(pa.int32(), pa.string())),
+        ("row", pa.dictionary(pa.int32(), pa.string())),
+        ("quantity", pa.int32()),
+        ("price", pa.float64()),
+        ("listing_valid_as_of", pa.timestamp("s")),
+        # Team the listings were crawled for in batch mode, null otherwise and in files written before it
+        ("team", pa.dictionary(pa.int32(), pa.string())),
+    ])
+
+
+def save_to_parquet(
+        output_directory: Path,
+        file_timestamp: str,
+        website: str,
+        event_date: str,
+        data: list[dict],
+        row_group_size: int=65536,
+        compression: str="zstd",
+        team: str=None
+    ):
+    """
+    Write the listings of one event as a parquet file
+    Files are partitioned by website and event date so a single event can be read
+        without touching the rest of the snapshots
+        output/parquet/spider=[website]/event_date=[YYYY-MM-DD]/[file_timestamp].parquet
+        output/parquet/spider=[website]/event_date=[YYYY-MM-DD]/team=[team]/[file_timestamp].parquet in batch mode
+
+    output_directory: folder the output folder is created in (OUTPUT_DIRECTORY of the crawler settings)
+    file_timestamp: timestamp of the run, used for the file name
+    website: name of the website the listings are from
+    event_date: YYYY-MM-DD of the event the listings are for
+    data: list of dictionaries with the listings
+    row_group_size: max # of rows per row group
+    compression: parquet compression codec
+    team: team the listings were crawled for in batch mode, None otherwise
+    """
+
+    if pa is None:
+        raise ImportError("pyarrow is required for the parquet output: pip install pyarrow")
+
+    output_dir = Path(output_directory) / f"output/parquet/spider={website}/event_date={event_date}"
+    if team:
+        output_dir = output_dir / f"team={team}"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    full_path = output_dir / f"{file_timestamp}.parquet"
+
+    columns = {
+        "event_date": [date.fromisoformat(x["event_date"]) for x in data],
+        "opponent": [x["opponent"] for x in data],
+        "section": [str(x["section"]) for x in data],
+        "row": [str(x["row"]) for x in data],
+        "quantity": [int(x["quantity"]) for x in data],
+        "price": [float(x["price"]) for x in data],
+        "listing_valid_as_of": [x["listing_valid_as_of"] for x in data],
+        "team": [x.get("team") for x in data],
+    }
+    table = pa.table(columns, schema=listing_schema())
+
+    logger.info(f"Saving to {full_path}")
+    pq.write_table(table, full_path, row_group_size=row_group_size, compression=compression)
+
+
+def read_parquet_snapshots(output_directory: Path, website: str, event_date: str=None, team: str=None):
+    """
+    Read the parquet snapshots of a website, optionally for a single event and team
+
+    output_directory: folder the output folder was created in (OUTPUT_DIRECTORY)
+    website: name of the website the listings are from
+    event_date: YYYY-MM-DD of the event, None reads every event
+    team: only the listings crawled for this team (batch mode), None reads every team
+    return: pyarrow Table with a column per listing field plus event_date
+    """
+
+    if pa is None:
+        raise ImportError("pyarrow is required for the parquet output: pip install pyarrow")
+
+    path = Path(output_directory) / f"output/parquet/spider={website}"
+    if event_date is not None:
+        path = path / f"event_date={event_date}"
+    dataset = ds.dataset(path, format="parquet", schema=listing_schema())
+    return dataset.to_table(filter=ds.field("team") == team if team is not None else None)
+
+
 def create_root_logger(output_to_file: bool=False, log_filename: str=None):
     """
     Create a logger 
+    Handlers are only added the first time it is called, calling it again
+        does not wipe handlers added by Scrapy or the QueueLoggingExtension
     
     output_to_file: logs will only be streamed unless this parameter is set to True
         If True, then logs will be output to a file
@@ -103,12 +205,13 @@ def create_root_logger(output_to_file: bool=False, log_filename: str=None):
     # Get the logger
     logger = logging.getLogger()
 
-    # Reset handlers on the logger
     # Helps avoid multiple handlers
-    logger.handlers = []
+    if any(getattr(x, "_root_logger_handler", False) for x in logger.handlers):
+        return logger
 
     # Create a stream handler
     sh = logging.StreamHandler(stream=sys.stderr)
+    sh._root_logger_handler = True
 
     # Add formatter to stream handler
     sh.setFormatter(formatter)
@@ -121,9 +224,11 @@ def create_root_logger(output_to_file: bool=False, log_filename: str=None):
             os.makedirs(LOG_DIRECTORY)
         fh = logging.FileHandler(LOG_DIRECTORY / log_filename if log_filename else 'log.txt')
         fh.setLevel(logging.INFO)
+        fh.setFormatter(formatter)
+        fh._root_logger_handler = True
         logger.addHandler(fh)
 
     # Set logging level
     logger.setLevel(logging.INFO)
 
-    return logger
\ No newline at end of file
+    return logger
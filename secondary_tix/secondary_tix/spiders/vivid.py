@@ -1,31 +1,75 @@
 import scrapy
-from secondary_tix.items import EventListing
+from secondary_tix.items import ListingRecord, event_parsed
+from secondary_tix.instrumentation import stage
+from secondary_tix.batch import load_batch_config, batch_teams
+from secondary_tix.discovery_cache import DiscoveryCache
 from bs4 import BeautifulSoup
 from scrapy.selector import Selector
 from datetime import datetime
+from decimal import Decimal
 import logging
-from .utility import save_to_csv, create_root_logger
+from secondary_tix.logging_utils import SampledLogger
 
-logger = create_root_logger(
-    output_to_file=False, # Set to True to output logs to file
-    log_filename=f'vivid_{datetime.now().strftime("%Y%m%d%H%M")}.log'
-)
+logger = logging.getLogger(__name__)
 
 
 class VividSpider(scrapy.Spider):
     name = "vivid"
     allowed_domains = ["https://www.vividseats.com", "www.vividseats.com"]
     start_urls = [] # Put your URL in the list
+    # The schedule page and listings API are plain HTTP/JSON, no browser needed
+    # Scrapy's own download handlers instead of scrapy-playwright's, so Playwright isn't started
+    custom_settings = {"DOWNLOAD_HANDLERS": {}}
+    # Per-listing lines, only 1 of every LOG_LISTING_SAMPLE_EVERY is logged (see from_crawler)
+    listing_logger = SampledLogger(logger)
 
-    def __init__(self, event_date=None, *args, **kwargs):
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(VividSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.listing_logger = SampledLogger(logger, crawler.settings.getint("LOG_LISTING_SAMPLE_EVERY", 100))
+        return spider
+
+
+    def __init__(self, event_date=None, batch=None, refresh_discovery=None, *args, **kwargs):
         super(VividSpider, self).__init__(*args, **kwargs)
+        # Batch mode crawls every team of a batch config (see batch.py)
+        self.batch = batch is not None
+        if self.batch:
+            config = load_batch_config(batch)
+            self.teams = batch_teams(config, self.name)
+            event_date = event_date or config["event_date"]
         self.event_date_filter = event_date
+        # Events already requested, an event is listed for both teams in batch mode
+        self.seen_event_ids = set()
+        # Rediscover the events instead of using the discovery cache
+        self.refresh_discovery = refresh_discovery is not None and refresh_discovery not in ("0", "False", "false")
         if self.event_date_filter is not None:
             logger.info(f"Will be filtering for event date: {self.event_date_filter}")
         current_datetime = datetime.utcnow()
         self.file_timestamp = current_datetime.strftime("%Y%m%d%H%M%S")
 
 
+    def start_requests(self):
+        """
+        Schedule page of every team, or its listings requests straight away when
+            its events are in the discovery cache
+        """
+
+        discovery_cache = DiscoveryCache.from_settings(self.settings, self.refresh_discovery)
+        teams = self.teams if self.batch else [(None, url) for url in self.start_urls]
+        for team, url in teams:
+            # Without batch mode the events are cached per start URL
+            cached_events = discovery_cache.load(self.name, team or url) if discovery_cache else None
+            if cached_events is not None:
+                logger.info(f"Using {len(cached_events)} cached events for {team or url}")
+                self.crawler.stats.inc_value("discovery_cache/hits")
+                yield from self.event_requests(cached_events, team)
+                continue
+
+            self.crawler.stats.inc_value("discovery_cache/misses")
+            yield scrapy.Request(url, callback=self.parse, meta={"team": team, "discovery_key": team or url}, dont_filter=not self.batch)
+
+
     def parse(self, response):
         """
         Response received will be the Vivid homepage for the teams's games
@@ -36,19 +80,45 @@ class VividSpider(scrapy.Spider):
         """
 
         logger.info(f"Response status = {response.status}")
-        events = response.css('div.styles_box__QqP94 a.styles_link__1Scjm')
-        for event in events:
-            extracted_event_date = event.css('p.styles_md__1m2cS.styles_semi-bold__d780p::text').get()
-            logger.info(f"{extracted_event_date = }")
-            event_date = self.format_event_date_filter(extracted_event_date)
-            logger.info(f"{event_date = }")
-            event_title = event.css('div.styles_col__2dlgD p.styles_md__1m2cS.styles_semi-bold__d780p::text').get()
-            logger.info(f"{event_title = }")
-            event_url = event.attrib['href']
-            logger.info(f"{event_url = }")
-            event_id = event_url.split("/")[-1]
-            logger.info(f"{event_id = }")
+        team = response.meta.get("team")
+        discovered_events = []
+        with stage(self, "discover_events"):
+            events = response.css('div.styles_box__QqP94 a.styles_link__1Scjm')
+            for event in events:
+                extracted_event_date = event.css('p.styles_md__1m2cS.styles_semi-bold__d780p::text').get()
+                logger.info(f"{extracted_event_date = }")
+                event_date = self.format_event_date_filter(extracted_event_date)
+                logger.info(f"{event_date = }")
+                event_title = event.css('div.styles_col__2dlgD p.styles_md__1m2cS.styles_semi-bold__d780p::text').get()
+                logger.info(f"{event_title = }")
+                event_url = event.attrib['href']
+                logger.info(f"{event_url = }")
+                event_id = event_url.split("/")[-1]
+                logger.info(f"{event_id = }")
+                discovered_events.append({
+                    "event_id": event_id,
+                    "event_date": event_date,
+                    "event_title": event_title,
+                    "event_url": event_url,
+                })
+
+        discovery_cache = DiscoveryCache.from_settings(self.settings)
+        if discovery_cache is not None:
+            discovery_cache.save(self.name, response.meta.get("discovery_key", team or response.url), discovered_events)
+
+        yield from self.event_requests(discovered_events, team)
+
+
+    def event_requests(self, events: list[dict], team: str):
+        """
+        Listings API request of every event, with the event_date filter applied
+
+        events: events found on the schedule page, dicts with event_id, event_date and event_title
+        team: team the events were found for, None without batch mode
+        """
 
+        for event in events:
+            event_id, event_date = event["event_id"], event["event_date"]
             # If event date filter is provided, and it doesn't equal the current
             #   event in the loop, then continue / don not call the URL
             if self.event_date_filter is not None:
@@ -56,14 +126,50 @@ class VividSpider(scrapy.Spider):
                     logger.info(f"{self.event_date_filter} <> {event_date}")
                     continue
 
-            # This URL will send us to a JSON of all the listings for the game
-            ajax_url = f"https://www.vividseats.com/hermes/api/v1/listings?productionId={event_id}&includeIpAddress=true&priceGroupId=277"
-            logger.info(f"{ajax_url = }")
-            yield response.follow(
-                ajax_url, 
-                callback=self.parse_event_page, 
-                meta={"event_date": event_date, "event_title": event_title}
-            )
+            if event_id in self.seen_event_ids:
+                self.crawler.stats.inc_value("batch/duplicate_events")
+                continue
+            self.seen_event_ids.add(event_id)
+
+            yield self.event_request(event, team)
+
+
+    def event_request(self, event: dict, team: str):
+        """
+        Listings API request of an event
+
+        event: dict with event_id, event_date and event_title
+        team: team the event was found for, None without batch mode
+        """
+
+        event_id = event["event_id"]
+        # This URL will send us to a JSON of all the listings for the game
+        ajax_url = f"https://www.vividseats.com/hermes/api/v1/listings?productionId={event_id}&includeIpAddress=true&priceGroupId=277"
+        logger.info(f"{ajax_url = }")
+        return scrapy.Request(
+            ajax_url, 
+            callback=self.parse_event_page, 
+            meta={
+                # event_id / event_date are also used by the polling daemon (see polling.py)
+                "event_id": event_id,
+                "event_date": event["event_date"],
+                "event_title": event["event_title"],
+                "instrument_stage": "load_event",
+                # Paced as a JSON API by the AdaptiveRateController
+                "request_class": "api",
+                "team": team,
+            }
+        )
+
+
+    def task_request(self, task: dict):
+        """
+        Request of a task of a distributed run (see distributed.py)
+
+        task: meta of an event request
+        """
+
+        return self.event_request(task, task.get("team"))
 
 
     def format_event_date_filter(self, event_date_to_format: str)->str:
@@ -80,11 +186,16 @@ class VividSpider(scrapy.Spider):
 
     def parse_event_page(self, response):
         """
-        Parse the listings and save them as a CSV
+        Parse the listings, the CsvWriterPipeline saves them as a CSV
         The response received is a JSON of all the listings for a given game
+        Skipped if the listings didn't change since the last crawl (HTTPCACHE_SKIP_UNCHANGED)
         """
 
-        all_listings = []
+        if "cached" in response.flags and self.settings.getbool("HTTPCACHE_SKIP_UNCHANGED"):
+            # Same listings as the last crawl of the event (see httpcache.py)
+            logger.info(f"Listings of {response.meta.get('event_title')} unchanged, skipping")
+            self.crawler.stats.inc_value("vivid/unchanged_events")
+            return
 
         event_date = response.meta.get('event_date')
         # date_obj = f"{date_obj} {datetime.now().year}"
@@ -92,37 +203,35 @@ class VividSpider(scrapy.Spider):
         # event_date = date_obj.strftime("%Y-%m-%d")
 
         event_title = response.meta.get("event_title")
+        team = response.meta.get("team")
         event_title_split = event_title.find(" at ")
         opponent = event_title[:event_title_split]
+        home_team = event_title[event_title_split + 4:] if event_title_split >= 0 else None
 
-        logger.info(f"{event_date = }, {opponent = }")
-
-        event_date_str = event_date.replace("-","")
+        logger.info("event_date = %s, opponent = %s", event_date, opponent)
 
         all_event_data = response.json()
         tickets = all_event_data["tickets"]
-        for ticket in tickets:
-            event_listing = EventListing()
-            section = ticket["s"]
-            row = ticket["r"]
-            quantity = ticket["q"]
-            price = ticket["p"]    
-            event_listing["event_date"] = event_date
-            event_listing["opponent"] = opponent 
-            event_listing["section"] = section
-            event_listing["row"] = row
-            event_listing["quantity"] = quantity
-            event_listing["price"] = price 
-            # current time in YYYY-MM-DD H:M:S format
-            event_listing["listing_valid_as_of"] = datetime.strptime(datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
-            logger.debug(f"{event_listing = }")
-            all_listings.append(event_listing)
-
-        save_to_csv(self.file_timestamp, self.name, event_date_str, all_listings)   
-
-        
-
-
-
-
-
+        # current time in YYYY-MM-DD H:M:S format, the same for every listing in the response
+        listing_valid_as_of = datetime.utcnow().replace(microsecond=0)
+        with stage(self, "parse_listings"):
+            event_listings = []
+            for ticket in tickets:
+                event_listing = ListingRecord(
+                    event_date,
+                    opponent,
+                    ticket["s"],
+                    ticket["r"],
+                    int(ticket["q"]),
+                    Decimal(str(ticket["p"])),
+                    listing_valid_as_of,
+                    ticket.get("i"),
+                    team,
+                    home_team,
+                )
+                self.listing_logger.debug("event_listing = %r", event_listing)
+                event_listings.append(event_listing)
+        self.crawler.signals.send_catch_log(event_parsed, spider=self, response=response, listings=len(event_listings))
+
+        for event_listing in event_listings:
+            yield event_listing
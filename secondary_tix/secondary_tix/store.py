@@ -0,0 +1,104 @@
+# Listing history store
+#
+# Every listing of every run in one SQLite database so the history of an event
+# can be queried without reading the CSVs. See query.py for the lookups.
+
+import sqlite3
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    spider TEXT NOT NULL,
+    run TEXT NOT NULL,
+    event_date TEXT NOT NULL,
+    opponent TEXT,
+    section TEXT,
+    row TEXT,
+    quantity INTEGER,
+    price REAL,
+    listing_valid_as_of TEXT NOT NULL,
+    team TEXT
+);
+CREATE INDEX IF NOT EXISTS listings_by_seat
+    ON listings (spider, event_date, section, row, listing_valid_as_of);
+CREATE INDEX IF NOT EXISTS listings_by_section_run
+    ON listings (spider, event_date, section, run, price, team);
+CREATE INDEX IF NOT EXISTS listings_by_run
+    ON listings (spider, event_date, run, price, team);
+"""
+
+# Stores created before the listings had a team (batch mode, see batch.py) get the column,
+# and the indexes the queries filter on it with are rebuilt with it
+ADD_TEAM = """
+ALTER TABLE listings ADD COLUMN team TEXT;
+DROP INDEX IF EXISTS listings_by_section_run;
+DROP INDEX IF EXISTS listings_by_run;
+"""
+
+INSERT_LISTING = """
+INSERT INTO listings (
+    spider, run, event_date, opponent, section, row, quantity, price, listing_valid_as_of, team
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def connect(path) -> sqlite3.Connection:
+    """
+    Open the store, creating the database and its indexes if needed
+
+    path: path of the SQLite database file
+    return: sqlite3 connection
+    """
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    # WAL lets the query module read while a crawl is writing
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    columns = [x[1] for x in conn.execute("PRAGMA table_info(listings)")]
+    if columns and "team" not in columns:
+        conn.executescript(ADD_TEAM)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def listing_row(spider_name: str, run: str, listing: dict) -> tuple:
+    """
+    Listing dict as a row of the listings table
+
+    spider_name: name of the spider the listing is from
+    run: timestamp of the run (file_timestamp of the spider)
+    listing: listing dict with the EventListing fields, and the team in batch mode
+    """
+
+    listing_valid_as_of = listing["listing_valid_as_of"]
+    return (
+        spider_name,
+        run,
+        listing["event_date"],
+        listing["opponent"],
+        str(listing["section"]),
+        str(listing["row"]),
+        int(listing["quantity"]),
+        float(listing["price"]),
+        listing_valid_as_of.strftime("%Y-%m-%d %H:%M:%S")
+            if hasattr(listing_valid_as_of, "strftime") else str(listing_valid_as_of),
+        listing.get("team"),
+    )
+
+
+def insert_listings(conn: sqlite3.Connection, rows: list[tuple]):
+    """
+    Insert rows of the listings table in a single transaction
+
+    conn: connection returned by connect
+    rows: rows built with listing_row
+    """
+
+    with conn:
+        conn.executemany(INSERT_LISTING, rows)
+    logger.debug("Inserted %s listings", len(rows))
@@ -0,0 +1,178 @@
+# Adaptive per-domain rate controller
+#
+# Every request is put in a download slot per (domain, request class):
+#   "browser"  pages rendered by playwright (meta "playwright")
+#   "api"      JSON APIs (meta "request_class": "api", ex - Vivid listings)
+#   "http"     everything else
+# so heavy browser pages and cheap API calls to the same site are paced separately.
+#
+# Each slot starts from the budget of its class (ADAPTIVE_RATE_BUDGETS) and is adjusted
+# on every response, like Scrapy's AutoThrottle:
+#   - healthy responses (fast, no error status) lower the delay, then raise the concurrency
+#   - 403 / 429 / 503, captcha pages and slow responses multiply the delay by
+#     ADAPTIVE_RATE_BACKOFF_FACTOR and halve the concurrency
+# Decisions are counted in the stats as adaptive_rate/[class]/... and the current delay /
+# concurrency of every slot as adaptive_rate/slot/[slot]/...
+
+import re
+import logging
+from dataclasses import dataclass
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BUDGETS = {
+    "browser": {"start_delay": 10, "min_delay": 3, "max_delay": 120, "concurrency": 1, "max_concurrency": 2, "target_latency": 20},
+    "api": {"start_delay": 1, "min_delay": 0.1, "max_delay": 60, "concurrency": 2, "max_concurrency": 8, "target_latency": 2},
+    "http": {"start_delay": 2, "min_delay": 0.5, "max_delay": 60, "concurrency": 1, "max_concurrency": 4, "target_latency": 5},
+}
+# Only the start of the body is searched for captcha markers
+CAPTCHA_SEARCH_BYTES = 64 * 1024
+
+
+def download_slot(request, request_class: str) -> str:
+    """
+    Download slot of a request, one per (hostname, request class)
+        ex - "gametime.co:browser"
+    """
+
+    hostname = urlparse_cached(request).hostname or ""
+    return f"{hostname}:{request_class}"
+
+
+@dataclass
+class SlotState:
+    """
+    What the controller tracks per download slot
+    """
+
+    request_class: str
+    delay: float
+    concurrency: int
+    healthy_streak: int = 0
+
+
+class AdaptiveRateController:
+    """
+    Adjust the delay and concurrency of each download slot from its responses
+    See the top of the module, enabled with ADAPTIVE_RATE_ENABLED
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.budgets = {**DEFAULT_BUDGETS, **settings.getdict('ADAPTIVE_RATE_BUDGETS')}
+        self.backoff_factor = settings.getfloat('ADAPTIVE_RATE_BACKOFF_FACTOR', 2.0)
+        self.speedup_factor = settings.getfloat('ADAPTIVE_RATE_SPEEDUP_FACTOR', 0.75)
+        self.healthy_streak = settings.getint('ADAPTIVE_RATE_HEALTHY_STREAK', 3)
+        self.block_statuses = set(settings.getlist('ADAPTIVE_RATE_BLOCK_STATUSES', [403, 429, 503]))
+        self.captcha_pattern = re.compile(
+            settings.get('ADAPTIVE_RATE_CAPTCHA_PATTERN', r"captcha|cf-chl|access denied").encode(), re.I
+        )
+        # slot key -> SlotState
+        self.slots = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_RATE_ENABLED'):
+            raise NotConfigured
+        # Same priority as settings.py, so a CONCURRENT_REQUESTS from the command line or batch.py wins
+        crawler.settings.set(
+            'CONCURRENT_REQUESTS', crawler.settings.getint('ADAPTIVE_RATE_CONCURRENT_REQUESTS', 16), priority='project'
+        )
+        extension = cls(crawler)
+        crawler.signals.connect(extension.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(extension.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(extension.response_downloaded, signal=signals.response_downloaded)
+        return extension
+
+    def request_class(self, request) -> str:
+        request_class = request.meta.get("request_class")
+        if request_class is None:
+            request_class = "browser" if request.meta.get("playwright") else "http"
+        return request_class if request_class in self.budgets else "http"
+
+    def request_scheduled(self, request, spider):
+        # Requests that already picked a slot keep it
+        # Requests downloaded with engine.download skip the scheduler and set their slot themselves
+        if "download_slot" not in request.meta:
+            request.meta["download_slot"] = download_slot(request, self.request_class(request))
+
+    def request_reached_downloader(self, request, spider):
+        key = request.meta.get("download_slot")
+        if key in self.slots:
+            return
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+        request_class = self.request_class(request)
+        budget = self.budgets[request_class]
+        state = self.slots[key] = SlotState(request_class, float(budget["start_delay"]), int(budget["concurrency"]))
+        self._apply(key, slot, state)
+
+    def response_downloaded(self, response, request, spider):
+        key = request.meta.get("download_slot")
+        state = self.slots.get(key)
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if state is None or slot is None or "cached" in response.flags:
+            return
+
+        budget = self.budgets[state.request_class]
+        latency = request.meta.get("download_latency")
+        if response.status in self.block_statuses:
+            self._backoff(key, state, budget, f"status_{response.status}", self._retry_after(response))
+        elif self._captcha(response):
+            self._backoff(key, state, budget, "captcha")
+        elif latency is not None and latency > budget["target_latency"]:
+            self._backoff(key, state, budget, "slow")
+        elif response.status < 400:
+            state.healthy_streak += 1
+            if state.healthy_streak >= self.healthy_streak:
+                state.healthy_streak = 0
+                self._speedup(state, budget)
+        self._apply(key, slot, state)
+
+    def _captcha(self, response) -> bool:
+        content_type = response.headers.get(b"Content-Type", b"")
+        if b"html" not in content_type.lower():
+            return False
+        return self.captcha_pattern.search(response.body[:CAPTCHA_SEARCH_BYTES]) is not None
+
+    @staticmethod
+    def _retry_after(response) -> float:
+        """
+        Seconds asked for in a Retry-After header, 0 if there is none
+        """
+
+        try:
+            return float(response.headers.get(b"Retry-After", b"0"))
+        except ValueError:
+            return 0
+
+    def _speedup(self, state: SlotState, budget: dict):
+        if state.delay > budget["min_delay"]:
+            state.delay = max(budget["min_delay"], state.delay * self.speedup_factor)
+        elif state.concurrency < budget["max_concurrency"]:
+            state.concurrency += 1
+        else:
+            return
+        self.stats.inc_value(f'adaptive_rate/{state.request_class}/speedups')
+
+    def _backoff(self, key: str, state: SlotState, budget: dict, reason: str, retry_after: float=0):
+        state.healthy_streak = 0
+        state.delay = min(budget["max_delay"], max(state.delay * self.backoff_factor, budget["min_delay"], retry_after))
+        state.concurrency = max(1, state.concurrency // 2)
+        self.stats.inc_value(f'adaptive_rate/{state.request_class}/backoffs')
+        self.stats.inc_value(f'adaptive_rate/{state.request_class}/backoff_reason/{reason}')
+        logger.info(f"Backing off {key} ({reason}): delay {state.delay:.2f}s, concurrency {state.concurrency}")
+
+    def _apply(self, key: str, slot, state: SlotState):
+        slot.delay = state.delay
+        slot.concurrency = state.concurrency
+        self.stats.set_value(f'adaptive_rate/slot/{key}/delay', round(state.delay, 3))
+        self.stats.set_value(f'adaptive_rate/slot/{key}/concurrency', state.concurrency)
+        self.stats.max_value(f'adaptive_rate/slot/{key}/delay_max', round(state.delay, 3))
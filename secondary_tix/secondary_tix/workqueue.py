@@ -0,0 +1,261 @@
+# Shared work queue of the distributed mode (see distributed.py)
+#
+# A SQLite database that every process of a run opens (put it on a shared drive to spread a
+# run over several machines). The coordinator puts the tasks of a run, the workers lease them:
+# a leased task is invisible to the other workers until its lease expires, so the tasks of a
+# worker that dies are crawled again by another one. Workers ack the tasks they are done with.
+#
+#   runs     one row per run, sealed once the coordinator found every event
+#   tasks    pending -> leased -> done, or failed after WORKQUEUE_MAX_ATTEMPTS leases
+#   workers  the workers of a run, the last one to close merges the outputs
+
+import json
+import time
+import sqlite3
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run TEXT NOT NULL,
+    spider TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    sealed INTEGER NOT NULL DEFAULT 0,
+    merged INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run, spider)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    run TEXT NOT NULL,
+    spider TEXT NOT NULL,
+    key TEXT NOT NULL,
+    task TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    UNIQUE (run, spider, key)
+);
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (run, spider, status, lease_until);
+CREATE TABLE IF NOT EXISTS workers (
+    run TEXT NOT NULL,
+    spider TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    opened_at REAL NOT NULL,
+    closed_at REAL,
+    PRIMARY KEY (run, spider, worker)
+);
+"""
+
+
+class WorkQueue:
+    """
+    Tasks of the runs of one spider, see the top of the module
+    Every write is its own short transaction, so many processes can share the database
+    """
+
+    def __init__(self, path, spider_name: str, max_attempts: int=3):
+        """
+        path: path of the SQLite database file
+        spider_name: name of the spider the tasks are for
+        max_attempts: leases of a task before it is marked as failed
+        """
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.spider_name = spider_name
+        self.max_attempts = max_attempts
+        # Autocommit, transactions are opened with BEGIN IMMEDIATE where they are needed
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def create_run(self, run: str):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO runs (run, spider, created_at) VALUES (?, ?, ?)",
+            (run, self.spider_name, time.time())
+        )
+
+    def latest_run(self):
+        """
+        Most recent run of the spider that isn't merged yet, None if there is none
+        """
+
+        row = self.conn.execute(
+            "SELECT run FROM runs WHERE spider = ? AND merged = 0 ORDER BY created_at DESC LIMIT 1",
+            (self.spider_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def seal(self, run: str):
+        """
+        Mark that every task of the run was put, workers stop once the run is drained
+        """
+
+        self.conn.execute("UPDATE runs SET sealed = 1 WHERE run = ? AND spider = ?", (run, self.spider_name))
+
+    def put(self, run: str, key: str, task: dict) -> bool:
+        """
+        Add a task to a run
+
+        run: run the task is part of
+        key: unique key of the task in the run, a task that was already put is ignored
+        task: JSON serializable task
+        return: True if the task was added
+        """
+
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO tasks (run, spider, key, task) VALUES (?, ?, ?, ?)",
+            (run, self.spider_name, key, json.dumps(task))
+        )
+        return cursor.rowcount == 1
+
+    def lease(self, run: str, worker: str, limit: int, visibility_timeout: float) -> list[tuple[int, dict]]:
+        """
+        Lease pending tasks and tasks whose lease expired
+
+        run: run to lease the tasks of
+        worker: id of the worker leasing them
+        limit: max # of tasks to lease
+        visibility_timeout: seconds before the tasks can be leased by another worker
+        return: list of (task id, task)
+        """
+
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases of tasks out of attempts won't be retried
+            self.conn.execute(
+                """
+                UPDATE tasks SET status = 'failed', worker = NULL, lease_until = NULL
+                WHERE run = ? AND spider = ? AND status = 'leased' AND lease_until < ? AND attempts >= ?
+                """,
+                (run, self.spider_name, now, self.max_attempts)
+            )
+            rows = self.conn.execute(
+                """
+                SELECT id, task FROM tasks
+                WHERE run = ? AND spider = ?
+                    AND (status = 'pending' OR (status = 'leased' AND lease_until < ?))
+                ORDER BY id LIMIT ?
+                """,
+                (run, self.spider_name, now, limit)
+            ).fetchall()
+            self.conn.executemany(
+                """
+                UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1
+                WHERE id = ?
+                """,
+                [(worker, now + visibility_timeout, task_id) for task_id, _ in rows]
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [(task_id, json.loads(task)) for task_id, task in rows]
+
+    def extend(self, task_ids: list[int], worker: str, visibility_timeout: float):
+        """
+        Push back the lease of tasks the worker is still crawling
+        """
+
+        lease_until = time.time() + visibility_timeout
+        self.conn.executemany(
+            "UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            [(lease_until, task_id, worker) for task_id in task_ids]
+        )
+
+    def ack(self, task_id: int, worker: str):
+        self.conn.execute(
+            "UPDATE tasks SET status = 'done', lease_until = NULL WHERE id = ? AND worker = ?",
+            (task_id, worker)
+        )
+
+    def release(self, task_id: int, worker: str):
+        """
+        Give a task back after a failure, it is marked as failed once out of attempts
+        """
+
+        self.conn.execute(
+            """
+            UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                worker = NULL, lease_until = NULL
+            WHERE id = ? AND worker = ? AND status = 'leased'
+            """,
+            (self.max_attempts, task_id, worker)
+        )
+
+    def counts(self, run: str) -> dict:
+        """
+        # of tasks of the run per status
+        """
+
+        rows = self.conn.execute(
+            "SELECT status, COUNT(*) FROM tasks WHERE run = ? AND spider = ? GROUP BY status",
+            (run, self.spider_name)
+        ).fetchall()
+        return {"pending": 0, "leased": 0, "done": 0, "failed": 0, **dict(rows)}
+
+    def run_state(self, run: str):
+        """
+        (sealed, merged) of a run, None if the coordinator didn't create it yet
+        """
+
+        row = self.conn.execute(
+            "SELECT sealed, merged FROM runs WHERE run = ? AND spider = ?", (run, self.spider_name)
+        ).fetchone()
+        return (bool(row[0]), bool(row[1])) if row else None
+
+    def drained(self, run: str) -> bool:
+        """
+        True once the run is sealed and every task is done or failed
+        """
+
+        state = self.run_state(run)
+        if state is None or not state[0]:
+            return False
+        counts = self.counts(run)
+        return counts["pending"] == 0 and counts["leased"] == 0
+
+    def open_worker(self, run: str, worker: str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO workers (run, spider, worker, opened_at) VALUES (?, ?, ?, ?)",
+            (run, self.spider_name, worker, time.time())
+        )
+
+    def close_worker(self, run: str, worker: str) -> bool:
+        """
+        Mark a worker as closed
+
+        return: True if it was the last open worker of a drained run, the caller then merges
+            the outputs (the run is marked as merged so only one worker does it)
+        """
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                "UPDATE workers SET closed_at = ? WHERE run = ? AND spider = ? AND worker = ?",
+                (time.time(), run, self.spider_name, worker)
+            )
+            still_open = self.conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE run = ? AND spider = ? AND closed_at IS NULL",
+                (run, self.spider_name)
+            ).fetchone()[0]
+            merge = still_open == 0 and self.drained(run)
+            if merge:
+                cursor = self.conn.execute(
+                    "UPDATE runs SET merged = 1 WHERE run = ? AND spider = ? AND merged = 0",
+                    (run, self.spider_name)
+                )
+                merge = cursor.rowcount == 1
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return merge
@@ -0,0 +1,7 @@
+# Run from the root of the repo:
+#   python -m pytest -q
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "secondary_tix"))
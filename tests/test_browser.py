@@ -0,0 +1,45 @@
+# Browser settings (browser.py) read from the crawler settings
+
+import os
+from types import SimpleNamespace
+
+import pytest
+from scrapy.crawler import Crawler
+from scrapy.utils.project import get_project_settings
+
+from secondary_tix import browser
+from secondary_tix.spiders.gametime import GametimeSpider
+from secondary_tix.spiders.vivid import VividSpider
+
+
+def crawler_settings(**overrides):
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "secondary_tix.settings")
+    settings = get_project_settings()
+    settings.setdict({"TWISTED_REACTOR": None, "LOG_QUEUE_ENABLED": False, **overrides}, priority="cmdline")
+    return settings
+
+
+def test_context_pool_follows_the_crawler_settings():
+    crawler = Crawler(GametimeSpider, crawler_settings(PLAYWRIGHT_CONTEXT_POOL_SIZE=4))
+    contexts = {browser.playwright_meta(crawler.settings)["playwright_context"] for _ in range(8)}
+    assert contexts == {"pool-0", "pool-1", "pool-2", "pool-3"}
+
+
+def test_pool_larger_than_max_contexts_is_refused():
+    with pytest.raises(ValueError, match="PLAYWRIGHT_MAX_CONTEXTS"):
+        Crawler(GametimeSpider, crawler_settings(PLAYWRIGHT_CONTEXT_POOL_SIZE=4, PLAYWRIGHT_MAX_CONTEXTS=2))
+
+
+def test_blocked_resources_follow_the_crawler_settings():
+    Crawler(GametimeSpider, crawler_settings(PLAYWRIGHT_BLOCKED_URL_PATTERNS=[r"example\.com"]))
+    assert browser.abort_request(SimpleNamespace(resource_type="image", url="https://gametime.co/a.png"))
+    assert browser.abort_request(SimpleNamespace(resource_type="script", url="https://example.com/a.js"))
+    assert not browser.abort_request(SimpleNamespace(resource_type="script", url="https://gametime.co/a.js"))
+
+
+def test_only_the_gametime_spider_starts_playwright():
+    # scrapy-playwright downloads the requests without the playwright meta key with Scrapy's HTTP handler
+    handlers = Crawler(GametimeSpider, crawler_settings()).settings.getwithbase("DOWNLOAD_HANDLERS")
+    assert handlers["https"] == "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler"
+    handlers = Crawler(VividSpider, crawler_settings()).settings.getwithbase("DOWNLOAD_HANDLERS")
+    assert handlers["https"] == "scrapy.core.downloader.handlers.http.HTTPDownloadHandler"
@@ -0,0 +1,125 @@
+# Delta snapshots (delta.py): a checkpoint, then deltas, rebuilt with reconstruct_snapshot
+
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from scrapy import signals, Request
+from scrapy.http import TextResponse
+from scrapy.utils.test import get_crawler
+
+from secondary_tix import delta
+from secondary_tix.items import EVENT_LISTING_HEADERS, event_parsed
+from secondary_tix.pipelines import DeltaSnapshotPipeline
+
+EVENT_DATE_STR = "20230729"
+
+
+def listing(section: str, row: str, quantity: int, price: str, listing_id: str=None) -> dict:
+    return {
+        "event_date": "2023-07-29",
+        "opponent": "Giants",
+        "section": section,
+        "row": row,
+        "quantity": quantity,
+        "price": Decimal(price),
+        "listing_valid_as_of": datetime(2023, 7, 29, 12, 0, 0),
+        "listing_id": listing_id,
+    }
+
+
+def as_rows(listings: list[dict]) -> list[tuple]:
+    """
+    Listings as sorted rows of strings, the way reconstruct_snapshot reads them back from the CSVs
+    """
+
+    return sorted(tuple(str(x[header]) for header in EVENT_LISTING_HEADERS) for x in listings)
+
+
+def save(tmp_path, file_timestamp: str, listings: list[dict]) -> str:
+    kind, _ = delta.save_delta_snapshot(tmp_path, file_timestamp, "vivid", EVENT_DATE_STR, listings, 3)
+    return kind
+
+
+def test_reconstruct_snapshot_round_trip(tmp_path):
+    snapshots = {
+        "202307291200": [
+            listing("112", "5", 2, "100", "a"),
+            listing("112", "5", 2, "120.50", "b"),
+            # Listings without an id in the same section / row / quantity, two of them at the same price
+            listing("Section 3", "1", 4, "80"),
+            listing("Section 3", "1", 4, "80"),
+            listing("Section 3", "1", 4, "95"),
+        ],
+        "202307291210": [
+            # b changed price, a was sold and c was added
+            listing("112", "5", 2, "110", "b"),
+            listing("140", "2", 2, "60", "c"),
+            # One of the duplicates was sold and the other one is cheaper
+            listing("Section 3", "1", 4, "75"),
+            listing("Section 3", "1", 4, "95"),
+        ],
+        "202307291220": [
+            listing("112", "5", 2, "110", "b"),
+            listing("140", "2", 2, "60", "c"),
+            listing("Section 3", "1", 4, "75"),
+            listing("Section 3", "1", 4, "75"),
+            listing("Section 3", "1", 4, "95"),
+        ],
+        # Checkpoint again, DELTA_CHECKPOINT_EVERY is 3
+        "202307291230": [
+            listing("140", "2", 2, "65", "c"),
+            listing("Section 3", "1", 4, "75"),
+        ],
+    }
+
+    kinds = [save(tmp_path, file_timestamp, listings) for file_timestamp, listings in snapshots.items()]
+    assert kinds == ["checkpoint", "delta", "delta", "checkpoint"]
+
+    for file_timestamp, listings in snapshots.items():
+        rebuilt = delta.reconstruct_snapshot(tmp_path, "vivid", EVENT_DATE_STR, file_timestamp)
+        assert as_rows(rebuilt) == as_rows(listings), file_timestamp
+
+
+def test_unchanged_listings_write_an_empty_delta(tmp_path):
+    listings = [listing("Section 3", "1", 4, "80"), listing("Section 3", "1", 4, "80")]
+    save(tmp_path, "202307291200", listings)
+    kind, records = delta.save_delta_snapshot(tmp_path, "202307291210", "vivid", EVENT_DATE_STR, listings, 3)
+    assert (kind, records) == ("delta", 0)
+    rebuilt = delta.reconstruct_snapshot(tmp_path, "vivid", EVENT_DATE_STR, "202307291210")
+    assert as_rows(rebuilt) == as_rows(listings)
+
+
+def test_event_without_listings_removes_its_last_listings(tmp_path):
+    save(tmp_path, "202307291200", [listing("112", "5", 2, "100", "a"), listing("140", "2", 2, "60", "c")])
+    assert delta.save_delta_snapshot(tmp_path, "202307291210", "vivid", EVENT_DATE_STR, [], 3) == ("delta", 2)
+    assert delta.reconstruct_snapshot(tmp_path, "vivid", EVENT_DATE_STR, "202307291210") == []
+
+
+def test_new_event_without_listings_writes_nothing(tmp_path):
+    assert delta.save_delta_snapshot(tmp_path, "202307291200", "vivid", EVENT_DATE_STR, [], 3) == (None, 0)
+    assert not (tmp_path / "output").exists()
+
+
+def test_pipeline_writes_a_delta_for_an_event_that_came_back_empty(tmp_path):
+    crawler = get_crawler(settings_dict={"DELTA_SNAPSHOTS_ENABLED": True, "OUTPUT_DIRECTORY": tmp_path})
+    pipeline = DeltaSnapshotPipeline.from_crawler(crawler)
+    spider = SimpleNamespace(name="vivid", file_timestamp="202307291200", batch=False)
+    response = TextResponse(
+        "https://www.vividseats.com/hermes/api/v1/listings?productionId=1",
+        request=Request("https://www.vividseats.com/hermes/api/v1/listings?productionId=1", meta={"event_date": "2023-07-29"}),
+    )
+
+    listings = [listing("112", "5", 2, "100", "a"), listing("140", "2", 2, "60", "c")]
+    for item in listings:
+        pipeline.process_item(item, spider)
+    crawler.signals.send_catch_log(event_parsed, spider=spider, response=response, listings=len(listings))
+    crawler.signals.send_catch_log(signals.spider_closed, spider=spider)
+
+    # Sold out on the next run, no item comes through
+    spider.file_timestamp = "202307291210"
+    crawler.signals.send_catch_log(event_parsed, spider=spider, response=response, listings=0)
+    crawler.signals.send_catch_log(signals.spider_closed, spider=spider)
+
+    assert as_rows(delta.reconstruct_snapshot(tmp_path, "vivid", EVENT_DATE_STR, "202307291200")) == as_rows(listings)
+    assert delta.reconstruct_snapshot(tmp_path, "vivid", EVENT_DATE_STR, "202307291210") == []
@@ -0,0 +1,27 @@
+# Listings read from the Gametime event pages (spiders/gametime.py)
+
+from decimal import Decimal, InvalidOperation
+
+import pytest
+
+from secondary_tix.spiders.gametime import GametimeSpider
+
+
+@pytest.fixture
+def spider():
+    return GametimeSpider(team="dodgers")
+
+
+def test_displayed_prices_are_read(spider):
+    listings = spider.parse_listings(
+        [("Section 112, Row 5", "$1,234/ea"), ("Field Box 12, Row 5", " $85 ")], 2, "2023-07-29", "giants"
+    )
+    assert [(listing.section, listing.row, listing.price) for listing in listings] == [
+        ("Section 112", "5", Decimal("1234")), ("Field Box 12", "5", Decimal("85")),
+    ]
+
+
+@pytest.mark.parametrize("price", ["Free", "$1,234/each", "€85/ea"])
+def test_unexpected_prices_fail(spider, price):
+    with pytest.raises(InvalidOperation):
+        spider.parse_listings([("Section 112, Row 5", price)], 2, "2023-07-29", "giants")
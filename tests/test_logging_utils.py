@@ -0,0 +1,29 @@
+# Queue logging (logging_utils.py)
+
+import queue
+import logging
+
+from secondary_tix.items import ListingRecord
+from secondary_tix.logging_utils import DeferredFormatQueueHandler
+
+
+def test_arguments_are_merged_when_the_record_is_logged():
+    records = queue.SimpleQueue()
+    logger = logging.getLogger("tests.logging_utils")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = DeferredFormatQueueHandler(records)
+    logger.addHandler(handler)
+    try:
+        listing = ListingRecord("2023-07-29", "Giants", "112", "5", 2, 100, None)
+        logger.debug("event_listing = %r", listing)
+        # Set after the call, like the team of the Gametime listings
+        listing.team = "dodgers"
+    finally:
+        logger.removeHandler(handler)
+
+    record = records.get_nowait()
+    assert record.args is None
+    assert "team=None" in record.getMessage()
+    # Still formatted by the listener's handlers
+    assert logging.Formatter("%(levelname)s %(message)s").format(record).startswith("DEBUG event_listing = ListingRecord(")
@@ -0,0 +1,38 @@
+# Parquet output (utility.save_to_parquet / read_parquet_snapshots), needs pyarrow
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from secondary_tix.spiders import utility
+
+
+def listings(price: float, team: str=None) -> list[dict]:
+    return [{
+        "event_date": "2023-07-29",
+        "opponent": "Giants",
+        "section": "112",
+        "row": "5",
+        "quantity": 2,
+        "price": price,
+        "listing_valid_as_of": datetime(2023, 7, 29, 12, 0, 0),
+        "team": team,
+    }]
+
+
+def test_batch_teams_on_the_same_date_get_their_own_files(tmp_path):
+    utility.save_to_parquet(tmp_path, "202307291200", "vivid", "2023-07-29", listings(100, "dodgers"), team="dodgers")
+    utility.save_to_parquet(tmp_path, "202307291200", "vivid", "2023-07-29", listings(80, "angels"), team="angels")
+
+    assert len(list((tmp_path / "output/parquet/spider=vivid").rglob("*.parquet"))) == 2
+    table = utility.read_parquet_snapshots(tmp_path, "vivid", "2023-07-29", team="angels")
+    assert table.column("price").to_pylist() == [80]
+    assert sorted(utility.read_parquet_snapshots(tmp_path, "vivid", "2023-07-29").column("team").to_pylist()) == ["angels", "dodgers"]
+
+
+def test_single_team_layout_is_unchanged(tmp_path):
+    utility.save_to_parquet(tmp_path, "202307291200", "gametime", "2023-07-29", listings(100))
+    assert (tmp_path / "output/parquet/spider=gametime/event_date=2023-07-29/202307291200.parquet").exists()
+    assert utility.read_parquet_snapshots(tmp_path, "gametime").column("price").to_pylist() == [100]
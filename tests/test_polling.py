@@ -0,0 +1,55 @@
+# Runs of the polling daemon (polling.py) next to the runs of one-off crawls
+
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from secondary_tix import delta
+from secondary_tix.polling import poll_run
+from secondary_tix.spiders.gametime import GametimeSpider
+
+
+@pytest.fixture
+def local_time_behind_utc(monkeypatch):
+    """
+    Run the test in a timezone behind UTC, where local and UTC run ids sort the wrong way round
+    """
+
+    monkeypatch.setenv("TZ", "America/Los_Angeles")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def listing(price: str) -> dict:
+    return {
+        "event_date": "2023-07-29",
+        "opponent": "Giants",
+        "section": "Section 112",
+        "row": "5",
+        "quantity": 2,
+        "price": Decimal(price),
+        "listing_valid_as_of": datetime(2023, 7, 29, 12, 0, 0),
+    }
+
+
+def test_daemon_runs_sort_after_earlier_one_off_runs(local_time_behind_utc):
+    one_off_run = GametimeSpider(team="dodgers").file_timestamp
+    daemon_run = poll_run()
+    assert one_off_run <= daemon_run
+    assert daemon_run[:len(one_off_run)] == one_off_run
+
+
+def test_delta_chain_over_one_off_and_daemon_runs(tmp_path, local_time_behind_utc):
+    # A one-off crawl writes the checkpoint, the daemon polls the event right after
+    one_off_run = GametimeSpider(team="dodgers").file_timestamp
+    delta.save_delta_snapshot(tmp_path, one_off_run, "gametime", "20230729", [listing("100")], 12)
+    daemon_run = poll_run()
+    kind, _ = delta.save_delta_snapshot(tmp_path, daemon_run, "gametime", "20230729", [listing("90")], 12)
+    assert kind == "delta"
+
+    rebuilt = delta.reconstruct_snapshot(tmp_path, "gametime", "20230729", daemon_run)
+    assert [x["price"] for x in rebuilt] == ["90"]
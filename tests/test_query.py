@@ -0,0 +1,94 @@
+# Listing history store (store.py) and its lookups (query.py) against a temporary SQLite file
+
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from secondary_tix import store, query
+
+
+def listing(price: float, team: str=None, section: str="Section 112") -> dict:
+    return {
+        "event_date": "2023-07-29",
+        "opponent": "Giants",
+        "section": section,
+        "row": "5",
+        "quantity": 2,
+        "price": price,
+        "listing_valid_as_of": datetime(2023, 7, 29, 12, 0, 0),
+        "team": team,
+    }
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = store.connect(tmp_path / "listings.sqlite")
+    yield conn
+    conn.close()
+
+
+def insert(conn, spider_name: str, run: str, listings: list[dict]):
+    store.insert_listings(conn, [store.listing_row(spider_name, run, x) for x in listings])
+
+
+def test_batch_teams_on_the_same_date_are_kept_apart(conn):
+    # Both teams play on 2023-07-29 and were crawled by the same batch run
+    insert(conn, "vivid", "20230729120000", [listing(100, "dodgers"), listing(80, "angels")])
+    insert(conn, "vivid", "20230729130000", [listing(90, "dodgers")])
+
+    assert query.latest_run(conn, "vivid", "2023-07-29", team="angels") == "20230729120000"
+    assert [x[3] for x in query.latest_snapshot(conn, "vivid", "2023-07-29", team="angels")] == [80]
+    assert [x[1] for x in query.price_history(conn, "vivid", "2023-07-29", "Section 112", team="dodgers")] == [100, 90]
+    assert [x[1:] for x in query.snapshot_price_stats(conn, "vivid", "2023-07-29", team="dodgers")] == [
+        (100, 100, 1), (90, 90, 1)
+    ]
+    # Without a team every team is read
+    assert [x[3] for x in query.snapshot_price_stats(conn, "vivid", "2023-07-29")] == [2, 1]
+
+
+def test_store_without_team_column_is_upgraded(tmp_path):
+    path = tmp_path / "listings.sqlite"
+    old = sqlite3.connect(path)
+    old.executescript(
+        """
+        CREATE TABLE listings (
+            spider TEXT NOT NULL, run TEXT NOT NULL, event_date TEXT NOT NULL, opponent TEXT, section TEXT,
+            row TEXT, quantity INTEGER, price REAL, listing_valid_as_of TEXT NOT NULL
+        );
+        CREATE INDEX listings_by_run ON listings (spider, event_date, run, price);
+        INSERT INTO listings VALUES ('vivid', '20230729120000', '2023-07-29', 'Giants', '112', '5', 2, 50, '2023-07-29 12:00:00');
+        """
+    )
+    old.close()
+
+    conn = store.connect(path)
+    try:
+        insert(conn, "vivid", "20230729130000", [listing(60, "dodgers")])
+        assert [x[3] for x in query.snapshot_price_stats(conn, "vivid", "2023-07-29")] == [1, 1]
+        assert [x[0] for x in query.snapshot_price_stats(conn, "vivid", "2023-07-29", team="dodgers")] == ["20230729130000"]
+        index_columns = [x[2] for x in conn.execute("PRAGMA index_info(listings_by_run)")]
+        assert index_columns == ["spider", "event_date", "run", "price", "team"]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("since, runs", [
+    # A date keeps every run of that day, whatever the length of the run
+    ("2023-07-24", ["202307241529", "20230724152959", "202307241530", "20230724153000", "20230725090000"]),
+    ("20230724", ["202307241529", "20230724152959", "202307241530", "20230724153000", "20230725090000"]),
+    # A time is compared down to the minute for the 12 character (Gametime) runs
+    ("2023-07-24 15:30:00", ["202307241530", "20230724153000", "20230725090000"]),
+    ("20230724153000", ["202307241530", "20230724153000", "20230725090000"]),
+    ("2023-07-24 15:30:30", ["202307241530", "20230725090000"]),
+    # A partial time is a prefix
+    ("2023-07-24 15", ["202307241529", "20230724152959", "202307241530", "20230724153000", "20230725090000"]),
+    ("2023-07-24 16", ["20230725090000"]),
+])
+def test_since_with_runs_of_different_lengths(conn, since, runs):
+    # Gametime runs are YYYYMMDDHHMM, Vivid and polling daemon runs YYYYMMDDHHMMSS
+    for run in ["202307231200", "20230723235959", "202307241529", "20230724152959", "202307241530", "20230724153000", "20230725090000"]:
+        insert(conn, "vivid", run, [listing(100)])
+
+    assert [x[0] for x in query.snapshot_price_stats(conn, "vivid", "2023-07-29", since=since)] == runs
+    assert len(query.price_history(conn, "vivid", "2023-07-29", "Section 112", since=since)) == len(runs)
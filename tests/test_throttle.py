@@ -0,0 +1,60 @@
+# Download slots of the AdaptiveRateController (throttle.py)
+
+import os
+
+import pytest
+import scrapy
+from scrapy.crawler import Crawler
+from scrapy.utils.project import get_project_settings
+
+from secondary_tix.throttle import AdaptiveRateController
+from secondary_tix.spiders.gametime import GametimeSpider
+
+EVENT_HREF = "/mlb-baseball/giants-at-dodgers-tickets-7-29-2023-los-angeles-ca-dodger-stadium/events/abc123"
+
+
+def make_crawler(**overrides) -> Crawler:
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "secondary_tix.settings")
+    settings = get_project_settings()
+    settings.setdict({"TWISTED_REACTOR": None, "LOG_QUEUE_ENABLED": False, "ADAPTIVE_RATE_ENABLED": True})
+    settings.setdict(overrides, priority="cmdline")
+    return Crawler(GametimeSpider, settings)
+
+
+@pytest.fixture
+def crawler():
+    return make_crawler()
+
+
+def controller(crawler) -> AdaptiveRateController:
+    return next(x for x in crawler.extensions.middlewares if isinstance(x, AdaptiveRateController))
+
+
+def test_scheduled_requests_get_a_slot_per_request_class(crawler):
+    spider = GametimeSpider.from_crawler(crawler, team="dodgers")
+    requests = [
+        spider.event_page_request(EVENT_HREF, "dodgers"),
+        scrapy.Request("https://gametime.co/v1/listings", meta={"request_class": "api"}),
+        scrapy.Request("https://gametime.co/robots.txt"),
+    ]
+    for request in requests:
+        controller(crawler).request_scheduled(request, spider)
+    assert [x.meta["download_slot"] for x in requests] == ["gametime.co:browser", "gametime.co:api", "gametime.co:http"]
+
+
+def test_sweep_requests_land_in_the_browser_slot(crawler):
+    spider = GametimeSpider.from_crawler(crawler, team="dodgers")
+    event_page = spider.event_page_request(EVENT_HREF, "dodgers")
+    controller(crawler).request_scheduled(event_page, spider)
+
+    # Downloaded with engine.download, request_scheduled is never sent for it
+    sweep = spider.sweep_request(event_page.url)
+    assert sweep.meta["download_slot"] == event_page.meta["download_slot"] == "gametime.co:browser"
+    assert controller(crawler).request_class(sweep) == "browser"
+
+
+def test_concurrent_requests_are_only_raised_by_the_controller():
+    assert make_crawler(ADAPTIVE_RATE_ENABLED=False).settings.getint("CONCURRENT_REQUESTS") == 2
+    assert make_crawler().settings.getint("CONCURRENT_REQUESTS") == 16
+    # The command line (and batch.py) still win
+    assert make_crawler(CONCURRENT_REQUESTS=4).settings.getint("CONCURRENT_REQUESTS") == 4
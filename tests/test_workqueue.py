@@ -0,0 +1,158 @@
+# Work queue of the distributed mode (workqueue.py, distributed.py) against a temporary SQLite file
+
+import csv
+
+import pytest
+
+from secondary_tix import workqueue
+from secondary_tix.distributed import merge_parts
+
+RUN = "202307291200"
+
+
+class Clock:
+    """
+    Stands in for time.time() so leases expire without waiting
+    """
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(workqueue.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = workqueue.WorkQueue(tmp_path / "workqueue.sqlite", "gametime", max_attempts=2)
+    queue.create_run(RUN)
+    yield queue
+    queue.close()
+
+
+def put_tasks(queue, n: int):
+    for i in range(n):
+        assert queue.put(RUN, f"event:{i}", {"event_id": str(i)})
+
+
+def test_put_ignores_a_task_already_put(queue):
+    put_tasks(queue, 1)
+    assert not queue.put(RUN, "event:0", {"event_id": "0"})
+    assert queue.counts(RUN)["pending"] == 1
+
+
+def test_leased_task_is_invisible_until_its_lease_expires(queue, clock):
+    put_tasks(queue, 2)
+    assert [task["event_id"] for _, task in queue.lease(RUN, "a", 1, 60)] == ["0"]
+    assert [task["event_id"] for _, task in queue.lease(RUN, "b", 10, 60)] == ["1"]
+    assert queue.lease(RUN, "b", 10, 60) == []
+
+    clock.now += 61
+    leased = queue.lease(RUN, "b", 10, 60)
+    assert [task["event_id"] for _, task in leased] == ["0", "1"]
+
+    # The first worker lost the task, its ack doesn't count
+    task_id = leased[0][0]
+    queue.ack(task_id, "a")
+    assert queue.counts(RUN) == {"pending": 0, "leased": 2, "done": 0, "failed": 0}
+    queue.ack(task_id, "b")
+    assert queue.counts(RUN)["done"] == 1
+
+
+def test_extend_pushes_back_the_lease(queue, clock):
+    put_tasks(queue, 1)
+    [(task_id, _)] = queue.lease(RUN, "a", 1, 60)
+    clock.now += 50
+    queue.extend([task_id], "a", 60)
+    clock.now += 50
+    assert queue.lease(RUN, "b", 1, 60) == []
+    clock.now += 11
+    assert len(queue.lease(RUN, "b", 1, 60)) == 1
+
+
+def test_expired_task_fails_after_max_attempts(queue, clock):
+    put_tasks(queue, 1)
+    for _ in range(queue.max_attempts):
+        assert len(queue.lease(RUN, "a", 1, 60)) == 1
+        clock.now += 61
+
+    assert queue.lease(RUN, "a", 1, 60) == []
+    assert queue.counts(RUN) == {"pending": 0, "leased": 0, "done": 0, "failed": 1}
+
+
+def test_released_task_fails_after_max_attempts(queue):
+    put_tasks(queue, 1)
+    [(task_id, _)] = queue.lease(RUN, "a", 1, 60)
+    queue.release(task_id, "a")
+    assert queue.counts(RUN)["pending"] == 1
+
+    [(task_id, _)] = queue.lease(RUN, "a", 1, 60)
+    queue.release(task_id, "a")
+    assert queue.counts(RUN) == {"pending": 0, "leased": 0, "done": 0, "failed": 1}
+
+
+def test_close_worker_merges_once(tmp_path, queue):
+    put_tasks(queue, 2)
+    queue.open_worker(RUN, "a")
+    queue.open_worker(RUN, "b")
+    for task_id, _ in queue.lease(RUN, "a", 10, 60):
+        queue.ack(task_id, "a")
+
+    # Not sealed, the coordinator can still put tasks
+    assert not queue.close_worker(RUN, "a")
+    queue.seal(RUN)
+    assert queue.drained(RUN)
+    # b is still open
+    assert not queue.close_worker(RUN, "a")
+
+    other = workqueue.WorkQueue(tmp_path / "workqueue.sqlite", "gametime")
+    try:
+        assert queue.close_worker(RUN, "b")
+        assert not queue.close_worker(RUN, "b")
+        assert not other.close_worker(RUN, "a")
+        assert other.run_state(RUN) == (True, True)
+    finally:
+        other.close()
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as file:
+        csv.writer(file).writerows(rows)
+
+
+def read_csv(path):
+    with open(path, newline="") as file:
+        return list(csv.reader(file))
+
+
+def test_merge_parts_writes_the_header_once(tmp_path):
+    header = ["event_date", "opponent", "section", "row", "quantity", "price", "listing_valid_as_of"]
+    rows = [
+        ["2023-07-29", "Giants", f"Section {i}", "5", "2", "100", "2023-07-29 12:00:00"]
+        for i in range(4)
+    ]
+    run_directory = tmp_path / "output/gametime" / RUN
+    team_directory = tmp_path / "output/gametime/dodgers" / RUN
+    for directory in (run_directory, team_directory):
+        directory.mkdir(parents=True)
+        write_csv(directory / "20230729.part-a.csv", [header, *rows[:2]])
+        write_csv(directory / "20230729.part-b.csv", [header, *rows[2:]])
+        # A worker that wrote no listings for the event
+        write_csv(directory / "20230729.part-c.csv", [])
+
+    assert merge_parts(tmp_path, "gametime", RUN) == 6
+    for directory in (run_directory, team_directory):
+        assert read_csv(directory / "20230729.csv") == [header, *rows]
+        assert list(directory.glob("*.part-*.csv")) == []
+
+    # Parts of a late worker are appended without another header
+    write_csv(run_directory / "20230729.part-d.csv", [header, rows[0]])
+    assert merge_parts(tmp_path, "gametime", RUN) == 1
+    assert read_csv(run_directory / "20230729.csv") == [header, *rows, rows[0]]